@@ -0,0 +1,209 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .images import content_hash, process_originals
+from .models import ImageBlob, ItemImage, DetailImage
+
+logger = logging.getLogger(__name__)
+
+BLOB_QUALITIES = ('low', 'medium')
+
+
+def blob_paths(blob):
+    """Every file under MEDIA_ROOT owned by a blob: the original and its variants"""
+    paths = [blob.path]
+    for variant in blob.variants.values():
+        paths.append(variant['path'])
+        paths.append(variant['webp_path'])
+    return paths
+
+
+def resolve_uploads(uploaded_files):
+    """
+    Map uploaded files to ImageBlob rows, processing only content not seen before.
+
+    Identical uploads (in this request or any earlier one) resolve to the same
+    blob, so their variants are generated and stored once.
+    Returns (blobs in upload order, number of originals actually processed).
+    """
+    originals = [uploaded_file.read() for uploaded_file in uploaded_files]
+    hashes = [content_hash(data) for data in originals]
+
+    blobs = ImageBlob.objects.in_bulk(set(hashes), field_name='sha256')
+    if blobs:
+        # Touch reused blobs so a concurrent garbage collection leaves them alone
+        ImageBlob.objects.filter(sha256__in=list(blobs)).update(updated_at=timezone.now())
+
+    missing = {}
+    for sha256, data in zip(hashes, originals):
+        if sha256 not in blobs:
+            missing.setdefault(sha256, data)
+
+    if missing:
+        results = process_originals(list(missing.values()))
+        ImageBlob.objects.bulk_create([
+            ImageBlob(
+                sha256=result['sha256'],
+                path=result['original']['path'],
+                width=result['original']['width'],
+                height=result['original']['height'],
+                byte_size=result['original']['byte_size'],
+                format=result['original']['format'],
+                dominant_color=result['original']['dominant_color'],
+                placeholder=result['original']['placeholder'],
+                variants=result['variants']
+            )
+            for result in results
+        ], ignore_conflicts=True)
+        # Re-read rather than trusting bulk_create, which can't return ids for
+        # rows a concurrent upload inserted first
+        blobs.update(ImageBlob.objects.in_bulk(list(missing), field_name='sha256'))
+
+    return [blobs[sha256] for sha256 in hashes], len(missing)
+
+
+def _media_path(url):
+    """Path relative to MEDIA_ROOT for a URL served from MEDIA_URL, or None"""
+    marker = settings.MEDIA_URL
+    if not url or marker not in url:
+        return None
+    return url.split(marker, 1)[1]
+
+
+def image_metadata(blob, variant=None):
+    """Precomputed metadata for a blob's original, or one of its variants"""
+    source = blob.variants[variant] if variant else blob
+    width = source['width'] if variant else source.width
+    height = source['height'] if variant else source.height
+    return {
+        'width': width,
+        'height': height,
+        'dominant_color': blob.dominant_color,
+        'placeholder': blob.placeholder,
+    }
+
+
+def resolve_media_urls(urls):
+    """
+    Map image URLs that point at locally stored files to (blob id, metadata).
+
+    Lets imports and admin edits that reference already stored images share the
+    existing blob (and its precomputed metadata) instead of being treated as
+    unrelated external URLs. One query regardless of how many URLs are passed.
+    """
+    paths = {}
+    for url in set(urls):
+        path = _media_path(url)
+        if path:
+            paths[path] = url
+    if not paths:
+        return {}
+
+    lookup = Q(path__in=list(paths))
+    for quality in BLOB_QUALITIES:
+        lookup |= Q(**{f'variants__{quality}__path__in': list(paths)})
+        lookup |= Q(**{f'variants__{quality}__webp_path__in': list(paths)})
+
+    resolved = {}
+    for blob in ImageBlob.objects.filter(lookup):
+        if blob.path in paths:
+            resolved[paths[blob.path]] = (blob.id, image_metadata(blob))
+        for quality, variant in blob.variants.items():
+            for path in (variant['path'], variant['webp_path']):
+                if path in paths:
+                    resolved[paths[path]] = (blob.id, image_metadata(blob, quality))
+    return resolved
+
+
+def attach_blobs(images):
+    """
+    Link unsaved ItemImage/DetailImage rows whose URL is a stored blob, and copy
+    the blob's precomputed metadata onto them.
+    """
+    resolved = resolve_media_urls([image.image_url for image in images])
+    for image in images:
+        if image.blob_id is None and image.image_url in resolved:
+            blob_id, metadata = resolved[image.image_url]
+            image.blob_id = blob_id
+            for field, value in metadata.items():
+                setattr(image, field, value)
+    return images
+
+
+def with_ref_counts(queryset):
+    """Annotate blobs with how many ItemImage and DetailImage rows reference them"""
+    def references(model):
+        return Coalesce(Subquery(
+            model.objects.filter(blob=OuterRef('pk')).order_by().values('blob').annotate(
+                total=Count('id')
+            ).values('total'),
+            output_field=IntegerField()
+        ), Value(0))
+
+    return queryset.annotate(
+        item_image_refs=references(ItemImage),
+        detail_image_refs=references(DetailImage)
+    )
+
+
+def collect_garbage(min_age=timedelta(hours=24), dry_run=False):
+    """
+    Delete blobs nobody references any more, along with their files.
+
+    Only blobs untouched for min_age are considered, so an upload that is
+    resolving to a blob right now can't lose it. Files are only removed when
+    no surviving blob shares them (variants are content-addressed too).
+    Returns a summary dict.
+    """
+    cutoff = timezone.now() - min_age
+    orphans = list(
+        with_ref_counts(ImageBlob.objects.filter(updated_at__lt=cutoff)).filter(
+            item_image_refs=0,
+            detail_image_refs=0
+        )
+    )
+    if not orphans:
+        return {'blobs': 0, 'files': 0, 'bytes': 0}
+
+    if not dry_run:
+        # Remove rows first; anything touched since the scan survives and keeps its files
+        orphan_ids = [blob.id for blob in orphans]
+        ImageBlob.objects.filter(id__in=orphan_ids, updated_at__lt=cutoff).delete()
+        survivors = set(ImageBlob.objects.filter(id__in=orphan_ids).values_list('id', flat=True))
+        orphans = [blob for blob in orphans if blob.id not in survivors]
+
+    orphan_ids = [blob.id for blob in orphans]
+    candidate_paths = {path for blob in orphans for path in blob_paths(blob)}
+
+    # Paths still used by surviving blobs must stay on disk
+    lookup = Q(path__in=list(candidate_paths))
+    for quality in BLOB_QUALITIES:
+        lookup |= Q(**{f'variants__{quality}__path__in': list(candidate_paths)})
+        lookup |= Q(**{f'variants__{quality}__webp_path__in': list(candidate_paths)})
+    live_paths = {
+        path
+        for blob in ImageBlob.objects.filter(lookup).exclude(id__in=orphan_ids)
+        for path in blob_paths(blob)
+    }
+
+    removed_files = 0
+    removed_bytes = 0
+    for path in candidate_paths - live_paths:
+        full_path = os.path.join(settings.MEDIA_ROOT, path)
+        if not os.path.exists(full_path):
+            continue
+        removed_bytes += os.path.getsize(full_path)
+        removed_files += 1
+        if not dry_run:
+            os.remove(full_path)
+
+    if not dry_run:
+        logger.info(f"Removed {len(orphan_ids)} orphaned image blobs ({removed_files} files)")
+
+    return {'blobs': len(orphan_ids), 'files': removed_files, 'bytes': removed_bytes}
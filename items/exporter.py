@@ -0,0 +1,123 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+
+from .inventory import with_stock_level
+from .models import Item, ItemImage, ItemSize, DetailImage
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+
+class _Echo:
+    """File-like object whose write() hands the formatted line straight back"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    """Yield CSV lines one at a time for a header and an iterable of rows"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(records):
+    """Yield one JSON document per line for an iterable of dicts"""
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_response(chunks, fmt, filename):
+    """Wrap a chunk generator in a StreamingHttpResponse download"""
+    content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
+
+def export_items_queryset():
+    """
+    Items with everything the export needs, read through a server-side cursor.
+
+    QuerySet.iterator(chunk_size=...) runs the prefetches once per chunk, so
+    memory stays bounded by the chunk size rather than the table size.
+    """
+    return Item.objects.select_related('details').prefetch_related(
+        Prefetch('sizes', queryset=with_stock_level(ItemSize.objects.all())),
+        'categories',
+        Prefetch('images', queryset=ItemImage.objects.order_by('-is_primary', 'id')),
+        Prefetch('detail_images', queryset=DetailImage.objects.order_by('display_order', 'id'))
+    ).order_by('id').iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+# Column names match what the catalog importer reads, so a CSV export can be
+# edited and fed back through import_catalog
+ITEM_CSV_HEADER = [
+    'id', 'name', 'price', 'description', 'color', 'detail', 'categories',
+    'sizes', 'total_stock', 'display_image', 'images', 'detail_images',
+    'created_at', 'updated_at',
+]
+
+
+def _item_record(item):
+    details = getattr(item, 'details', None)
+    sizes = list(item.sizes.all())
+    images = list(item.images.all())
+    display_image = next((img.image_url for img in images if img.is_primary and img.quality == 'low'), None)
+    return {
+        'id': item.id,
+        'name': item.name,
+        'price': str(item.price),
+        'description': item.description,
+        'color': details.color if details else None,
+        'detail': details.detail if details else None,
+        'categories': [cat.id for cat in item.categories.all()],
+        'sizes': [
+            {'id': size.id, 'size': size.size, 'quantity': size.stock_level}
+            for size in sizes
+        ],
+        'total_stock': sum(size.stock_level for size in sizes),
+        'display_image': display_image,
+        'images': [img.image_url for img in images if img.quality == 'medium'],
+        'detail_images': [img.image_url for img in item.detail_images.all()],
+        'created_at': item.created_at,
+        'updated_at': item.updated_at,
+    }
+
+
+def iter_item_records():
+    for item in export_items_queryset():
+        yield _item_record(item)
+
+
+def iter_item_csv_rows():
+    for record in iter_item_records():
+        yield [
+            record['id'],
+            record['name'],
+            record['price'],
+            record['description'] or '',
+            record['color'] or '',
+            record['detail'] or '',
+            ';'.join(str(category_id) for category_id in record['categories']),
+            ';'.join(f"{size['size']}:{size['quantity']}" for size in record['sizes']),
+            record['total_stock'],
+            record['display_image'] or '',
+            ';'.join(record['images']),
+            ';'.join(record['detail_images']),
+            record['created_at'].isoformat(),
+            record['updated_at'].isoformat(),
+        ]
+
+
+def stream_items(fmt):
+    """Generator of export chunks for the whole catalog"""
+    if fmt == 'csv':
+        return stream_csv(ITEM_CSV_HEADER, iter_item_csv_rows())
+    return stream_jsonl(iter_item_records())
@@ -0,0 +1,303 @@
+import base64
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import urllib.request
+from urllib.parse import unquote, urlparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Bounding boxes for the generated variants, matching ItemImage.quality
+VARIANT_SIZES = {
+    'low': (400, 400),
+    'medium': (1200, 1200),
+}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+MEDIA_SUBDIR = 'items'
+POOL_WORKERS = int(os.getenv('IMAGE_POOL_WORKERS', '2'))
+PROCESS_TIMEOUT = 60
+PLACEHOLDER_SIZE = (16, 16)
+DOWNLOAD_TIMEOUT = 10
+
+_pool = None
+
+
+class ImageProcessingError(Exception):
+    pass
+
+
+def get_pool():
+    """
+    Process pool shared by every request handled by this worker.
+
+    Workers are spawned rather than forked so they never inherit the parent's
+    database connections or request threads.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=POOL_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+def _discard_pool(pool):
+    """
+    Shut down a pool that failed or timed out, without waiting for it, and
+    stop handing it out. Queued tasks are cancelled; a worker still busy
+    exits once its current task ends.
+    """
+    global _pool
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if _pool is pool:
+        _pool = None
+
+
+def content_hash(data):
+    """SHA-256 hex digest identifying a file by its content"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _store(data, extension, media_root, subdir=MEDIA_SUBDIR):
+    """
+    Write bytes under a name derived from their SHA-256 and return the relative path.
+
+    Identical output is written once; later uploads of the same image reuse the file.
+    """
+    digest = content_hash(data)
+    relative_path = f'{subdir}/{digest[:2]}/{digest}.{extension}'
+    full_path = os.path.join(media_root, relative_path)
+    if not os.path.exists(full_path):
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = f'{full_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, full_path)
+    return relative_path
+
+
+def _encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def _open_rgb(data):
+    """
+    Decode image bytes into an upright RGB image.
+
+    Returns (image, source format). Transparency is flattened onto white
+    rather than letting it turn black.
+    """
+    with Image.open(io.BytesIO(data)) as opened:
+        source_format = (opened.format or 'bin').lower()
+        image = ImageOps.exif_transpose(opened)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+    return image, source_format
+
+
+def dominant_color(image):
+    """Most common colour of a small quantized copy, as '#rrggbb'"""
+    small = image.copy()
+    small.thumbnail((64, 64))
+    quantized = small.quantize(colors=5)
+    palette = quantized.getpalette()
+    _, index = max(quantized.getcolors())
+    red, green, blue = palette[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def placeholder(image):
+    """Tiny JPEG of the image as a base64 data URI, for blur-up placeholders"""
+    tiny = image.copy()
+    tiny.thumbnail(PLACEHOLDER_SIZE)
+    data = _encode(tiny, 'JPEG', quality=50, optimize=True)
+    return 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
+
+
+def describe_image(data):
+    """Width, height, dominant colour and placeholder of one image"""
+    try:
+        image, _ = _open_rgb(data)
+        with image:
+            return {
+                'width': image.width,
+                'height': image.height,
+                'dominant_color': dominant_color(image),
+                'placeholder': placeholder(image),
+            }
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        raise ImageProcessingError(f'Invalid image: {e}')
+
+
+def local_media_file(url, media_root, media_url):
+    """
+    Absolute path of the file under media_root that url is served from, or
+    None when it isn't a MEDIA_URL URL: the URL's path must start with
+    MEDIA_URL's path, and its host must match when MEDIA_URL is absolute.
+    Raises ImageProcessingError for a path leading outside media_root.
+    """
+    media = urlparse(media_url)
+    parsed = urlparse(url)
+    if media.netloc and (parsed.scheme, parsed.netloc) != (media.scheme, media.netloc):
+        return None
+    if not parsed.path.startswith(media.path):
+        return None
+
+    root = os.path.realpath(media_root)
+    path = os.path.realpath(os.path.join(root, unquote(parsed.path[len(media.path):]).lstrip('/')))
+    if os.path.commonpath([root, path]) != root:
+        raise ImageProcessingError(f'Path outside MEDIA_ROOT: {url}')
+    return path
+
+
+def describe_url(url, media_root, media_url):
+    """
+    Fetch one image (from MEDIA_ROOT when it's stored locally) and describe it.
+
+    Runs inside a pool worker. Returns (url, metadata or None, error or None).
+    """
+    try:
+        path = local_media_file(url, media_root, media_url)
+        if path is not None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        else:
+            with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response:
+                data = response.read()
+        return url, describe_image(data), None
+    except Exception as e:
+        return url, None, str(e)
+
+
+def describe_urls(urls):
+    """
+    Describe many images in the process pool.
+
+    Yields (url, metadata or None, error or None) as results complete, once
+    per URL. If the pool breaks or times out part way, it is shut down,
+    results it did finish are still yielded and only the remaining URLs are
+    described in-process.
+    """
+    media_root = str(settings.MEDIA_ROOT)
+    completed = set()
+    futures = []
+    pool = None
+    try:
+        pool = get_pool()
+        futures = [pool.submit(describe_url, url, media_root, settings.MEDIA_URL) for url in urls]
+        for future in as_completed(futures, timeout=PROCESS_TIMEOUT):
+            result = future.result()
+            completed.add(result[0])
+            yield result
+    except Exception as e:
+        logger.warning(f"Image pool unavailable, describing remaining images in-process: {str(e)}")
+        _discard_pool(pool)
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                result = future.result()
+                if result[0] not in completed:
+                    completed.add(result[0])
+                    yield result
+        for url in urls:
+            if url not in completed:
+                completed.add(url)
+                yield describe_url(url, media_root, settings.MEDIA_URL)
+
+
+def process_image(data, media_root):
+    """
+    Store one original image and generate its low/medium JPEG and WebP variants.
+
+    Runs inside a pool worker, so it only takes and returns plain data:
+    {'sha256', 'original': {...}, 'variants': {quality: {...}}} with paths
+    relative to MEDIA_ROOT, dimensions, byte sizes, and the original's
+    dominant colour and placeholder.
+    """
+    try:
+        original, original_format = _open_rgb(data)
+        with original:
+            variants = {}
+            for quality, box in VARIANT_SIZES.items():
+                image = original.copy()
+                image.thumbnail(box, Image.LANCZOS)
+                jpeg = _encode(image, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+                webp = _encode(image, 'WEBP', quality=WEBP_QUALITY, method=4)
+                variants[quality] = {
+                    'path': _store(jpeg, 'jpg', media_root),
+                    'webp_path': _store(webp, 'webp', media_root),
+                    'width': image.width,
+                    'height': image.height,
+                    'byte_size': len(jpeg),
+                    'webp_byte_size': len(webp),
+                }
+
+            return {
+                'sha256': content_hash(data),
+                'original': {
+                    'path': _store(data, original_format, media_root, f'{MEDIA_SUBDIR}/originals'),
+                    'width': original.width,
+                    'height': original.height,
+                    'byte_size': len(data),
+                    'format': original_format,
+                    'dominant_color': dominant_color(original),
+                    'placeholder': placeholder(original),
+                },
+                'variants': variants,
+            }
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        raise ImageProcessingError(f'Invalid image: {e}')
+
+
+def process_originals(originals):
+    """
+    Process several original images (bytes) in the process pool, in parallel.
+
+    Returns one result per original, in order. The batch gets PROCESS_TIMEOUT
+    in total; if the pool breaks (e.g. a crashed worker) or runs out of time
+    it is shut down, and only the originals it didn't finish are encoded
+    in-process.
+    """
+    media_root = str(settings.MEDIA_ROOT)
+    results = {}
+    futures = {}
+    pool = None
+
+    try:
+        pool = get_pool()
+        for index, data in enumerate(originals):
+            futures[pool.submit(process_image, data, media_root)] = index
+        for future in as_completed(futures, timeout=PROCESS_TIMEOUT):
+            results[futures[future]] = future.result()
+    except ImageProcessingError:
+        raise
+    except Exception as e:
+        logger.warning(f"Image pool unavailable, encoding unfinished images in-process: {str(e)}")
+        _discard_pool(pool)
+        for future, index in futures.items():
+            if index not in results and future.done() and not future.cancelled() and future.exception() is None:
+                results[index] = future.result()
+        for index, data in enumerate(originals):
+            if index not in results:
+                results[index] = process_image(data, media_root)
+
+    return [results[index] for index in range(len(originals))]
+
+
+def media_url(request, relative_path):
+    """Absolute URL for a file stored under MEDIA_ROOT"""
+    return request.build_absolute_uri(f'{settings.MEDIA_URL}{relative_path}')
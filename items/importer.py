@@ -0,0 +1,296 @@
+import csv
+import io
+import json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction, connections, DatabaseError
+
+from .models import Category
+from .services import bulk_create_items
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+
+
+# Row parsing
+
+def _split_list(value):
+    """
+    Parse a list cell from a CSV row. Accepts a JSON array or a ';' separated string.
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    value = str(value).strip()
+    if not value:
+        return []
+    if value.startswith('['):
+        return json.loads(value)
+    return [part.strip() for part in value.split(';') if part.strip()]
+
+
+def _parse_sizes(value):
+    """
+    Sizes are either [{"size": "M", "quantity": 3}, ...] or "S:5;M:3" in CSV.
+    """
+    sizes = []
+    for entry in _split_list(value):
+        if isinstance(entry, dict):
+            size, quantity = entry['size'], entry['quantity']
+        else:
+            size, _, quantity = str(entry).partition(':')
+        quantity = int(quantity)
+        if quantity < 0:
+            raise ValueError(f'Negative quantity for size {size}')
+        sizes.append({'size': str(size).strip(), 'quantity': quantity})
+    return sizes
+
+
+def normalize_row(raw):
+    """
+    Validate one catalog row and return it in the shape used by ItemView.post.
+
+    Accepts the camelCase keys of the create endpoint (displayImage, detailImages)
+    as well as their snake_case equivalents, which read better as CSV headers.
+    Raises ValueError describing the first problem found.
+    """
+    name = (raw.get('name') or '').strip()
+    if not name:
+        raise ValueError('Missing required field: name')
+
+    try:
+        price = Decimal(str(raw.get('price', '')).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid price: {raw.get('price')!r}")
+    if price < 0:
+        raise ValueError('Price must not be negative')
+
+    sizes = _parse_sizes(raw.get('sizes'))
+    size_labels = [size['size'] for size in sizes]
+    if len(size_labels) != len(set(size_labels)):
+        raise ValueError('Duplicate size labels')
+
+    return {
+        'name': name,
+        'price': price,
+        'description': raw.get('description') or None,
+        'color': raw.get('color'),
+        'detail': raw.get('detail') or None,
+        'sizes': sizes,
+        'displayImage': raw.get('displayImage') or raw.get('display_image') or None,
+        'images': _split_list(raw.get('images')),
+        'detailImages': _split_list(raw.get('detailImages', raw.get('detail_images'))),
+        'categories': [int(category_id) for category_id in _split_list(raw.get('categories'))],
+    }
+
+
+def iter_catalog_rows(stream, fmt):
+    """
+    Stream (row_number, raw_dict) pairs from a CSV or JSON-lines text stream.
+
+    Row numbers are 1-based data rows (the CSV header is not counted), which is
+    what checkpoints and error reports refer to.
+    """
+    if fmt == 'csv':
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, row
+    elif fmt == 'jsonl':
+        row_number = 0
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                row = {'__error__': f'Invalid JSON: {e}'}
+            if not isinstance(row, dict):
+                row = {'__error__': 'Expected a JSON object'}
+            yield row_number, row
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+def detect_format(filename):
+    """Guess the import format from a file name"""
+    lowered = (filename or '').lower()
+    if lowered.endswith('.csv'):
+        return 'csv'
+    if lowered.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    raise ValueError(f'Cannot detect format of {filename!r}, pass csv or jsonl explicitly')
+
+
+# Batch persistence
+
+def import_batch(batch):
+    """
+    Validate and insert one batch of raw rows.
+
+    batch: list of (row_number, raw_dict)
+    Returns (last_row_number, created_count, errors) where errors is a list of
+    {'row': n, 'error': message}. A batch that fails at the database level is
+    retried row by row so a single bad row doesn't sink its neighbours.
+    """
+    errors = []
+    valid = []
+    for row_number, raw in batch:
+        if '__error__' in raw:
+            errors.append({'row': row_number, 'error': raw['__error__']})
+            continue
+        try:
+            valid.append((row_number, normalize_row(raw)))
+        except (ValueError, KeyError, TypeError) as e:
+            errors.append({'row': row_number, 'error': str(e)})
+
+    # Check every referenced category with a single query
+    referenced = {category_id for _, row in valid for category_id in row['categories']}
+    if referenced:
+        known = set(Category.objects.filter(id__in=referenced).values_list('id', flat=True))
+        checked = []
+        for row_number, row in valid:
+            missing = [category_id for category_id in row['categories'] if category_id not in known]
+            if missing:
+                errors.append({'row': row_number, 'error': f'Unknown categories: {missing}'})
+            else:
+                checked.append((row_number, row))
+        valid = checked
+
+    created = 0
+    if valid:
+        try:
+            with transaction.atomic():
+                created = len(bulk_create_items([row for _, row in valid]))
+        except DatabaseError as e:
+            logger.warning(f"Catalog batch ending at row {batch[-1][0]} failed, retrying row by row: {str(e)}")
+            for row_number, row in valid:
+                try:
+                    with transaction.atomic():
+                        bulk_create_items([row])
+                    created += 1
+                except DatabaseError as e:
+                    errors.append({'row': row_number, 'error': str(e).strip()})
+
+    last_row = batch[-1][0] if batch else 0
+    return last_row, created, errors
+
+
+def _init_worker():
+    """Give each worker process its own database connections"""
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def _batched(rows, batch_size):
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_catalog(stream, fmt, batch_size=DEFAULT_BATCH_SIZE, workers=1, start_after=0, on_progress=None,
+                   on_errors=None):
+    """
+    Stream a catalog file into the database in bounded batches.
+
+    stream: text stream of CSV or JSON lines
+    start_after: skip data rows up to and including this row number (resume)
+    workers: number of worker processes; 1 imports in the calling process
+    on_progress: optional callable(checkpoint_row, report) invoked whenever the
+        contiguous range of finished rows grows, used for resumable checkpoints
+    on_errors: optional callable(errors) invoked with every finished batch's
+        row errors, all of them, e.g. to stream them to a file
+
+    At most 2 x workers batches are held in memory at any time.
+    Returns a report dict with created/failed counts and the first
+    MAX_REPORTED_ERRORS per-row errors; errors_truncated is set when
+    more rows failed than that.
+    """
+    report = {
+        'created': 0,
+        'failed': 0,
+        'errors': [],
+        'errors_truncated': False,
+        'checkpoint': start_after,
+    }
+
+    rows = (
+        (row_number, raw)
+        for row_number, raw in iter_catalog_rows(stream, fmt)
+        if row_number > start_after
+    )
+
+    def record(last_row, created, errors):
+        report['created'] += created
+        report['failed'] += len(errors)
+        if errors and on_errors:
+            on_errors(errors)
+        room = MAX_REPORTED_ERRORS - len(report['errors'])
+        report['errors'].extend(errors[:max(room, 0)])
+        report['errors_truncated'] = report['failed'] > len(report['errors'])
+
+    if workers <= 1:
+        for batch in _batched(rows, batch_size):
+            last_row, created, errors = import_batch(batch)
+            record(last_row, created, errors)
+            report['checkpoint'] = last_row
+            if on_progress:
+                on_progress(last_row, report)
+        return report
+
+    # Batches finish out of order across workers, so the checkpoint only advances
+    # past batches whose predecessors have all finished too
+    connections.close_all()
+    pending = {}
+    finished = {}
+    next_index = 0
+    order = deque()
+
+    def advance():
+        while order and order[0] in finished:
+            report['checkpoint'] = finished.pop(order.popleft())
+            if on_progress:
+                on_progress(report['checkpoint'], report)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        batches = _batched(rows, batch_size)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                future = executor.submit(import_batch, batch)
+                pending[future] = next_index
+                order.append(next_index)
+                next_index += 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                last_row, created, errors = future.result()
+                record(last_row, created, errors)
+                finished[index] = last_row
+            advance()
+
+    return report
+
+
+def open_text_stream(uploaded_file):
+    """Wrap an uploaded (binary) file so it can be read line by line as text"""
+    return io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline='')
@@ -0,0 +1,296 @@
+import logging
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Item, ItemSize, StockMovement
+
+logger = logging.getLogger(__name__)
+
+# First key of the (namespace, size id) advisory locks guarding stock checks
+STOCK_LOCK_NAMESPACE = 4901
+# First key of the (namespace, item id) advisory locks guarding stock flag refreshes
+FLAGS_LOCK_NAMESPACE = 4902
+COMPACT_BATCH_SIZE = 5000
+RECONCILE_BATCH_SIZE = 1000
+
+
+def lock_stock(size_ids):
+    """
+    Serialise stock checks for these sizes until the transaction ends.
+
+    Transaction-scoped advisory locks, taken in id order so checkouts never
+    deadlock, instead of row locks on sizes: the rows themselves are no
+    longer written by checkout, and reads of them never wait. Buyers of the
+    same size still queue here, one at a time, for the check, the sale
+    movement and the commit; a claim without the lock could pass twice for
+    the last unit, since neither buyer sees the other's uncommitted sale.
+    """
+    _advisory_xact_locks(STOCK_LOCK_NAMESPACE, size_ids)
+
+
+def _advisory_xact_locks(namespace, ids):
+    ids = sorted(set(ids))
+    if not ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(%s, id) FROM unnest(%s::int[]) AS id',
+            [namespace, ids]
+        )
+
+
+def _pending_subquery(size_ref=OuterRef('pk')):
+    pending = StockMovement.objects.filter(
+        size=size_ref,
+        compacted_at__isnull=True
+    ).order_by().values('size').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(pending, output_field=IntegerField()), Value(0))
+
+
+def with_stock_level(size_queryset):
+    """
+    Annotate sizes with 'stock_level': the quantity snapshot plus pending
+    movements. A correlated subquery on the pending-movements partial index,
+    so it stays one query.
+    """
+    return size_queryset.annotate(stock_level=F('quantity') + _pending_subquery())
+
+
+def size_stock_level(size_field):
+    """
+    Live stock level of the size a row points at through size_field (e.g.
+    'size' on cart lines), for annotating querysets of other models.
+    """
+    return F(f'{size_field}__quantity') + _pending_subquery(OuterRef(size_field))
+
+
+def item_stock_level():
+    """Live stock across all of an item's sizes, for annotating Item querysets"""
+    snapshots = ItemSize.objects.filter(
+        item=OuterRef('pk')
+    ).order_by().values('item').annotate(total=Sum('quantity')).values('total')
+    pending = StockMovement.objects.filter(
+        size__item=OuterRef('pk'),
+        compacted_at__isnull=True
+    ).order_by().values('size__item').annotate(total=Sum('quantity')).values('total')
+    return (
+        Coalesce(Subquery(snapshots, output_field=IntegerField()), Value(0))
+        + Coalesce(Subquery(pending, output_field=IntegerField()), Value(0))
+    )
+
+
+def stock_levels(size_ids):
+    """Map size id -> live stock level (snapshot plus pending movements), in one query"""
+    return dict(
+        with_stock_level(ItemSize.objects.filter(id__in=list(size_ids))).values_list('id', 'stock_level')
+    )
+
+
+def record_movements(movements, kind, reference='', compacted=False):
+    """
+    Append one movement per (size id, signed quantity) in movements.
+
+    compacted=True is for changes applied to ItemSize.quantity by the
+    caller in the same transaction (new sizes, admin stock edits).
+    """
+    now = timezone.now()
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            size_id=size_id, kind=kind, quantity=quantity, reference=reference,
+            compacted_at=now if compacted else None
+        )
+        for size_id, quantity in movements
+        if quantity
+    ])
+
+
+class StaleStockLevel(Exception):
+    """A stock target was based on a level that has changed since it was read"""
+
+    def __init__(self, size_ids):
+        super().__init__(
+            "Stock changed since it was loaded for sizes "
+            f"{', '.join(str(size_id) for size_id in sorted(size_ids))}; reload and try again"
+        )
+        self.size_ids = size_ids
+
+
+def set_stock_levels(targets, reference='', expected=None):
+    """
+    Bring sizes to absolute stock levels ({size id: units}), e.g. from the
+    admin item form.
+
+    expected ({size id: units}) holds the levels the targets were based on,
+    i.e. what the form showed. If any live level differs (stock sold or
+    received since), nothing is applied and StaleStockLevel is raised: an
+    absolute target read before a sale would otherwise put the sold units
+    back on the shelf.
+
+    Records the difference from the live level as an adjustment and applies
+    it to the snapshot straight away, so admin screens show it immediately.
+    Must run inside transaction.atomic(). Returns the ids of the sizes changed.
+    """
+    expected = expected or {}
+    lock_stock(targets)
+    levels = list(with_stock_level(ItemSize.objects.filter(id__in=list(targets))).values_list(
+        'id', 'item_id', 'stock_level'
+    ))
+    stale = {
+        size_id for size_id, _, level in levels
+        if size_id in expected and expected[size_id] != level
+    }
+    if stale:
+        raise StaleStockLevel(stale)
+
+    deltas, item_ids = {}, set()
+    for size_id, item_id, level in levels:
+        if targets[size_id] != level:
+            deltas[size_id] = targets[size_id] - level
+            item_ids.add(item_id)
+    _add_to_snapshots(deltas)
+    record_movements(deltas.items(), 'adjustment', reference=reference, compacted=True)
+    refresh_stock_flags(item_ids)
+    return set(deltas)
+
+
+def stock_flags(level, threshold):
+    """(in_stock, low_stock) for a size at this stock level"""
+    return level > 0, level <= threshold
+
+
+def refresh_stock_flags(item_ids):
+    """
+    Recompute the in_stock / low_stock flags of these items and their sizes
+    from live stock levels. Call it in the transaction that changed the
+    stock, after the change.
+
+    A per-item advisory lock makes concurrent changes to sibling sizes
+    refresh one after the other, each seeing the other's committed
+    movements, so the item flags can't be left stale. Only flags that flip
+    are written: usually this is one read and no-op updates.
+    """
+    _advisory_xact_locks(FLAGS_LOCK_NAMESPACE, item_ids)
+    if not item_ids:
+        return
+    item_flags = {item_id: [False, False] for item_id in item_ids}
+    flipped = []
+    for size in with_stock_level(ItemSize.objects.filter(item_id__in=list(item_ids))).only(
+        'id', 'item_id', 'low_stock_threshold', 'in_stock', 'low_stock'
+    ):
+        in_stock, low_stock = stock_flags(size.stock_level, size.low_stock_threshold)
+        flags = item_flags[size.item_id]
+        flags[0] = flags[0] or in_stock
+        flags[1] = flags[1] or low_stock
+        if (size.in_stock, size.low_stock) != (in_stock, low_stock):
+            size.in_stock, size.low_stock = in_stock, low_stock
+            flipped.append(size)
+    ItemSize.objects.bulk_update(flipped, ['in_stock', 'low_stock'])
+
+    # One UPDATE per combination of flags, touching only rows that differ
+    by_flags = defaultdict(list)
+    for item_id, (in_stock, low_stock) in item_flags.items():
+        by_flags[(in_stock, low_stock)].append(item_id)
+    for (in_stock, low_stock), ids in by_flags.items():
+        Item.objects.filter(id__in=ids).exclude(in_stock=in_stock, low_stock=low_stock).update(
+            in_stock=in_stock, low_stock=low_stock
+        )
+
+
+def _add_to_snapshots(deltas):
+    """quantity += delta for each size, in one UPDATE"""
+    if not deltas:
+        return
+    ItemSize.objects.filter(id__in=list(deltas)).update(
+        quantity=F('quantity') + Case(
+            *[When(id=size_id, then=Value(delta)) for size_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ),
+        updated_at=timezone.now()
+    )
+
+
+def compact(batch_size=COMPACT_BATCH_SIZE):
+    """
+    Fold pending movements into ItemSize.quantity, oldest first, batch by
+    batch. Each batch adds its per-size totals to the snapshots and marks
+    its movements compacted in one transaction, so the live level
+    (snapshot plus pending) never changes underneath readers. Returns the
+    number of movements compacted.
+    """
+    compacted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                StockMovement.objects.select_for_update(skip_locked=True).filter(
+                    compacted_at__isnull=True
+                ).order_by('id').values_list('id', 'size_id', 'quantity')[:batch_size]
+            )
+            if not batch:
+                break
+            deltas = defaultdict(int)
+            for _, size_id, quantity in batch:
+                deltas[size_id] += quantity
+            _add_to_snapshots({size_id: delta for size_id, delta in deltas.items() if delta})
+            StockMovement.objects.filter(id__in=[row[0] for row in batch]).update(
+                compacted_at=timezone.now()
+            )
+        compacted += len(batch)
+    if compacted:
+        logger.info(f"Compacted {compacted} stock movements")
+    return compacted
+
+
+def reconcile(batch_size=RECONCILE_BATCH_SIZE, fix=False):
+    """
+    Check, size by size in batches, that each ItemSize.quantity equals the
+    sum of its compacted movements, and report live levels below zero.
+
+    With fix=True a mismatched snapshot is taken as the truth (it is what
+    someone last set, outside the ledger) and the ledger gets a compacted
+    'adjustment' recording the difference. Returns a summary dict.
+    """
+    summary = {'checked': 0, 'mismatched': [], 'negative': [], 'fixed': 0}
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            # One snapshot per batch, so a concurrent compaction can't show up as drift
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            sizes = list(
+                with_stock_level(ItemSize.objects.filter(id__gt=last_id)).order_by('id').values_list(
+                    'id', 'quantity', 'stock_level'
+                )[:batch_size]
+            )
+            if not sizes:
+                break
+            last_id = sizes[-1][0]
+            ledger = dict(
+                StockMovement.objects.filter(
+                    size_id__in=[size_id for size_id, _, _ in sizes],
+                    compacted_at__isnull=False
+                ).values('size_id').annotate(total=Sum('quantity')).values_list('size_id', 'total')
+            )
+
+            drift = []
+            for size_id, quantity, level in sizes:
+                summary['checked'] += 1
+                if quantity != ledger.get(size_id, 0):
+                    summary['mismatched'].append(
+                        {'size_id': size_id, 'quantity': quantity, 'ledger': ledger.get(size_id, 0)}
+                    )
+                    drift.append((size_id, quantity - ledger.get(size_id, 0)))
+                if level < 0:
+                    summary['negative'].append({'size_id': size_id, 'stock_level': level})
+
+            if fix and drift:
+                record_movements(drift, 'adjustment', reference='reconciliation', compacted=True)
+                summary['fixed'] += len(drift)
+
+    if summary['mismatched']:
+        logger.warning(f"Stock reconciliation found {len(summary['mismatched'])} mismatched sizes")
+    return summary
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from items.inventory import COMPACT_BATCH_SIZE, compact
+
+
+class Command(BaseCommand):
+    help = 'Fold pending stock movements into the ItemSize quantity snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=COMPACT_BATCH_SIZE, help='Movements folded per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep running, compacting as movements arrive')
+        parser.add_argument('--poll-interval', type=float, default=10.0, help='Seconds to sleep between passes')
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            compacted = compact(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Compacted {compacted} stock movements"))
+            return
+
+        self.stdout.write("Stock compactor running")
+        try:
+            while True:
+                if not compact(batch_size=options['batch_size']):
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping stock compactor")
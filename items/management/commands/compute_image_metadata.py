@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from items.metadata import backfill_image_metadata
+
+
+class Command(BaseCommand):
+    help = 'Precompute dimensions, dominant colour and placeholders for item and detail images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Rows processed per batch')
+        parser.add_argument('--force', action='store_true', help='Recompute images that already have metadata')
+
+    def handle(self, *args, **options):
+        def on_progress(model, last_id, report):
+            self.stdout.write(
+                f"{model.__name__} up to id {last_id}: {report['updated']} updated, {report['failed']} failed"
+            )
+
+        report = backfill_image_metadata(
+            batch_size=options['batch_size'],
+            force=options['force'],
+            on_progress=on_progress
+        )
+
+        for error in report['errors'][:20]:
+            self.stdout.write(self.style.WARNING(f"{error['url']}: {error['error']}"))
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Updated {report['updated']} images ({report['failed']} failed)")
+        )
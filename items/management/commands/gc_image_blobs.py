@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from items.blobs import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete stored images that are no longer referenced by any item image or detail image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age-hours', type=float, default=24, help='Only collect blobs untouched for at least this long')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting it')
+
+    def handle(self, *args, **options):
+        result = collect_garbage(
+            min_age=timedelta(hours=options['min_age_hours']),
+            dry_run=options['dry_run']
+        )
+
+        action = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} {result['blobs']} blobs, {result['files']} files ({result['bytes']} bytes)"
+            )
+        )
@@ -0,0 +1,75 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from items.importer import import_catalog, detect_format, DEFAULT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Import items with sizes, images and categories from a CSV or JSON-lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON-lines file to import')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='File format (detected from the extension by default)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows inserted per batch')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes importing batches in parallel')
+        parser.add_argument('--checkpoint', help='File recording the last imported row, used to resume an interrupted import')
+        parser.add_argument('--errors', help='Write per-row errors to this JSON-lines file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'File not found: {path}')
+
+        try:
+            fmt = options['format'] or detect_format(path)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        # Resume after the last row recorded by a previous run
+        start_after = 0
+        checkpoint_path = options['checkpoint']
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                start_after = int(f.read().strip() or 0)
+            self.stdout.write(f'Resuming after row {start_after}')
+
+        errors_file = open(options['errors'], 'a') if options['errors'] else None
+
+        def on_errors(errors):
+            # Every error goes to the file; the report only keeps the first ones
+            for error in errors:
+                errors_file.write(json.dumps(error) + '\n')
+            errors_file.flush()
+
+        def on_progress(checkpoint, report):
+            if checkpoint_path:
+                with open(checkpoint_path, 'w') as f:
+                    f.write(str(checkpoint))
+            self.stdout.write(f"Row {checkpoint}: {report['created']} created, {report['failed']} failed")
+
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                report = import_catalog(
+                    stream,
+                    fmt,
+                    batch_size=options['batch_size'],
+                    workers=options['workers'],
+                    start_after=start_after,
+                    on_progress=on_progress,
+                    on_errors=on_errors if errors_file else None
+                )
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        for error in report['errors'][:20]:
+            self.stdout.write(self.style.WARNING(f"Row {error['row']}: {error['error']}"))
+        if report['failed'] > 20:
+            where = f"see {options['errors']}" if errors_file else 'use --errors to keep them all'
+            self.stdout.write(self.style.WARNING(f"... and {report['failed'] - 20} more errors ({where})"))
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Imported {report['created']} items ({report['failed']} rows failed)")
+        )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from items.inventory import RECONCILE_BATCH_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Check ItemSize quantity snapshots against the stock movement ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE, help='Sizes checked per transaction')
+        parser.add_argument('--fix', action='store_true', help='Record adjustments bringing the ledger in line with the snapshots')
+
+    def handle(self, *args, **options):
+        summary = reconcile(batch_size=options['batch_size'], fix=options['fix'])
+
+        for row in summary['mismatched']:
+            self.stdout.write(
+                self.style.WARNING(f"Size {row['size_id']}: snapshot {row['quantity']}, ledger {row['ledger']}")
+            )
+        for row in summary['negative']:
+            self.stdout.write(self.style.WARNING(f"Size {row['size_id']}: stock level {row['stock_level']}"))
+
+        message = (
+            f"Checked {summary['checked']} sizes: {len(summary['mismatched'])} mismatched, "
+            f"{len(summary['negative'])} below zero"
+        )
+        if options['fix']:
+            message += f", {summary['fixed']} fixed"
+        if summary['mismatched'] or summary['negative']:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
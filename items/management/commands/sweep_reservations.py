@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from items.reservations import sweep_expired, SWEEP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations (run periodically, e.g. every few minutes from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE, help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        removed = sweep_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} expired reservations"))
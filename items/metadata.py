@@ -0,0 +1,56 @@
+from .blobs import resolve_media_urls
+from .images import describe_urls
+from .models import ItemImage, DetailImage
+
+METADATA_FIELDS = ['width', 'height', 'dominant_color', 'placeholder']
+MAX_REPORTED_ERRORS = 100
+
+
+def backfill_image_metadata(batch_size=200, force=False, on_progress=None):
+    """
+    Compute width, height, dominant colour and placeholder for stored image rows.
+
+    Walks ItemImage and DetailImage in id order (keyset pagination, so rows
+    that fail are not retried forever in one run). URLs of locally stored
+    blobs reuse the blob's metadata; everything else is fetched and decoded in
+    the image process pool, once per distinct URL in the batch.
+    Returns a report with updated/failed counts and sample errors.
+    """
+    report = {'updated': 0, 'failed': 0, 'errors': []}
+
+    for model in (ItemImage, DetailImage):
+        queryset = model.objects.all() if force else model.objects.filter(width__isnull=True)
+        queryset = queryset.only('id', 'image_url', *METADATA_FIELDS)
+        last_id = 0
+
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            urls = {row.image_url for row in rows}
+            metadata = {url: meta for url, (_, meta) in resolve_media_urls(urls).items()}
+
+            for url, meta, error in describe_urls([url for url in urls if url not in metadata]):
+                if meta is not None:
+                    metadata[url] = meta
+                else:
+                    report['failed'] += sum(1 for row in rows if row.image_url == url)
+                    if len(report['errors']) < MAX_REPORTED_ERRORS:
+                        report['errors'].append({'url': url, 'error': error})
+
+            updated = []
+            for row in rows:
+                meta = metadata.get(row.image_url)
+                if meta:
+                    for field in METADATA_FIELDS:
+                        setattr(row, field, meta[field])
+                    updated.append(row)
+            model.objects.bulk_update(updated, METADATA_FIELDS)
+            report['updated'] += len(updated)
+
+            if on_progress:
+                on_progress(model, last_id, report)
+
+    return report
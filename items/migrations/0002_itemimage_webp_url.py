@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-19 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="itemimage",
+            name="webp_url",
+            field=models.URLField(blank=True, default="", max_length=255),
+        ),
+    ]
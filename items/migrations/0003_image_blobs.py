@@ -0,0 +1,65 @@
+# Generated by Django 5.0.14 on 2026-10-19 10:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0002_itemimage_webp_url"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageBlob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("path", models.CharField(max_length=255)),
+                ("width", models.PositiveIntegerField()),
+                ("height", models.PositiveIntegerField()),
+                ("byte_size", models.PositiveIntegerField()),
+                ("format", models.CharField(max_length=10)),
+                ("variants", models.JSONField(default=dict)),
+            ],
+            options={
+                "verbose_name_plural": "Image Blobs",
+                "db_table": "image_blobs",
+            },
+        ),
+        migrations.AddField(
+            model_name="detailimage",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="detail_images",
+                to="items.imageblob",
+            ),
+        ),
+        migrations.AddField(
+            model_name="itemimage",
+            name="blob",
+            field=models.ForeignKey(
+                blank=True,
+                db_constraint=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="item_images",
+                to="items.imageblob",
+            ),
+        ),
+    ]
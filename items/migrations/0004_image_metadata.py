@@ -0,0 +1,63 @@
+# Generated by Django 5.0.14 on 2026-10-19 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0003_image_blobs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="detailimage",
+            name="dominant_color",
+            field=models.CharField(blank=True, default="", max_length=7),
+        ),
+        migrations.AddField(
+            model_name="detailimage",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="detailimage",
+            name="placeholder",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="detailimage",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="imageblob",
+            name="dominant_color",
+            field=models.CharField(blank=True, default="", max_length=7),
+        ),
+        migrations.AddField(
+            model_name="imageblob",
+            name="placeholder",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="itemimage",
+            name="dominant_color",
+            field=models.CharField(blank=True, default="", max_length=7),
+        ),
+        migrations.AddField(
+            model_name="itemimage",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="itemimage",
+            name="placeholder",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="itemimage",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
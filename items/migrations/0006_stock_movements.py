@@ -0,0 +1,90 @@
+# Generated by Django 5.0.14 on 2026-10-19 11:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+OPENING_BATCH_SIZE = 5000
+
+
+def record_opening_balances(apps, schema_editor):
+    """Start the ledger with each size's current stock, already compacted into it"""
+    ItemSize = apps.get_model("items", "ItemSize")
+    StockMovement = apps.get_model("items", "StockMovement")
+    now = timezone.now()
+    last_id = 0
+    while True:
+        sizes = list(
+            ItemSize.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "quantity")[:OPENING_BATCH_SIZE]
+        )
+        if not sizes:
+            break
+        StockMovement.objects.bulk_create(
+            [
+                StockMovement(
+                    size_id=size_id,
+                    kind="receipt",
+                    quantity=quantity,
+                    reference="opening balance",
+                    compacted_at=now,
+                    created_at=now,
+                )
+                for size_id, quantity in sizes
+                if quantity
+            ]
+        )
+        last_id = sizes[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0005_stock_reservations"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockMovement",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("receipt", "Receipt"),
+                            ("sale", "Sale"),
+                            ("adjustment", "Adjustment"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("quantity", models.IntegerField()),
+                ("reference", models.CharField(blank=True, default="", max_length=100)),
+                ("compacted_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "size",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="movements",
+                        to="items.itemsize",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "stock_movements",
+                "indexes": [
+                    models.Index(fields=["size", "id"], name="movement_size_idx"),
+                    models.Index(
+                        condition=models.Q(("compacted_at__isnull", True)),
+                        fields=["size"],
+                        name="movement_pending_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
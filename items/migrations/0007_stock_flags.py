@@ -0,0 +1,74 @@
+# Generated by Django 5.0.14 on 2026-10-19 11:11
+
+from django.db import migrations, models
+
+# Flags from live levels: the snapshot plus movements not yet compacted into it
+BACKFILL_SIZE_FLAGS = """
+UPDATE sizes SET in_stock = levels.level > 0, low_stock = levels.level <= sizes.low_stock_threshold
+FROM (
+    SELECT s.id, s.quantity + COALESCE(SUM(m.quantity), 0) AS level
+    FROM sizes s
+    LEFT JOIN stock_movements m ON m.size_id = s.id AND m.compacted_at IS NULL
+    GROUP BY s.id
+) AS levels
+WHERE sizes.id = levels.id
+"""
+
+BACKFILL_ITEM_FLAGS = """
+UPDATE items SET
+    in_stock = EXISTS (SELECT 1 FROM sizes WHERE sizes.item_id = items.id AND sizes.in_stock),
+    low_stock = EXISTS (SELECT 1 FROM sizes WHERE sizes.item_id = items.id AND sizes.low_stock)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("items", "0006_stock_movements"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="in_stock",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="item",
+            name="low_stock",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="itemsize",
+            name="in_stock",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="itemsize",
+            name="low_stock",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="itemsize",
+            name="low_stock_threshold",
+            field=models.PositiveIntegerField(default=5),
+        ),
+        migrations.RunSQL(BACKFILL_SIZE_FLAGS, migrations.RunSQL.noop),
+        migrations.RunSQL(BACKFILL_ITEM_FLAGS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name="item",
+            index=models.Index(
+                condition=models.Q(("in_stock", True)),
+                fields=["-created_at"],
+                name="items_in_stock_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="itemsize",
+            index=models.Index(
+                condition=models.Q(("low_stock", True)),
+                fields=["item"],
+                name="size_low_stock_idx",
+            ),
+        ),
+    ]
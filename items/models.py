@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.db import models
 
+# Units at or below which a size counts as low on stock, unless set per size
+DEFAULT_LOW_STOCK_THRESHOLD = 5
+
 class BaseModel(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -19,9 +23,12 @@ class BaseModel(models.Model):
 #     id SERIAL PRIMARY KEY,
 #     name VARCHAR(255) NOT NULL,
 #     price DECIMAL(10, 2) NOT NULL,
-#     description TEXT
+#     description TEXT,
+#     in_stock BOOLEAN NOT NULL,  -- Any size in stock
+#     low_stock BOOLEAN NOT NULL  -- Any size low on stock
 #     -- Note: Removed category_id to avoid conflict with many-to-many relationship
 # );
+# CREATE INDEX ON items (created_at DESC) WHERE in_stock;
 
 # -- Junction table for many-to-many relationship between items and categories
 # CREATE TABLE item_categories (
@@ -47,8 +54,12 @@ class BaseModel(models.Model):
 #     item_id INT NOT NULL,
 #     size VARCHAR(50) NOT NULL,  -- e.g., 'S', 'M', 'L'
 #     quantity INT NOT NULL,  -- Stock for this specific size
+#     low_stock_threshold INT NOT NULL DEFAULT 5,
+#     in_stock BOOLEAN NOT NULL,  -- Stock level > 0
+#     low_stock BOOLEAN NOT NULL,  -- Stock level <= low_stock_threshold
 #     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
 # );
+# CREATE INDEX ON sizes (item_id) WHERE low_stock;
 
 # -- Item images table (one-to-many with items, for images of different qualities)
 # CREATE TABLE images (
@@ -57,6 +68,11 @@ class BaseModel(models.Model):
 #     image_url VARCHAR(255) NOT NULL,  -- URL to externally stored image
 #     quality VARCHAR(10) NOT NULL,  -- 'low', 'medium'
 #     is_primary BOOLEAN DEFAULT FALSE,  -- Marks the main image for display
+#     webp_url VARCHAR(255) NOT NULL DEFAULT '',  -- WebP version of the image, if generated
+#     blob_id INT,  -- Stored original, for images uploaded locally
+#     width INT, height INT,  -- Precomputed dimensions
+#     dominant_color VARCHAR(7) NOT NULL DEFAULT '',  -- '#rrggbb'
+#     placeholder TEXT NOT NULL DEFAULT '',  -- Tiny base64 preview
 #     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
 # );
 
@@ -66,9 +82,57 @@ class BaseModel(models.Model):
 #     item_id INT NOT NULL,
 #     image_url VARCHAR(255) NOT NULL,  -- URL to externally stored image
 #     display_order INT NOT NULL,  -- To control the order of detail images
+#     blob_id INT,  -- Stored original, for images uploaded locally
+#     width INT, height INT,  -- Precomputed dimensions
+#     dominant_color VARCHAR(7) NOT NULL DEFAULT '',  -- '#rrggbb'
+#     placeholder TEXT NOT NULL DEFAULT '',  -- Tiny base64 preview
 #     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE
 # );
 
+# -- Image blobs table (content-addressed index of locally stored images)
+# CREATE TABLE image_blobs (
+#     id SERIAL PRIMARY KEY,
+#     sha256 VARCHAR(64) NOT NULL UNIQUE,  -- Hash of the original upload
+#     path VARCHAR(255) NOT NULL,  -- Original file, relative to MEDIA_ROOT
+#     width INT NOT NULL,
+#     height INT NOT NULL,
+#     byte_size INT NOT NULL,
+#     format VARCHAR(10) NOT NULL,
+#     dominant_color VARCHAR(7) NOT NULL DEFAULT '',
+#     placeholder TEXT NOT NULL DEFAULT '',
+#     variants JSONB NOT NULL  -- Generated low/medium JPEG and WebP files
+# );
+
+# -- Stock reservations table (units held by carts for a limited time)
+# CREATE TABLE stock_reservations (
+#     id SERIAL PRIMARY KEY,
+#     user_id INT NOT NULL,
+#     size_id INT NOT NULL,
+#     quantity INT NOT NULL,  -- Units of this size held for the user
+#     expires_at TIMESTAMP NOT NULL,  -- Ignored (and swept) after this time
+#     created_at TIMESTAMP NOT NULL,
+#     updated_at TIMESTAMP NOT NULL,
+#     UNIQUE (user_id, size_id),
+#     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+#     FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
+# );
+# CREATE INDEX ON stock_reservations (size_id, expires_at);
+# CREATE INDEX ON stock_reservations (expires_at);
+
+# -- Stock movements table (append-only ledger of every change to a size's stock)
+# CREATE TABLE stock_movements (
+#     id BIGSERIAL PRIMARY KEY,
+#     size_id INT NOT NULL,  -- No FK: the ledger outlives deleted sizes
+#     kind VARCHAR(20) NOT NULL,  -- 'receipt', 'sale', 'adjustment'
+#     quantity INT NOT NULL,  -- Signed change in units
+#     reference VARCHAR(100) NOT NULL,  -- What caused it, e.g. 'order:42', 'admin:3'
+#     compacted_at TIMESTAMP,  -- When it was folded into sizes.quantity; NULL while pending
+#     created_at TIMESTAMP NOT NULL
+# );
+# CREATE INDEX ON stock_movements (size_id, id);
+# CREATE INDEX ON stock_movements (size_id) WHERE compacted_at IS NULL;
+# -- sizes.quantity is the compacted snapshot: stock level = quantity + pending movements
+
 
 class Category(BaseModel):
     name = models.CharField(max_length=255) # Corresponds to VARCHAR(255) NOT NULL
@@ -98,12 +162,18 @@ class Item(BaseModel):
         through='ItemCategory',
         related_name='items'
     )
+    in_stock = models.BooleanField(default=False) # Some size has stock; maintained by items.inventory
+    low_stock = models.BooleanField(default=False) # Some size is at or below its threshold
 
     def __str__(self):
         return self.name
 
     class Meta:
         db_table = 'items' # Match SQL comment
+        indexes = [
+            # Storefront listings with ?in_stock=true, newest first
+            models.Index(fields=['-created_at'], condition=models.Q(in_stock=True), name='items_in_stock_idx'),
+        ]
 
 class ItemCategory(BaseModel): # Through model for Item <-> Category
     item = models.ForeignKey(Item, on_delete=models.CASCADE, db_constraint=False)
@@ -142,6 +212,9 @@ class ItemSize(BaseModel): # One-to-many with Item
     )
     size = models.CharField(max_length=50) # Corresponds to VARCHAR(50) NOT NULL
     quantity = models.IntegerField() # Corresponds to INT NOT NULL
+    low_stock_threshold = models.PositiveIntegerField(default=DEFAULT_LOW_STOCK_THRESHOLD)
+    in_stock = models.BooleanField(default=False) # Stock level above zero; maintained by items.inventory
+    low_stock = models.BooleanField(default=True) # Stock level at or below low_stock_threshold
 
     def __str__(self):
         return f"{self.item.name} - Size: {self.size} (Qty: {self.quantity})"
@@ -150,6 +223,35 @@ class ItemSize(BaseModel): # One-to-many with Item
         unique_together = ('item', 'size') # Ensure an item doesn't have duplicate sizes
         verbose_name_plural = "Item Sizes"
         db_table = 'sizes' # Match SQL comment
+        indexes = [
+            models.Index(fields=['item'], condition=models.Q(low_stock=True), name='size_low_stock_idx'),
+        ]
+
+class ImageBlob(BaseModel):
+    """
+    Content-addressed index of uploaded images.
+
+    One row per distinct original (keyed by its SHA-256), pointing at the stored
+    original and the generated variants so identical uploads are stored and
+    processed once. Rows no longer referenced by any ItemImage or DetailImage
+    are removed by the gc_image_blobs command.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    path = models.CharField(max_length=255) # Original file, relative to MEDIA_ROOT
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    byte_size = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    dominant_color = models.CharField(max_length=7, blank=True, default='') # '#rrggbb'
+    placeholder = models.TextField(blank=True, default='') # Tiny base64 data URI shown while loading
+    variants = models.JSONField(default=dict) # quality -> {path, webp_path, width, height, byte_size, webp_byte_size}
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.width}x{self.height})"
+
+    class Meta:
+        verbose_name_plural = "Image Blobs"
+        db_table = 'image_blobs'
 
 class ItemImage(BaseModel): # One-to-many with Item
     item = models.ForeignKey(
@@ -169,6 +271,19 @@ class ItemImage(BaseModel): # One-to-many with Item
         # NOT NULL is default for CharField
     )
     is_primary = models.BooleanField(default=False) # Corresponds to BOOLEAN DEFAULT FALSE
+    webp_url = models.URLField(max_length=255, blank=True, default='') # WebP version, set for images processed locally
+    blob = models.ForeignKey(
+        ImageBlob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='item_images',
+        db_constraint=False
+    ) # Stored original this image was generated from, if uploaded locally
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    dominant_color = models.CharField(max_length=7, blank=True, default='') # '#rrggbb'
+    placeholder = models.TextField(blank=True, default='') # Tiny base64 data URI shown while loading
 
     def __str__(self):
         return f"{self.item.name} - {self.get_quality_display()} Image"
@@ -186,6 +301,18 @@ class DetailImage(BaseModel):
     )
     image_url = models.URLField(max_length=255)
     display_order = models.IntegerField(default=0)  # To control the order of detail images
+    blob = models.ForeignKey(
+        ImageBlob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='detail_images',
+        db_constraint=False
+    ) # Stored original this image was generated from, if uploaded locally
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    dominant_color = models.CharField(max_length=7, blank=True, default='') # '#rrggbb'
+    placeholder = models.TextField(blank=True, default='') # Tiny base64 data URI shown while loading
 
     def __str__(self):
         return f"{self.item.name} - Detail Image {self.display_order}"
@@ -193,4 +320,86 @@ class DetailImage(BaseModel):
     class Meta:
         verbose_name_plural = "Detail Images"
         db_table = 'detail_images'
-        ordering = ['display_order']  # Default ordering by display_order
\ No newline at end of file
+        ordering = ['display_order']  # Default ordering by display_order
+
+class StockReservation(BaseModel):
+    """
+    Units of a size held for a user's cart until expires_at.
+
+    Available stock is ItemSize.quantity minus the active (unexpired)
+    reservations of other users. Expired rows are ignored by every read and
+    removed by the sweep_reservations command.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='stock_reservations'
+    )
+    size = models.ForeignKey(
+        ItemSize,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        db_constraint=False
+    )
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.quantity}x size {self.size_id} for user {self.user_id} until {self.expires_at}"
+
+    class Meta:
+        verbose_name_plural = "Stock Reservations"
+        db_table = 'stock_reservations'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'size'], name='unique_reservation_per_user_size'),
+        ]
+        indexes = [
+            models.Index(fields=['size', 'expires_at'], name='reservation_size_expiry_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+
+class StockMovement(models.Model):
+    """
+    One change to a size's stock. Rows are only ever appended.
+
+    ItemSize.quantity is a snapshot holding every compacted movement; the
+    live stock level is that plus the pending (uncompacted) movements. The
+    compact_stock command folds pending movements into the snapshot.
+
+    Cart reservations are not movements: they are holds that lapse on their
+    own (StockReservation.expires_at) and never change the level, so they
+    are subtracted at read time instead of being booked and un-booked here.
+    """
+    KIND_CHOICES = [
+        ('receipt', 'Receipt'),
+        ('sale', 'Sale'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    size = models.ForeignKey(
+        ItemSize,
+        on_delete=models.DO_NOTHING,
+        related_name='movements',
+        db_constraint=False
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()  # Signed change in units
+    reference = models.CharField(max_length=100, blank=True, default='')  # e.g. 'order:42'
+    compacted_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} for size {self.size_id} ({self.reference})"
+
+    class Meta:
+        db_table = 'stock_movements'
+        indexes = [
+            models.Index(fields=['size', 'id'], name='movement_size_idx'),
+            models.Index(
+                fields=['size'],
+                name='movement_pending_idx',
+                condition=models.Q(compacted_at__isnull=True)
+            ),
+        ]
@@ -0,0 +1,161 @@
+import logging
+import os
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .inventory import lock_stock, stock_levels, with_stock_level
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_TTL = timedelta(minutes=int(os.getenv('CART_RESERVATION_MINUTES', '15')))
+SWEEP_BATCH_SIZE = 5000
+
+
+class InsufficientStock(Exception):
+    """A reservation that would take more than the size has left for this user"""
+
+    def __init__(self, size_id, available):
+        super().__init__(f"Only {available} items available")
+        self.size_id = size_id
+        self.available = available
+
+
+def reserved_quantities(size_ids, exclude_user_id=None):
+    """
+    Units currently held by active reservations, per size id.
+
+    exclude_user_id leaves out the user's own reservations, which is what
+    "how many can this user still take" needs. One aggregate query over the
+    (size_id, expires_at) index.
+    """
+    reservations = StockReservation.objects.filter(
+        size_id__in=list(size_ids),
+        expires_at__gt=timezone.now()
+    )
+    if exclude_user_id is not None:
+        reservations = reservations.exclude(user_id=exclude_user_id)
+    return dict(
+        reservations.values('size_id').annotate(total=Sum('quantity')).values_list('size_id', 'total')
+    )
+
+
+def available_quantities(sizes, exclude_user_id=None):
+    """Map size id -> live stock level minus other users' active reservations (never negative)"""
+    return _available(list({size.id for size in sizes}), exclude_user_id)
+
+
+def _available(size_ids, exclude_user_id=None):
+    levels = stock_levels(size_ids)
+    reserved = reserved_quantities(size_ids, exclude_user_id)
+    return {
+        size_id: max(levels.get(size_id, 0) - reserved.get(size_id, 0), 0)
+        for size_id in size_ids
+    }
+
+
+def with_available_quantity(size_queryset):
+    """
+    Annotate sizes with 'available': the live stock level minus every
+    active reservation.
+
+    Correlated subqueries over the (size_id, expires_at) and pending
+    movement indexes, so listing a product's sizes stays a single query.
+    """
+    active = StockReservation.objects.filter(
+        size=OuterRef('pk'),
+        expires_at__gt=timezone.now()
+    ).order_by().values('size').annotate(total=Sum('quantity')).values('total')
+    return with_stock_level(size_queryset).annotate(
+        available=Greatest(
+            F('stock_level') - Coalesce(Subquery(active, output_field=IntegerField()), Value(0)),
+            Value(0)
+        )
+    )
+
+
+def reserve(user_id, quantities, increased=()):
+    """
+    Make the user's reservations match quantities (size id -> units) and
+    restart their TTL.
+
+    Sizes the user would hold more of than now are checked against the live
+    level minus other users' reservations under the sizes' stock locks (the
+    ones checkout takes), held until the surrounding transaction commits, so
+    two shoppers can't both reserve the last unit. For sizes in increased
+    (the cart lines the caller just grew) a shortfall raises
+    InsufficientStock and nothing is written; any other size (e.g. a line
+    whose reservation lapsed) is re-held only as far as it still fits.
+    Holding the same or fewer units never fails.
+
+    Sizes missing from quantities (or with 0 units) are released. One delete
+    and one upsert on the (user, size) unique constraint, whatever the count.
+    """
+    quantities = {size_id: quantity for size_id, quantity in quantities.items() if quantity > 0}
+    now = timezone.now()
+    with transaction.atomic():
+        held = dict(StockReservation.objects.filter(
+            user_id=user_id, expires_at__gt=now
+        ).values_list('size_id', 'quantity'))
+        grown = [size_id for size_id, quantity in quantities.items() if quantity > held.get(size_id, 0)]
+        if grown:
+            lock_stock(grown)
+            available = _available(grown, exclude_user_id=user_id)
+            for size_id in sorted(grown):
+                if quantities[size_id] <= available[size_id]:
+                    continue
+                if size_id in increased:
+                    raise InsufficientStock(size_id, available[size_id])
+                quantities[size_id] = available[size_id]
+            quantities = {size_id: quantity for size_id, quantity in quantities.items() if quantity > 0}
+
+        StockReservation.objects.filter(user_id=user_id).exclude(size_id__in=list(quantities)).delete()
+        if not quantities:
+            return
+
+        expires_at = now + RESERVATION_TTL
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(
+                    user_id=user_id, size_id=size_id, quantity=quantity,
+                    expires_at=expires_at, created_at=now, updated_at=now
+                )
+                for size_id, quantity in quantities.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'size'],
+            update_fields=['quantity', 'expires_at', 'updated_at']
+        )
+
+
+def release(user_id, size_ids=None):
+    """Drop the user's reservations (all of them, or only for size_ids)"""
+    reservations = StockReservation.objects.filter(user_id=user_id)
+    if size_ids is not None:
+        reservations = reservations.filter(size_id__in=list(size_ids))
+    reservations.delete()
+
+
+def sweep_expired(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Delete expired reservations in batches walking the expires_at index, so
+    the sweep never holds long locks. Returns the number of rows removed.
+    """
+    now = timezone.now()
+    removed = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at').values_list(
+                'id', flat=True
+            )[:batch_size]
+        )
+        if not batch:
+            break
+        removed += StockReservation.objects.filter(id__in=batch, expires_at__lte=now).delete()[0]
+    if removed:
+        logger.info(f"Swept {removed} expired stock reservations")
+    return removed
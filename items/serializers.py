@@ -11,21 +11,48 @@ class ItemImageSerializer(serializers.ModelSerializer):
         model = ItemImage
         fields = ['id', 'image_url', 'is_primary']
 
+def image_meta(image):
+    """Precomputed layout metadata for an ItemImage or DetailImage, if available"""
+    if image is None or image.width is None:
+        return None
+    return {
+        'width': image.width,
+        'height': image.height,
+        'dominant_color': image.dominant_color or None,
+        'placeholder': image.placeholder or None,
+    }
+
 class ItemSerializer(serializers.ModelSerializer):
     categories = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_meta = serializers.SerializerMethodField()
     
     class Meta:
         model = Item
-        fields = ['id', 'name', 'price', 'description', 'categories', 'image', 'created_at']
+        fields = ['id', 'name', 'price', 'description', 'categories', 'image', 'image_meta', 'in_stock', 'created_at']
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Image metadata is opt-in (context include_image_meta) to keep listings small
+        if not self.context.get('include_image_meta'):
+            self.fields.pop('image_meta')
     
     def get_categories(self, obj):
         return [category.name for category in obj.categories.all()]
     
+    def _low_image(self, obj):
+        # Use the prefetched low quality images when the view provided them
+        if 'images' in getattr(obj, '_prefetched_objects_cache', {}):
+            return next((img for img in obj.images.all() if img.quality == 'low'), None)
+        return obj.images.filter(quality='low').first()
+    
     def get_image(self, obj):
         # Get only the first low quality image
-        low_image = obj.images.filter(quality='low').first()
+        low_image = self._low_image(obj)
         return low_image.image_url if low_image else None
+    
+    def get_image_meta(self, obj):
+        return image_meta(self._low_image(obj))
 
 class RecentItemSerializer(serializers.ModelSerializer):
     low_quality_image = serializers.SerializerMethodField()
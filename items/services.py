@@ -0,0 +1,271 @@
+from django.utils import timezone
+
+from .blobs import attach_blobs
+from .inventory import record_movements, refresh_stock_flags, set_stock_levels, stock_flags
+from .models import DEFAULT_LOW_STOCK_THRESHOLD, Item, ItemCategory, ItemDetail, ItemSize, ItemImage, DetailImage
+
+
+def _sync_children(model, existing_rows, incoming, key, update_fields, build):
+    """
+    Diff incoming child rows against existing ones by natural key.
+
+    existing_rows: rows currently stored for the item
+    incoming: dict of natural key -> field values from the request
+    key: callable returning the natural key of an existing row
+    update_fields: fields compared (and written) for rows present on both sides
+    build: callable creating an unsaved model instance from (key, values)
+
+    Applies the diff with one bulk_create, one bulk_update and one delete,
+    and returns a summary of what changed.
+    """
+    existing = {key(row): row for row in existing_rows}
+    now = timezone.now()
+
+    to_create = []
+    to_update = []
+    for natural_key, values in incoming.items():
+        row = existing.get(natural_key)
+        if row is None:
+            to_create.append(build(natural_key, values))
+            continue
+
+        changed = False
+        for field in update_fields:
+            if getattr(row, field) != values[field]:
+                setattr(row, field, values[field])
+                changed = True
+        if changed:
+            # bulk_update bypasses auto_now, so bump updated_at explicitly
+            row.updated_at = now
+            to_update.append(row)
+
+    to_delete = [row.id for natural_key, row in existing.items() if natural_key not in incoming]
+
+    if to_create:
+        if model in (ItemImage, DetailImage):
+            attach_blobs(to_create)
+        model.objects.bulk_create(to_create)
+    if to_update:
+        model.objects.bulk_update(to_update, list(update_fields) + ['updated_at'])
+    if to_delete:
+        model.objects.filter(id__in=to_delete).delete()
+
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'deleted': len(to_delete),
+        'unchanged': len(existing) - len(to_update) - len(to_delete),
+    }
+
+
+def sync_item_sizes(item, sizes_data):
+    """
+    Update an item's sizes in place, keyed by the size label.
+
+    Existing ItemSize rows keep their ids, so CartItem.size references
+    survive admin edits that only change quantities. Quantities go through
+    the stock ledger: new sizes get a receipt, changed ones an adjustment
+    from their live level. A size sent with 'expected_quantity' (the level
+    the form loaded) raises StaleStockLevel if its stock has moved since,
+    instead of overwriting sales made meanwhile. Must run inside
+    transaction.atomic().
+    """
+    existing_rows = list(item.sizes.all())
+    existing = {row.size: row for row in existing_rows}
+
+    incoming = {}
+    for size_data in sizes_data:
+        row = existing.get(size_data['size'])
+        threshold = size_data.get(
+            'low_stock_threshold', row.low_stock_threshold if row else DEFAULT_LOW_STOCK_THRESHOLD
+        )
+        incoming[size_data['size']] = {
+            'quantity': int(size_data['quantity']),
+            'low_stock_threshold': int(threshold),
+        }
+
+    threshold_changed = {
+        existing[size].id for size, values in incoming.items()
+        if size in existing and existing[size].low_stock_threshold != values['low_stock_threshold']
+    }
+    summary = _sync_children(
+        ItemSize,
+        existing_rows,
+        incoming,
+        key=lambda row: row.size,
+        update_fields=['low_stock_threshold'],
+        build=lambda size, values: _new_size(item, size, values['quantity'], values['low_stock_threshold'])
+    )
+
+    reference = f'admin item:{item.id}'
+    adjusted = set_stock_levels(
+        {
+            existing[size].id: values['quantity']
+            for size, values in incoming.items()
+            if size in existing
+        },
+        reference=reference,
+        expected={
+            existing[size_data['size']].id: int(size_data['expected_quantity'])
+            for size_data in sizes_data
+            if size_data['size'] in existing and size_data.get('expected_quantity') is not None
+        }
+    )
+    summary['updated'] = len(threshold_changed | adjusted)
+    summary['unchanged'] = len(existing) - summary['updated'] - summary['deleted']
+
+    if summary['created']:
+        new_sizes = ItemSize.objects.filter(item=item).exclude(id__in=[row.id for row in existing_rows])
+        record_movements(
+            new_sizes.values_list('id', 'quantity'), 'receipt', reference=reference, compacted=True
+        )
+    if summary['created'] or summary['deleted'] or threshold_changed:
+        refresh_stock_flags([item.id])
+    return summary
+
+
+def _new_size(item, size, quantity, threshold=DEFAULT_LOW_STOCK_THRESHOLD):
+    """Unsaved ItemSize with its stock flags set from its opening quantity"""
+    in_stock, low_stock = stock_flags(quantity, threshold)
+    return ItemSize(
+        item=item, size=size, quantity=quantity, low_stock_threshold=threshold,
+        in_stock=in_stock, low_stock=low_stock
+    )
+
+
+def sync_item_images(item, images_data):
+    """
+    Update an item's images in place, keyed by (image_url, quality).
+    """
+    incoming = {}
+    for image_data in images_data:
+        natural_key = (image_data['image_url'], image_data.get('quality', 'medium'))
+        incoming[natural_key] = {'is_primary': bool(image_data.get('is_primary', False))}
+
+    existing_rows = item.images.all()
+    return _sync_children(
+        ItemImage,
+        existing_rows,
+        incoming,
+        key=lambda row: (row.image_url, row.quality),
+        update_fields=['is_primary'],
+        build=lambda natural_key, values: ItemImage(
+            item=item,
+            image_url=natural_key[0],
+            quality=natural_key[1],
+            is_primary=values['is_primary']
+        )
+    )
+
+
+def sync_detail_images(item, detail_images_data):
+    """
+    Update an item's detail images in place, keyed by image_url.
+    """
+    incoming = {}
+    for idx, image_data in enumerate(detail_images_data):
+        incoming[image_data['image_url']] = {
+            'display_order': int(image_data.get('display_order', idx))
+        }
+
+    existing_rows = item.detail_images.all()
+    return _sync_children(
+        DetailImage,
+        existing_rows,
+        incoming,
+        key=lambda row: row.image_url,
+        update_fields=['display_order'],
+        build=lambda image_url, values: DetailImage(
+            item=item,
+            image_url=image_url,
+            display_order=values['display_order']
+        )
+    )
+
+
+def sync_item_categories(item, category_ids):
+    """
+    Update an item's categories by adding and removing only the differences.
+    """
+    incoming = {int(category_id) for category_id in category_ids}
+    existing = set(
+        ItemCategory.objects.filter(item=item).values_list('category_id', flat=True)
+    )
+
+    to_add = incoming - existing
+    to_remove = existing - incoming
+
+    if to_add:
+        ItemCategory.objects.bulk_create([
+            ItemCategory(item=item, category_id=category_id)
+            for category_id in to_add
+        ])
+    if to_remove:
+        ItemCategory.objects.filter(item=item, category_id__in=to_remove).delete()
+
+    return {
+        'created': len(to_add),
+        'updated': 0,
+        'deleted': len(to_remove),
+        'unchanged': len(existing & incoming),
+    }
+
+
+def bulk_create_items(rows):
+    """
+    Create items and all their child rows with one bulk_create per table.
+
+    rows: list of dicts shaped like the ItemView.post payload (name, price,
+    description, color, detail, sizes, displayImage, images, detailImages,
+    categories). Category ids are expected to be validated by the caller.
+    Returns the created Item instances, in the same order as rows.
+    """
+    # New rows get their stock flags with the insert: nothing else can see them yet
+    size_rows = [
+        [
+            (size['size'], int(size['quantity']), int(size.get('low_stock_threshold', DEFAULT_LOW_STOCK_THRESHOLD)))
+            for size in row['sizes']
+        ]
+        for row in rows
+    ]
+    items = []
+    for row, item_sizes in zip(rows, size_rows):
+        flags = [stock_flags(quantity, threshold) for _, quantity, threshold in item_sizes]
+        items.append(Item(
+            name=row['name'], price=row['price'], description=row['description'],
+            in_stock=any(in_stock for in_stock, _ in flags),
+            low_stock=any(low_stock for _, low_stock in flags)
+        ))
+    items = Item.objects.bulk_create(items)
+
+    details, sizes, images, detail_images, categories = [], [], [], [], []
+    for item, row, item_sizes in zip(items, rows, size_rows):
+        if row.get('color') is not None:
+            details.append(ItemDetail(item=item, color=row['color'], detail=row.get('detail')))
+        for size, quantity, threshold in item_sizes:
+            sizes.append(_new_size(item, size, quantity, threshold))
+        if row.get('displayImage'):
+            images.append(ItemImage(
+                item=item, image_url=row['displayImage'], quality='low', is_primary=True
+            ))
+        for image_url in row['images']:
+            images.append(ItemImage(
+                item=item, image_url=image_url, quality='medium', is_primary=False
+            ))
+        for idx, image_url in enumerate(row.get('detailImages', [])):
+            detail_images.append(DetailImage(item=item, image_url=image_url, display_order=idx))
+        for category_id in dict.fromkeys(int(category_id) for category_id in row['categories']):
+            categories.append(ItemCategory(item=item, category_id=category_id))
+
+    ItemDetail.objects.bulk_create(details)
+    ItemSize.objects.bulk_create(sizes)
+    # Opening stock enters the ledger as receipts already held in the snapshot
+    record_movements(
+        [(size.id, size.quantity) for size in sizes], 'receipt', reference='new item', compacted=True
+    )
+    # Images pointing at files we already store share the existing blob
+    attach_blobs(images + detail_images)
+    ItemImage.objects.bulk_create(images)
+    DetailImage.objects.bulk_create(detail_images)
+    ItemCategory.objects.bulk_create(categories)
+    return items
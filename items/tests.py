@@ -1,3 +1,330 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from users.models import User
+from . import images
+from .importer import import_catalog
+from .inventory import compact, reconcile, stock_levels
+from .models import (
+    Category, DetailImage, Item, ItemCategory, ItemDetail, ItemImage, ItemSize, StockMovement
+)
+
+
+class StockLedgerTests(TransactionTestCase):
+    """Stock levels through checkout, admin edits and compaction"""
+
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', email='admin@example.com', is_superuser=True)
+        self.category = Category.objects.create(name='tops')
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(self.admin)
+
+        response = self.admin_client.post('/api/items/', [{
+            'name': 'Shirt',
+            'price': '20.00',
+            'description': 'A shirt',
+            'color': 'blue',
+            'detail': 'cotton',
+            'sizes': [{'size': 'M', 'quantity': 3}, {'size': 'L', 'quantity': 10}],
+            'images': [],
+            'categories': [self.category.id],
+        }], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.item = Item.objects.get(id=response.data['ids'][0])
+        self.size_m = self.item.sizes.get(size='M')
+        self.size_l = self.item.sizes.get(size='L')
+
+    def buy(self, size, quantity):
+        return APIClient().post('/api/guest-checkout/', {
+            'cart': {'items': [{'id': self.item.id, 'size_id': size.id, 'quantity': quantity}]},
+            'shipping_address': '1 Main St',
+            'shipping_phone': '555',
+            'shipping_email': 'guest@example.com',
+            'first_name': 'Guest',
+            'last_name': 'Buyer',
+            'zip_code': '00000',
+            'city': 'Town',
+        }, format='json')
+
+    def admin_sizes(self):
+        response = self.admin_client.get(f'/api/admin/items/{self.item.id}/')
+        return {size['size']: size['quantity'] for size in response.data['sizes']}
+
+    def test_new_item_opens_ledger(self):
+        self.assertEqual(stock_levels([self.size_m.id]), {self.size_m.id: 3})
+        self.assertEqual(reconcile()['mismatched'], [])
+
+    def test_checkout_appends_sale_without_touching_snapshot(self):
+        self.assertEqual(self.buy(self.size_m, 2).status_code, 201)
+
+        self.assertEqual(ItemSize.objects.get(id=self.size_m.id).quantity, 3)
+        self.assertEqual(stock_levels([self.size_m.id]), {self.size_m.id: 1})
+        sale = StockMovement.objects.get(kind='sale')
+        self.assertEqual((sale.size_id, sale.quantity, sale.compacted_at), (self.size_m.id, -2, None))
+
+    def test_checkout_refuses_more_than_live_level(self):
+        self.assertEqual(self.buy(self.size_m, 2).status_code, 201)
+        self.assertEqual(self.buy(self.size_m, 2).status_code, 400)
+        self.assertEqual(stock_levels([self.size_m.id]), {self.size_m.id: 1})
+
+    def test_racing_buyers_never_oversell(self):
+        start = threading.Barrier(6)
+        statuses = []
+
+        def race():
+            try:
+                start.wait()
+                statuses.append(self.buy(self.size_m, 1).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=race) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] * 3 + [400] * 3)
+        self.assertEqual(stock_levels([self.size_m.id]), {self.size_m.id: 0})
+        self.assertEqual(StockMovement.objects.filter(kind='sale').count(), 3)
+        self.assertTrue(Item.objects.get(id=self.item.id).in_stock)  # L is still stocked
+
+    def test_compaction_keeps_levels(self):
+        self.buy(self.size_m, 2)
+        self.buy(self.size_l, 4)
+
+        self.assertEqual(compact(), 2)
+        self.assertEqual(
+            stock_levels([self.size_m.id, self.size_l.id]), {self.size_m.id: 1, self.size_l.id: 6}
+        )
+        self.assertEqual(ItemSize.objects.get(id=self.size_m.id).quantity, 1)
+        self.assertFalse(StockMovement.objects.filter(compacted_at__isnull=True).exists())
+        self.assertEqual(reconcile()['mismatched'], [])
+
+    def test_readers_show_live_level_before_compaction(self):
+        self.buy(self.size_m, 2)
+
+        self.assertEqual(self.admin_sizes(), {'M': 1, 'L': 10})
+        detail = APIClient().get(f'/api/items/{self.item.id}/').data
+        self.assertEqual({size['size']: size['quantity'] for size in detail['sizes']}, {'M': 1, 'L': 10})
+
+        listing = self.admin_client.get('/api/admin/items/?max_stock=11').data
+        self.assertEqual([row['id'] for row in listing['results']['items']], [self.item.id])
+        self.assertEqual(listing['results']['items'][0]['total_stock'], 11)
+        listing = self.admin_client.get('/api/admin/items/?max_stock=10').data
+        self.assertEqual(listing['results']['items'], [])
+
+    def test_resaving_admin_form_keeps_sales(self):
+        self.buy(self.size_m, 2)
+        sizes = [{'size': size, 'quantity': quantity} for size, quantity in self.admin_sizes().items()]
+
+        response = self.admin_client.put(f'/api/admin/items/{self.item.id}/', {'sizes': sizes}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(stock_levels([self.size_m.id]), {self.size_m.id: 1})
+        self.assertFalse(StockMovement.objects.filter(kind='adjustment').exists())
+
+    def test_unchanged_sizes_keep_their_rows(self):
+        sizes = [{'size': size, 'quantity': quantity} for size, quantity in self.admin_sizes().items()]
+
+        response = self.admin_client.put(f'/api/admin/items/{self.item.id}/', {'sizes': sizes}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['changes']['sizes']['updated'], response.data['changes']['sizes']['unchanged']), (0, 2)
+        )
+        self.assertEqual(
+            dict(self.item.sizes.values_list('size', 'id')), {'M': self.size_m.id, 'L': self.size_l.id}
+        )
+        self.assertFalse(StockMovement.objects.filter(kind='adjustment').exists())
+
+    def test_threshold_change_refreshes_low_stock(self):
+        response = self.admin_client.put(f'/api/admin/items/{self.item.id}/', {'sizes': [
+            {'size': 'M', 'quantity': 3},
+            {'size': 'L', 'quantity': 10, 'low_stock_threshold': 10},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changes']['sizes']['updated'], 1)
+        size_l = ItemSize.objects.get(id=self.size_l.id)
+        self.assertEqual((size_l.low_stock_threshold, size_l.low_stock), (10, True))
+        self.assertFalse(StockMovement.objects.filter(kind='adjustment').exists())
+
+    def test_admin_edit_adjusts_from_live_level(self):
+        self.buy(self.size_m, 2)
+
+        response = self.admin_client.put(f'/api/admin/items/{self.item.id}/', {'sizes': [
+            {'size': 'M', 'quantity': 5, 'expected_quantity': 1},
+            {'size': 'L', 'quantity': 10, 'expected_quantity': 10},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.item.sizes.get(size='M').id, self.size_m.id)
+        self.assertEqual(stock_levels([self.size_m.id]), {self.size_m.id: 5})
+        self.assertEqual(StockMovement.objects.get(kind='adjustment').quantity, 4)
+        self.assertEqual(reconcile()['mismatched'], [])
+
+    def test_admin_edit_from_stale_level_is_refused(self):
+        form = self.admin_sizes()
+        self.buy(self.size_m, 2)
+
+        response = self.admin_client.put(f'/api/admin/items/{self.item.id}/', {'sizes': [
+            {'size': size, 'quantity': quantity + 1, 'expected_quantity': quantity}
+            for size, quantity in form.items()
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['size_ids'], [self.size_m.id])
+        self.assertEqual(
+            stock_levels([self.size_m.id, self.size_l.id]), {self.size_m.id: 1, self.size_l.id: 10}
+        )
+
+    def test_reconcile_fix_records_drift(self):
+        ItemSize.objects.filter(id=self.size_l.id).update(quantity=12)
+
+        summary = reconcile(fix=True)
+
+        self.assertEqual(summary['mismatched'], [{'size_id': self.size_l.id, 'quantity': 12, 'ledger': 10}])
+        self.assertEqual(reconcile()['mismatched'], [])
+
+    def test_sizes_created_outside_ledger_show_up_in_reconcile(self):
+        other = Item.objects.create(name='Socks', price='5.00')
+        ItemDetail.objects.create(item=other, color='red')
+        ItemCategory.objects.create(item=other, category=self.category)
+        size = ItemSize.objects.create(item=other, size='One', quantity=4)
+
+        self.assertEqual([row['size_id'] for row in reconcile()['mismatched']], [size.id])
+
+
+class AdminItemListTests(TransactionTestCase):
+
+    def setUp(self):
+        admin = User.objects.create(username='admin', email='admin@example.com', is_superuser=True)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(admin)
+        self.item = Item.objects.create(name='Shirt', price='20.00')
+        ItemDetail.objects.create(item=self.item, color='blue')
+        for size, quantity in (('M', 3), ('L', 4)):
+            ItemSize.objects.create(item=self.item, size=size, quantity=quantity)
+
+    def test_totals_are_not_multiplied_by_other_relations(self):
+        for quality in ('low', 'medium'):
+            ItemImage.objects.create(item=self.item, image_url='https://example.com/a.jpg', quality=quality)
+        for order in range(3):
+            DetailImage.objects.create(item=self.item, image_url='https://example.com/d.jpg', display_order=order)
+
+        row = self.admin_client.get('/api/admin/items/?min_images=2&max_detail_images=3').data['results']['items'][0]
+
+        self.assertEqual((row['total_images'], row['total_detail_images'], row['total_stock']), (2, 3, 7))
+
+
+class CatalogImportErrorTests(TransactionTestCase):
+
+    def test_errors_file_keeps_every_error_past_the_report_cap(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        feed = os.path.join(directory, 'feed.jsonl')
+        errors_path = os.path.join(directory, 'errors.jsonl')
+        with open(feed, 'w') as f:
+            f.write('[]\n' * 5)
+
+        with mock.patch('items.importer.MAX_REPORTED_ERRORS', 2):
+            call_command('import_catalog', feed, '--batch-size', '2', '--errors', errors_path, stdout=StringIO())
+
+        with open(errors_path) as f:
+            errors = [json.loads(line) for line in f]
+        self.assertEqual([error['row'] for error in errors], [1, 2, 3, 4, 5])
+
+    def test_report_marks_truncated_errors(self):
+        with mock.patch('items.importer.MAX_REPORTED_ERRORS', 2):
+            report = import_catalog(StringIO('[]\n' * 3), 'jsonl')
+
+        self.assertEqual((report['failed'], len(report['errors']), report['errors_truncated']), (3, 2, True))
+
+
+class FakePool:
+    """Pool whose tasks fail (as from a crashed worker) for the given arguments"""
+
+    def __init__(self, failing):
+        self.failing = failing
+        self.shutdown_calls = []
+
+    def submit(self, function, argument, *args):
+        future = Future()
+        if argument in self.failing:
+            future.set_exception(BrokenProcessPool('worker died'))
+        else:
+            future.set_result((argument, 'pool', None))
+        return future
+
+    def shutdown(self, **kwargs):
+        self.shutdown_calls.append(kwargs)
+
+
+class ImagePoolFallbackTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = FakePool(failing={b'b'})
+        patcher = mock.patch.object(images, '_pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_broken_pool_is_shut_down_and_only_unfinished_originals_rerun(self):
+        with mock.patch.object(images, 'process_image', side_effect=lambda data, root: (data, 'local', None)) as local:
+            results = images.process_originals([b'a', b'b', b'c'])
+
+        self.assertEqual(results, [(b'a', 'pool', None), (b'b', 'local', None), (b'c', 'pool', None)])
+        self.assertEqual([call.args[0] for call in local.call_args_list], [b'b'])
+        self.assertEqual(self.pool.shutdown_calls, [{'wait': False, 'cancel_futures': True}])
+        self.assertIsNone(images._pool)
+
+    def test_describe_urls_falls_back_only_for_unfinished_urls(self):
+        with mock.patch.object(images, 'describe_url', side_effect=lambda url, *args: (url, 'local', None)) as local:
+            results = sorted(images.describe_urls([b'a', b'b', b'c']))
+
+        self.assertEqual(results, [(b'a', 'pool', None), (b'b', 'local', None), (b'c', 'pool', None)])
+        self.assertEqual([call.args[0] for call in local.call_args_list], [b'b'])
+        self.assertEqual(self.pool.shutdown_calls, [{'wait': False, 'cancel_futures': True}])
+
+
+class LocalMediaFileTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.root = os.path.realpath(self.root)
+
+    def test_media_url_paths_resolve_under_media_root(self):
+        self.assertEqual(
+            images.local_media_file('https://shop.example/media/items/a%20b.jpg', self.root, '/media/'),
+            os.path.join(self.root, 'items', 'a b.jpg')
+        )
+
+    def test_urls_merely_containing_media_url_are_remote(self):
+        for url in ('https://cdn.example/img?next=/media/a.jpg', 'https://cdn.example/x/media/a.jpg'):
+            self.assertIsNone(images.local_media_file(url, self.root, '/media/'))
+
+    def test_absolute_media_url_must_match_the_host(self):
+        media_url = 'https://shop.example/media/'
+        self.assertIsNone(images.local_media_file('https://other.example/media/a.jpg', self.root, media_url))
+        self.assertEqual(
+            images.local_media_file('https://shop.example/media/a.jpg', self.root, media_url),
+            os.path.join(self.root, 'a.jpg')
+        )
+
+    def test_paths_escaping_media_root_are_refused(self):
+        for url in ('/media/../secret.txt', '/media/%2e%2e/secret.txt', '/media/items/../../secret.txt'):
+            with self.assertRaises(images.ImageProcessingError):
+                images.local_media_file(url, self.root, '/media/')
@@ -1,9 +1,12 @@
 from django.urls import path
-from .views import ItemView, ItemDetailView, AdminItemView
+from .views import ItemView, ItemDetailView, AdminItemView, AdminCatalogImportView, AdminItemExportView, AdminLowStockView
 
 urlpatterns = [
     path('items/', ItemView.as_view(), name='items'),
     path('items/<int:item_id>/', ItemDetailView.as_view(), name='item-detail'),
     path('admin/items/', AdminItemView.as_view(), name='admin-items'),
     path('admin/items/<int:item_id>/', AdminItemView.as_view(), name='admin-item-detail'),
+    path('admin/items/import/', AdminCatalogImportView.as_view(), name='admin-items-import'),
+    path('admin/items/export/', AdminItemExportView.as_view(), name='admin-items-export'),
+    path('admin/items/low-stock/', AdminLowStockView.as_view(), name='admin-items-low-stock'),
 ]
\ No newline at end of file
@@ -4,9 +4,17 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.pagination import PageNumberPagination
-from django.db.models import Q, Prefetch
-from .models import Item, Category, ItemImage, ItemDetail, ItemSize, DetailImage
-from .serializers import ItemSerializer
+from django.db.models import Q, Prefetch, Count, Max, Exists, OuterRef, Subquery, Value, IntegerField
+from django.db.models.functions import Coalesce
+from .models import Item, Category, ItemCategory, ItemImage, ItemDetail, ItemSize, DetailImage
+from .serializers import ItemSerializer, image_meta
+from .services import sync_item_sizes, sync_item_images, sync_detail_images, sync_item_categories, bulk_create_items
+from .importer import import_catalog, detect_format, open_text_stream, DEFAULT_BATCH_SIZE
+from .exporter import stream_items, export_response, EXPORT_FORMATS
+from .images import media_url, ImageProcessingError
+from .blobs import resolve_uploads, image_metadata
+from .reservations import with_available_quantity
+from .inventory import StaleStockLevel, item_stock_level, with_stock_level
 from django.db import transaction
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -17,6 +25,37 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+def wants_image_meta(request):
+    """Whether the client asked for image metadata with ?image_meta=true"""
+    return request.query_params.get('image_meta', '').lower() in ('1', 'true')
+
+def related_count(model):
+    """Count of model rows for the outer item, as a correlated subquery (no join, so counts don't multiply)"""
+    counts = model.objects.filter(
+        item=OuterRef('pk')
+    ).order_by().values('item').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+def get_all_subcategories(category_ids):
+    """
+    Recursively get all subcategories for given category IDs
+    """
+    all_categories = set(category_ids)
+    to_process = list(category_ids)
+    
+    while to_process:
+        current_ids = to_process
+        # Find all direct children of current categories
+        subcategories = Category.objects.filter(parent_category_id__in=current_ids)
+        to_process = []
+        
+        for subcat in subcategories:
+            if subcat.id not in all_categories:
+                all_categories.add(subcat.id)
+                to_process.append(subcat.id)
+                
+    return list(all_categories)
+
 class ItemView(APIView):
     permission_classes = [AllowAny]  # Allow public access to browse items
     pagination_class = CustomPagination
@@ -25,21 +64,7 @@ class ItemView(APIView):
         """
         Recursively get all subcategories for given category IDs
         """
-        all_categories = set(category_ids)
-        to_process = list(category_ids)
-        
-        while to_process:
-            current_ids = to_process
-            # Find all direct children of current categories
-            subcategories = Category.objects.filter(parent_category_id__in=current_ids)
-            to_process = []
-            
-            for subcat in subcategories:
-                if subcat.id not in all_categories:
-                    all_categories.add(subcat.id)
-                    to_process.append(subcat.id)
-                    
-        return list(all_categories)
+        return get_all_subcategories(category_ids)
 
     def get(self, request):
         """
@@ -51,7 +76,7 @@ class ItemView(APIView):
             'sizes',
             Prefetch(
                 'images',
-                queryset=ItemImage.objects.filter(quality='low')
+                queryset=ItemImage.objects.filter(quality='low').order_by('id')
             )
         ).select_related('details').all()
 
@@ -75,6 +100,13 @@ class ItemView(APIView):
                 Q(description__icontains=search)
             )
 
+        # Stock filter: a flag on the item row, so no join with sizes
+        in_stock = request.query_params.get('in_stock', '').lower()
+        if in_stock in ('1', 'true'):
+            queryset = queryset.filter(in_stock=True)
+        elif in_stock in ('0', 'false'):
+            queryset = queryset.filter(in_stock=False)
+
         # Price range filter
         min_price = request.query_params.get('min_price')
         if min_price:
@@ -101,10 +133,20 @@ class ItemView(APIView):
         paginator = self.pagination_class()
         paginated_queryset = paginator.paginate_queryset(queryset, request)
         
-        serializer = ItemSerializer(paginated_queryset, many=True)
+        serializer = ItemSerializer(
+            paginated_queryset,
+            many=True,
+            context={'include_image_meta': wants_image_meta(request)}
+        )
         return paginator.get_paginated_response(serializer.data)
 
     def post(self, request):
+        """
+        Create one item, or a list of items in a single transaction.
+
+        A JSON object creates one item and returns its payload; a JSON array
+        creates every item in it (all or nothing) and returns their ids and payloads.
+        """
         # Check if user is authenticated for creating items
         if not request.user.is_authenticated:
             return Response(
@@ -113,90 +155,94 @@ class ItemView(APIView):
             )
             
         try:
-            # Start a transaction to ensure all related data is created or none
-            with transaction.atomic():
-                # 1. Create the main item
-                item = Item.objects.create(
-                    name=request.data['name'],
-                    price=request.data['price'],
-                    description=request.data['description']
-                )
-
-                # 2. Create item details (one-to-one)
-                ItemDetail.objects.create(
-                    item=item,
-                    color=request.data['color'],
-                    detail=request.data['detail']
+            is_batch = isinstance(request.data, list)
+            payloads = request.data if is_batch else [request.data]
+            if not payloads:
+                return Response(
+                    {'error': 'At least one item is required'},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
 
-                # 3. Create sizes (one-to-many)
-                for size_data in request.data['sizes']:
-                    ItemSize.objects.create(
-                        item=item,
-                        size=size_data['size'],
-                        quantity=size_data['quantity']
-                    )
-
-                # 4. Create images
-                # Create display image (low quality, primary)
-                if 'displayImage' in request.data:
-                    ItemImage.objects.create(
-                        item=item,
-                        image_url=request.data['displayImage'],
-                        quality='low',
-                        is_primary=True
-                    )
-
-                # Create other images (medium quality)
-                for image_url in request.data['images']:
-                    ItemImage.objects.create(
-                        item=item,
-                        image_url=image_url,
-                        quality='medium',
-                        is_primary=False
-                    )
+            # 1. Read every payload up front so a missing field fails before any write
+            rows = [
+                {
+                    'name': payload['name'],
+                    'price': payload['price'],
+                    'description': payload['description'],
+                    'color': payload['color'],
+                    'detail': payload['detail'],
+                    'sizes': payload['sizes'],
+                    'displayImage': payload.get('displayImage'),
+                    'images': payload['images'],
+                    'detailImages': payload.get('detailImages', []),
+                    'categories': [int(category_id) for category_id in payload['categories']],
+                }
+                for payload in payloads
+            ]
 
-                # Create detail images if any
-                for idx, image_url in enumerate(request.data.get('detailImages', [])):
-                    DetailImage.objects.create(
-                        item=item,
-                        image_url=image_url,
-                        display_order=idx
-                    )
+            # 2. Resolve every referenced category with one query
+            category_ids = {category_id for row in rows for category_id in row['categories']}
+            categories = Category.objects.in_bulk(category_ids)
+            missing = sorted(category_ids - set(categories))
+            if missing:
+                return Response(
+                    {'error': f'Unknown categories: {missing}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-                # 5. Add categories (many-to-many)
-                item.categories.add(*request.data['categories'])
+            # 3. Create the items and their child rows with one insert per table
+            with transaction.atomic():
+                items = bulk_create_items(rows)
 
-                # 6. Return the created item data
-                response_data = {
+            # 4. Echo the created data back from the request instead of re-reading it
+            response_data = [
+                {
                     'id': item.id,
                     'name': item.name,
                     'price': str(item.price),
                     'description': item.description,
-                    'categories': list(item.categories.values('id', 'name')),
+                    'categories': [
+                        {'id': category_id, 'name': categories[category_id].name}
+                        for category_id in dict.fromkeys(row['categories'])
+                    ],
                     'details': {
-                        'color': request.data['color'],
-                        'detail': request.data['detail']
+                        'color': row['color'],
+                        'detail': row['detail']
                     },
-                    'sizes': request.data['sizes'],
-                    'images': [
+                    'sizes': row['sizes'],
+                    'images': (
+                        [{
+                            'image_url': row['displayImage'],
+                            'is_primary': True,
+                            'quality': 'low'
+                        }] if row['displayImage'] else []
+                    ) + [
                         {
-                            'image_url': img.image_url,
-                            'is_primary': img.is_primary,
-                            'quality': img.quality
+                            'image_url': image_url,
+                            'is_primary': False,
+                            'quality': 'medium'
                         }
-                        for img in item.images.all()
+                        for image_url in row['images']
                     ],
                     'detail_images': [
                         {
-                            'image_url': img.image_url,
-                            'display_order': img.display_order
+                            'image_url': image_url,
+                            'display_order': idx
                         }
-                        for img in item.detail_images.all()
+                        for idx, image_url in enumerate(row['detailImages'])
                     ]
                 }
+                for item, row in zip(items, rows)
+            ]
 
-                return Response(response_data, status=status.HTTP_201_CREATED)
+            if is_batch:
+                return Response({
+                    'created': len(items),
+                    'ids': [item.id for item in items],
+                    'items': response_data
+                }, status=status.HTTP_201_CREATED)
+
+            return Response(response_data[0], status=status.HTTP_201_CREATED)
 
         except KeyError as e:
             return Response(
@@ -217,7 +263,10 @@ class ItemDetailView(APIView):
             # Get item with all related data in a single query
             item = Item.objects.prefetch_related(
                 'details',
-                'sizes',
+                Prefetch(
+                    'sizes',
+                    queryset=with_available_quantity(ItemSize.objects.all())
+                ),
                 Prefetch(
                     'images',
                     queryset=ItemImage.objects.filter(quality='medium')
@@ -252,7 +301,8 @@ class ItemDetailView(APIView):
                     {
                         'id': size.id,  # Added size ID for cart operations
                         'size': size.size,
-                        'quantity': size.quantity
+                        'quantity': size.stock_level,
+                        'available': size.available  # Minus units held in shoppers' carts
                     }
                     for size in item.sizes.all()
                 ],
@@ -262,6 +312,7 @@ class ItemDetailView(APIView):
                     {
                         'id': img.id,
                         'image_url': img.image_url,
+                        'webp_url': img.webp_url or None,
                         'is_primary': img.is_primary
                     }
                     for img in item.images.all()
@@ -278,6 +329,13 @@ class ItemDetailView(APIView):
                 ]
             }
             
+            # Optional precomputed dimensions, dominant colour and placeholders
+            if wants_image_meta(request):
+                for entry, img in zip(data['images'], item.images.all()):
+                    entry['meta'] = image_meta(img)
+                for entry, img in zip(data['detail_images'], item.detail_images.all()):
+                    entry['meta'] = image_meta(img)
+            
             return Response(data)
             
         except Item.DoesNotExist:
@@ -337,6 +395,82 @@ class AdminItemView(APIView):
             )
         return None
     
+    def get_admin_list_queryset(self, request):
+        """
+        Build the admin item list queryset with annotated counts and stock totals.
+
+        Supports filtering by category (including subcategories), search,
+        image/detail image counts and stock totals, and sorting by any of them.
+        """
+        # Every total is a correlated subquery: joining images and detail images
+        # would multiply rows per item before the counts are taken
+        queryset = Item.objects.select_related('details').prefetch_related(
+            Prefetch('sizes', queryset=with_stock_level(ItemSize.objects.all())),
+            'categories'
+        ).annotate(
+            total_images=related_count(ItemImage),
+            total_detail_images=related_count(DetailImage),
+            total_stock=item_stock_level()
+        )
+
+        # Category filter with subcategories support
+        category_ids = request.query_params.getlist('category')
+        if category_ids:
+            try:
+                category_ids = [int(cid) for cid in category_ids]
+                all_category_ids = get_all_subcategories(category_ids)
+                queryset = queryset.filter(Exists(
+                    ItemCategory.objects.filter(
+                        item=OuterRef('pk'),
+                        category_id__in=all_category_ids
+                    )
+                ))
+            except ValueError:
+                pass  # Invalid category ID format, ignore filter
+
+        # Search filter
+        search = request.query_params.get('search')
+        if search:
+            queryset = queryset.filter(
+                Q(name__icontains=search) |
+                Q(description__icontains=search)
+            )
+
+        # Range filters on the annotated values, e.g. ?max_stock=0 or ?min_images=1
+        range_filters = {
+            'images': 'total_images',
+            'detail_images': 'total_detail_images',
+            'stock': 'total_stock',
+        }
+        for param, field in range_filters.items():
+            try:
+                min_value = request.query_params.get(f'min_{param}')
+                if min_value not in (None, ''):
+                    queryset = queryset.filter(**{f'{field}__gte': int(min_value)})
+
+                max_value = request.query_params.get(f'max_{param}')
+                if max_value not in (None, ''):
+                    queryset = queryset.filter(**{f'{field}__lte': int(max_value)})
+            except ValueError:
+                pass  # Invalid number format, ignore filter
+
+        # Sorting
+        sort_field = request.query_params.get('sort', 'created_at')
+        order = request.query_params.get('order', 'desc')
+
+        valid_sort_fields = [
+            'created_at', 'updated_at', 'price', 'name',
+            'total_images', 'total_detail_images', 'total_stock'
+        ]
+        if sort_field not in valid_sort_fields:
+            sort_field = 'created_at'
+
+        if order == 'desc':
+            sort_field = f'-{sort_field}'
+
+        # Tie-break on id so pages stay stable when sorting by counts
+        return queryset.order_by(sort_field, 'id')
+
     def get(self, request, item_id=None):
         """Get item details for admin (with all image qualities)"""
         # Check admin permission
@@ -349,7 +483,7 @@ class AdminItemView(APIView):
                 # Get specific item
                 item = Item.objects.prefetch_related(
                     'details',
-                    'sizes',
+                    Prefetch('sizes', queryset=with_stock_level(ItemSize.objects.all())),
                     'images',
                     'detail_images',
                     'categories'
@@ -375,14 +509,19 @@ class AdminItemView(APIView):
                         {
                             'id': size.id,
                             'size': size.size,
-                            'quantity': size.quantity
+                            'quantity': size.stock_level,
+                            'low_stock_threshold': size.low_stock_threshold,
+                            'low_stock': size.low_stock
                         }
                         for size in item.sizes.all()
                     ],
+                    'in_stock': item.in_stock,
+                    'low_stock': item.low_stock,
                     'images': [
                         {
                             'id': img.id,
                             'image_url': img.image_url,
+                            'webp_url': img.webp_url,
                             'quality': img.quality,
                             'is_primary': img.is_primary
                         }
@@ -399,14 +538,9 @@ class AdminItemView(APIView):
                 }
                 return Response(data)
             else:
-                # Get all items with pagination
-                items = Item.objects.prefetch_related(
-                    'details',
-                    'sizes',
-                    'images',
-                    'detail_images',
-                    'categories'
-                ).all()
+                # Get all items with pagination; image counts and stock totals
+                # come from annotations so each page costs a fixed number of queries
+                items = self.get_admin_list_queryset(request)
                 
                 paginator = CustomPagination()
                 paginated_items = paginator.paginate_queryset(items, request)
@@ -432,17 +566,21 @@ class AdminItemView(APIView):
                             {
                                 'id': size.id,
                                 'size': size.size,
-                                'quantity': size.quantity
+                                'quantity': size.stock_level
                             }
                             for size in item.sizes.all()
                         ],
-                        'total_images': item.images.count(),
-                        'total_detail_images': item.detail_images.count()
+                        'total_stock': item.total_stock,
+                        'in_stock': item.in_stock,
+                        'low_stock': item.low_stock,
+                        'total_images': item.total_images,
+                        'total_detail_images': item.total_detail_images
                     })
                 
+                # Reuse the paginator's count instead of running a second COUNT
                 return paginator.get_paginated_response({
                     'items': items_data,
-                    'total_items': items.count()
+                    'total_items': paginator.page.paginator.count
                 })
                 
         except Item.DoesNotExist:
@@ -456,6 +594,123 @@ class AdminItemView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    def post(self, request, item_id=None):
+        """
+        Upload original images for an item.
+
+        Files under 'images' become low and medium ItemImage rows; files under
+        'detail_images' become DetailImage rows (medium variant) appended after
+        the existing ones. Originals are resolved through the content-addressed
+        blob index, so only content never seen before is resized (JPEG plus
+        WebP) in the image process pool. Pass is_primary=true to make the first
+        file under 'images' the item's primary image.
+        """
+        # Check admin permission
+        permission_check = self.check_admin_permission(request)
+        if permission_check:
+            return permission_check
+
+        if not item_id:
+            return Response(
+                {'error': 'item_id is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        image_files = request.FILES.getlist('images')
+        detail_files = request.FILES.getlist('detail_images')
+        uploaded_files = image_files + detail_files
+        if not uploaded_files:
+            return Response(
+                {'error': 'At least one file is required in images or detail_images'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            item = Item.objects.get(id=item_id)
+
+            # Resolve and encode before opening the transaction so no locks are held meanwhile
+            blobs, processed_count = resolve_uploads(uploaded_files)
+            image_blobs = blobs[:len(image_files)]
+            detail_blobs = blobs[len(image_files):]
+
+            make_primary = str(request.data.get('is_primary', '')).lower() in ('1', 'true')
+            with transaction.atomic():
+                if image_blobs:
+                    if make_primary:
+                        item.images.filter(is_primary=True).update(is_primary=False)
+                    else:
+                        # The first upload for an item without a primary image becomes primary
+                        make_primary = not item.images.filter(is_primary=True).exists()
+
+                images = []
+                for idx, blob in enumerate(image_blobs):
+                    for quality, variant in blob.variants.items():
+                        images.append(ItemImage(
+                            item=item,
+                            blob=blob,
+                            image_url=media_url(request, variant['path']),
+                            webp_url=media_url(request, variant['webp_path']),
+                            quality=quality,
+                            is_primary=make_primary and idx == 0,
+                            **image_metadata(blob, quality)
+                        ))
+                ItemImage.objects.bulk_create(images)
+
+                detail_images = []
+                if detail_blobs:
+                    last_order = item.detail_images.aggregate(last=Max('display_order'))['last']
+                    next_order = 0 if last_order is None else last_order + 1
+                    for idx, blob in enumerate(detail_blobs):
+                        detail_images.append(DetailImage(
+                            item=item,
+                            blob=blob,
+                            image_url=media_url(request, blob.variants['medium']['path']),
+                            display_order=next_order + idx,
+                            **image_metadata(blob, 'medium')
+                        ))
+                    DetailImage.objects.bulk_create(detail_images)
+
+            return Response({
+                'message': f'{len(uploaded_files)} image(s) uploaded successfully',
+                'item_id': item.id,
+                'processed': processed_count,
+                'deduplicated': len(uploaded_files) - processed_count,
+                'images': [
+                    {
+                        'id': img.id,
+                        'image_url': img.image_url,
+                        'webp_url': img.webp_url,
+                        'quality': img.quality,
+                        'is_primary': img.is_primary
+                    }
+                    for img in images
+                ],
+                'detail_images': [
+                    {
+                        'id': img.id,
+                        'image_url': img.image_url,
+                        'display_order': img.display_order
+                    }
+                    for img in detail_images
+                ]
+            }, status=status.HTTP_201_CREATED)
+
+        except Item.DoesNotExist:
+            return Response(
+                {'error': 'Item not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except ImageProcessingError as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+    
     def put(self, request, item_id):
         """Update an item's details"""
         # Check admin permission
@@ -487,51 +742,30 @@ class AdminItemView(APIView):
                         details.detail = data['detail']
                     details.save()
                 
+                # Update child rows by diffing against what's stored, so unchanged
+                # rows keep their ids (and CartItem.size references stay valid)
+                changes = {}
+                
                 # Update sizes
                 if 'sizes' in data:
-                    # Delete existing sizes
-                    item.sizes.all().delete()
-                    # Create new sizes
-                    for size_data in data['sizes']:
-                        ItemSize.objects.create(
-                            item=item,
-                            size=size_data['size'],
-                            quantity=size_data['quantity']
-                        )
+                    changes['sizes'] = sync_item_sizes(item, data['sizes'])
                 
                 # Update categories
                 if 'categories' in data:
-                    item.categories.clear()
-                    item.categories.add(*data['categories'])
+                    changes['categories'] = sync_item_categories(item, data['categories'])
                 
                 # Update images
                 if 'images' in data:
-                    # Delete existing images
-                    item.images.all().delete()
-                    # Create new images
-                    for image_data in data['images']:
-                        ItemImage.objects.create(
-                            item=item,
-                            image_url=image_data['image_url'],
-                            quality=image_data.get('quality', 'medium'),
-                            is_primary=image_data.get('is_primary', False)
-                        )
+                    changes['images'] = sync_item_images(item, data['images'])
                 
                 # Update detail images
                 if 'detail_images' in data:
-                    # Delete existing detail images
-                    item.detail_images.all().delete()
-                    # Create new detail images
-                    for idx, image_data in enumerate(data['detail_images']):
-                        DetailImage.objects.create(
-                            item=item,
-                            image_url=image_data['image_url'],
-                            display_order=image_data.get('display_order', idx)
-                        )
+                    changes['detail_images'] = sync_detail_images(item, data['detail_images'])
                 
                 return Response({
                     'message': 'Item updated successfully',
-                    'item_id': item.id
+                    'item_id': item.id,
+                    'changes': changes
                 }, status=status.HTTP_200_OK)
                 
         except Item.DoesNotExist:
@@ -539,6 +773,11 @@ class AdminItemView(APIView):
                 {'error': 'Item not found'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
+        except StaleStockLevel as e:
+            return Response(
+                {'error': str(e), 'size_ids': sorted(e.size_ids)},
+                status=status.HTTP_409_CONFLICT
+            )
         except Exception as e:
             return Response(
                 {'error': str(e)}, 
@@ -571,4 +810,123 @@ class AdminItemView(APIView):
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            ) 
\ No newline at end of file
+            ) 
+
+
+class AdminCatalogImportView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request):
+        """
+        Import items from an uploaded CSV or JSON-lines file.
+
+        The upload is streamed in batches; use the import_catalog management
+        command for very large feeds that need worker processes or resuming.
+        """
+        if not request.user.is_superuser:
+            return Response(
+                {"error": "Only administrators can perform this action"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        uploaded_file = request.FILES.get('file')
+        if not uploaded_file:
+            return Response(
+                {'error': 'file is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            fmt = request.data.get('format') or detect_format(uploaded_file.name)
+            batch_size = int(request.data.get('batch_size', DEFAULT_BATCH_SIZE))
+            start_after = int(request.data.get('start_after', 0))
+        except ValueError as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            report = import_catalog(
+                open_text_stream(uploaded_file),
+                fmt,
+                batch_size=max(1, min(batch_size, DEFAULT_BATCH_SIZE)),
+                start_after=start_after
+            )
+            return Response(report, status=status.HTTP_200_OK)
+
+        except ValueError as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class AdminItemExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Stream the whole catalog with sizes and stock as CSV or JSON lines.
+
+        Use ?export_format=csv|jsonl (DRF reserves ?format for renderers).
+        """
+        if not request.user.is_superuser:
+            return Response(
+                {"error": "Only administrators can perform this action"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        fmt = request.query_params.get('export_format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return export_response(stream_items(fmt), fmt, 'items')
+
+
+class AdminLowStockView(APIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = CustomPagination
+
+    def get(self, request):
+        """
+        List sizes at or below their low-stock threshold, emptiest first,
+        with their live stock level. ?out_of_stock=true keeps only sold-out
+        sizes. Reads the partial index on flagged sizes, not every size.
+        """
+        if not request.user.is_superuser:
+            return Response(
+                {"error": "Only administrators can perform this action"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        queryset = with_stock_level(ItemSize.objects.filter(low_stock=True))
+        if request.query_params.get('out_of_stock', '').lower() in ('1', 'true'):
+            queryset = queryset.filter(in_stock=False)
+        queryset = queryset.values(
+            'id', 'item_id', 'item__name', 'size', 'stock_level', 'low_stock_threshold', 'in_stock'
+        ).order_by('stock_level', 'id')
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request)
+        return paginator.get_paginated_response([
+            {
+                'size_id': row['id'],
+                'item_id': row['item_id'],
+                'item_name': row['item__name'],
+                'size': row['size'],
+                'stock_level': row['stock_level'],
+                'low_stock_threshold': row['low_stock_threshold'],
+                'in_stock': row['in_stock'],
+            }
+            for row in page
+        ])
@@ -90,6 +90,73 @@ DATABASES = {
     }
 }
 
+# Optional read replica for the admin sales analytics, so dashboard queries stay off the primary
+if os.getenv('ANALYTICS_DATABASE_URL'):
+    analyticsPostgres = urlparse(os.getenv('ANALYTICS_DATABASE_URL'))
+    DATABASES['analytics'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': analyticsPostgres.path.replace('/', ''),
+        'USER': analyticsPostgres.username,
+        'PASSWORD': analyticsPostgres.password,
+        'HOST': analyticsPostgres.hostname,
+        'PORT': analyticsPostgres.port or 5432,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Cache - Redis when REDIS_URL is set (shared by every worker), per-process memory otherwise.
+# Values other workers must see change (e.g. cart badge counts) are only cached
+# in a shared cache; with per-process memory they are read from the database.
+# 'carts' holds cart records for the key-value cart backend. Records with
+# unflushed changes are their only copy and are stored without a TTL, so the
+# Redis instance must run with maxmemory-policy volatile-lru / volatile-ttl
+# (or noeviction), never allkeys-*.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+            'KEY_PREFIX': 'carts',
+            'TIMEOUT': 60 * 60 * 24 * 30,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'carts',
+            'TIMEOUT': 60 * 60 * 24 * 30,
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        },
+    }
+
+# Cart storage - ORM rows by default; 'users.cart_storage.KeyValueCartStorage'
+# keeps carts in the 'carts' cache and writes them back to the database
+# CART_FLUSH_DELAY seconds after a change (and always before checkout). It
+# caches the product data cart reads need for up to CART_CATALOG_TIMEOUT seconds
+CART_STORAGE_BACKEND = os.getenv('CART_STORAGE_BACKEND', 'users.cart_storage.ORMCartStorage')
+CART_FLUSH_DELAY = float(os.getenv('CART_FLUSH_DELAY', '2'))
+CART_CATALOG_TIMEOUT = int(os.getenv('CART_CATALOG_TIMEOUT', '60'))
+# The key-value backend refuses a per-process 'carts' cache unless this is set
+# (a single-process development server)
+CART_STORAGE_ALLOW_LOCAL_CACHE = os.getenv('CART_STORAGE_ALLOW_LOCAL_CACHE', 'false').lower() == 'true'
+
+# Emails are queued in the email_outbox table and sent by `manage.py run_outbox_worker`;
+# 'users.outbox.LocMemTransport' records them in memory instead of sending (tests, local dev)
+EMAIL_OUTBOX_TRANSPORT = os.getenv('EMAIL_OUTBOX_TRANSPORT', 'users.outbox.ResendTransport')
+# Resend API timeouts (seconds), and the circuit breaker that stops calling it after
+# EMAIL_BREAKER_THRESHOLD failures in a row, for EMAIL_BREAKER_RESET seconds
+EMAIL_CONNECT_TIMEOUT = float(os.getenv('EMAIL_CONNECT_TIMEOUT', '3.05'))
+EMAIL_READ_TIMEOUT = float(os.getenv('EMAIL_READ_TIMEOUT', '10'))
+EMAIL_BREAKER_THRESHOLD = int(os.getenv('EMAIL_BREAKER_THRESHOLD', '5'))
+EMAIL_BREAKER_RESET = float(os.getenv('EMAIL_BREAKER_RESET', '30'))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -155,6 +222,7 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
     'cache-control',
     'pragma',
+    'idempotency-key',
 ]
 
 CORS_ALLOW_METHODS = [
@@ -174,6 +242,7 @@ CORS_ALLOW_PRIVATE_NETWORK = True
 CORS_EXPOSE_HEADERS = [
     'Content-Length',
     'Content-Type',
+    'Idempotent-Replayed',
 ]
 
 # Security settings - different for development and production
@@ -0,0 +1,505 @@
+import logging
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Sum, Value, prefetch_related_objects
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from items.models import Category, Item, ItemImage, ItemSize
+from items.inventory import lock_stock, size_stock_level, stock_levels
+from items.reservations import InsufficientStock, available_quantities, reserve
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+CART_COUNT_CACHE_TIMEOUT = 300
+
+
+def is_shared_cache(alias):
+    """False for caches each process keeps to itself (local memory, dummy)"""
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+def line_prefetches(prefix='item__'):
+    """Primary image and category prefetches for cart lines (prefix='' for Items themselves)"""
+    return [
+        Prefetch(
+            f'{prefix}images',
+            queryset=ItemImage.objects.filter(is_primary=True, quality='low').only(
+                'id', 'item_id', 'image_url'
+            ).order_by('id'),
+            to_attr='primary_images'
+        ),
+        Prefetch(
+            f'{prefix}categories',
+            queryset=Category.objects.only('id', 'name').order_by('id'),
+            to_attr='category_list'
+        ),
+    ]
+
+
+def cart_items_queryset(cart_id):
+    """
+    Cart lines with everything the cart drawer shows, in a fixed number of queries.
+
+    One query for the lines (joined with item and size), one for the primary
+    low-quality images and one for the category names, however many lines
+    the cart holds.
+    """
+    return CartItem.objects.filter(cart_id=cart_id).select_related(
+        'item', 'size'
+    ).annotate(
+        stock_level=size_stock_level('size')
+    ).prefetch_related(*line_prefetches()).order_by('-created_at')
+
+
+def prefetch_cart_lines(lines):
+    """
+    Load what serialize_cart_item needs for CartItem instances that didn't come
+    from cart_items_queryset (e.g. lines held by a key-value cart backend).
+    Returns the lines newest first.
+    """
+    lines = sorted(lines, key=lambda line: line.created_at, reverse=True)
+    prefetch_related_objects(lines, 'item', 'size', *line_prefetches())
+    levels = stock_levels({line.size_id for line in lines})
+    for line in lines:
+        line.stock_level = levels.get(line.size_id, 0)
+    return lines
+
+
+def serialize_cart_item(cart_item):
+    """Response shape of one cart line, read from the prefetched relations"""
+    item = cart_item.item
+    primary_image = item.primary_images[0] if item.primary_images else None
+    category_names = [category.name for category in item.category_list]
+    return {
+        'id': item.id,
+        'cart_item_id': cart_item.id,
+        'name': item.name,
+        'price': str(item.price),
+        'size': cart_item.size.size,
+        'quantity': cart_item.quantity,
+        'total_available': cart_item.stock_level,
+        'image_url': primary_image.image_url if primary_image else None,
+        'categories': ', '.join(category_names) if category_names else None
+    }
+
+
+# Cart counters
+
+def cart_count_cache_key(user_id):
+    return f'cart-count:{user_id}'
+
+
+def _counts_cached():
+    """
+    Counters are only cached in a cache every worker shares: deleting a key
+    from a per-process one would leave the other workers' copies stale.
+    """
+    return is_shared_cache(DEFAULT_CACHE_ALIAS)
+
+
+def invalidate_cart_counts(user_id):
+    """Drop the cached counters once the surrounding transaction (if any) commits"""
+    if not _counts_cached():
+        return
+
+    def drop():
+        try:
+            cache.delete(cart_count_cache_key(user_id))
+        except Exception as e:
+            logger.warning(f"Could not invalidate cart count for user {user_id}: {str(e)}")
+    transaction.on_commit(drop)
+
+
+def adjust_cart_counters(user_id, quantity_delta=0, line_delta=0):
+    """
+    Apply a change in cart contents to the user's denormalized counters.
+
+    A single UPDATE with F() expressions, so concurrent changes to the same
+    cart add up instead of overwriting each other.
+    """
+    if quantity_delta or line_delta:
+        Cart.objects.filter(user_id=user_id).update(
+            total_quantity=Greatest(F('total_quantity') + quantity_delta, Value(0)),
+            line_count=Greatest(F('line_count') + line_delta, Value(0)),
+            updated_at=timezone.now()
+        )
+    invalidate_cart_counts(user_id)
+
+
+def reset_cart_counters(user_id):
+    """Zero the counters after the cart has been emptied (e.g. by checkout)"""
+    Cart.objects.filter(user_id=user_id).update(
+        total_quantity=0,
+        line_count=0,
+        updated_at=timezone.now()
+    )
+    invalidate_cart_counts(user_id)
+
+
+def recompute_cart_counters(user_ids):
+    """
+    Set the users' counters from their remaining cart lines, for when lines
+    went away without going through the cart code (e.g. cascaded from a
+    deleted item or size). One UPDATE with correlated subqueries.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.filter(user_id__in=user_ids).update(
+        total_quantity=Coalesce(Subquery(lines.annotate(total=Sum('quantity')).values('total')), Value(0)),
+        line_count=Coalesce(Subquery(lines.annotate(total=Count('id')).values('total')), Value(0)),
+        updated_at=timezone.now()
+    )
+    for user_id in user_ids:
+        invalidate_cart_counts(user_id)
+
+
+def get_cart_counts(user_id):
+    """
+    The user's cart badge counts: {'total_quantity', 'line_count'}.
+
+    Served from the cache with a single key lookup; on a miss (or if the cache
+    is unavailable, or per-process) the counters are read from the cart row,
+    never aggregated.
+    """
+    if not _counts_cached():
+        return _read_cart_counts(user_id)
+
+    key = cart_count_cache_key(user_id)
+    try:
+        counts = cache.get(key)
+        if counts is not None:
+            return counts
+    except Exception as e:
+        logger.warning(f"Cart count cache unavailable: {str(e)}")
+
+    counts = _read_cart_counts(user_id)
+    try:
+        cache.set(key, counts, CART_COUNT_CACHE_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Cart count cache unavailable: {str(e)}")
+    return counts
+
+
+def _read_cart_counts(user_id):
+    counts = Cart.objects.filter(user_id=user_id).values('total_quantity', 'line_count').first()
+    return counts or {'total_quantity': 0, 'line_count': 0}
+
+
+# Guest cart merge
+
+def merge_guest_cart(user, guest_items):
+    """
+    Merge the lines of a guest (browser) cart into the user's cart.
+
+    Items and sizes are fetched with one in_bulk each, new lines are written
+    with one bulk_create and merged lines with one bulk_update, all in a single
+    transaction, so login cost no longer grows with queries per guest line.
+    Quantities of lines already in the cart are summed, capped at the stock.
+    Returns a report of added, updated and failed lines.
+    """
+    parsed = []
+    failed_items = []
+    for guest_item in guest_items:
+        try:
+            parsed.append((
+                int(guest_item['id']),
+                int(guest_item['size_id']),
+                int(guest_item['quantity'])
+            ))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Error processing guest cart item: {str(e)}")
+            failed_items.append({
+                'item_id': guest_item.get('id') if isinstance(guest_item, dict) else None,
+                'size_id': guest_item.get('size_id') if isinstance(guest_item, dict) else None,
+                'quantity': guest_item.get('quantity') if isinstance(guest_item, dict) else None,
+                'reason': 'processing_error'
+            })
+
+    added_items = []
+    updated_items = []
+
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(user=user)
+
+        items = Item.objects.in_bulk({item_id for item_id, _, _ in parsed})
+        sizes = ItemSize.objects.in_bulk({size_id for _, size_id, _ in parsed})
+        # Units other shoppers hold in their carts can't be merged in; the stock
+        # locks keep them from changing until the merged lines are reserved
+        lock_stock(list(sizes))
+        available = available_quantities(sizes.values(), exclude_user_id=user.id)
+        lines = {
+            (line.item_id, line.size_id): line
+            for line in CartItem.objects.filter(cart=cart)
+        }
+
+        to_create = {}
+        to_update = {}
+        quantity_delta = 0
+        now = timezone.now()
+
+        for item_id, size_id, requested_quantity in parsed:
+            item = items.get(item_id)
+            size = sizes.get(size_id)
+            if item is None or size is None:
+                failed_items.append({
+                    'item_id': item_id,
+                    'size_id': size_id,
+                    'quantity': requested_quantity,
+                    'reason': 'item_not_found'
+                })
+                continue
+
+            # Check stock availability
+            if requested_quantity > available[size_id]:
+                failed_items.append({
+                    'item_name': item.name,
+                    'size': size.size,
+                    'requested_quantity': requested_quantity,
+                    'available_quantity': available[size_id],
+                    'reason': 'insufficient_stock'
+                })
+                continue
+
+            key = (item_id, size_id)
+            line = lines.get(key)
+            if line is None:
+                # New item - add to user cart
+                line = CartItem(cart=cart, item=item, size=size, quantity=requested_quantity)
+                lines[key] = line
+                to_create[key] = line
+                quantity_delta += requested_quantity
+                added_items.append({
+                    'item_name': item.name,
+                    'size': size.size,
+                    'quantity': requested_quantity
+                })
+                continue
+
+            # Item already in the cart - sum quantities, but respect stock limits
+            old_quantity = line.quantity
+            new_quantity = old_quantity + requested_quantity
+            if new_quantity > available[size_id]:
+                new_quantity = max(available[size_id], old_quantity)
+                failed_items.append({
+                    'item_name': item.name,
+                    'size': size.size,
+                    'requested_quantity': requested_quantity,
+                    'existing_quantity': old_quantity,
+                    'final_quantity': new_quantity,
+                    'reason': 'partial_merge_due_to_stock'
+                })
+
+            line.quantity = new_quantity
+            line.updated_at = now
+            if key not in to_create:
+                to_update[key] = line
+            quantity_delta += new_quantity - old_quantity
+            updated_items.append({
+                'item_name': item.name,
+                'size': size.size,
+                'old_quantity': old_quantity,
+                'added_quantity': requested_quantity,
+                'final_quantity': new_quantity
+            })
+
+        if to_create:
+            CartItem.objects.bulk_create(to_create.values())
+        if to_update:
+            CartItem.objects.bulk_update(to_update.values(), ['quantity', 'updated_at'])
+        adjust_cart_counters(user.id, quantity_delta, len(to_create))
+        reserve(user.id, {line.size_id: line.quantity for line in lines.values()})
+
+    return {
+        'success': True,
+        'total_guest_items': len(guest_items),
+        'added_items': added_items,
+        'updated_items': updated_items,
+        'failed_items': failed_items,
+        'message': f"Cart merge completed. Added {len(added_items)} new items, updated {len(updated_items)} existing items."
+    }
+
+
+# Batched cart mutations
+
+CART_OPERATIONS = ('add', 'set', 'remove')
+
+
+class CartOperationError(ValueError):
+    """An operation in a batch that can't be applied; nothing in the batch is"""
+
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+
+
+class CartLineNotFound(CartOperationError):
+    pass
+
+
+def _parse_quantity(index, operation, allow_zero=False):
+    try:
+        quantity = int(operation['quantity'])
+    except KeyError:
+        raise CartOperationError(index, 'quantity is required')
+    except (TypeError, ValueError):
+        raise CartOperationError(index, 'quantity must be an integer')
+    if quantity < 0 or (quantity == 0 and not allow_zero):
+        raise CartOperationError(index, 'Quantity must be greater than 0')
+    return quantity
+
+
+def _parse_item_and_size(index, operation, sizes):
+    try:
+        item_id = int(operation['item_id'])
+        size = sizes.get(int(operation['size_id']))
+    except (KeyError, TypeError, ValueError):
+        raise CartOperationError(index, 'item_id and size_id are required')
+    if size is None or size.item_id != item_id:
+        raise CartOperationError(index, 'Invalid item or size')
+    return item_id, size
+
+
+def plan_cart_operations(lines, operations, cart_id, user_id, sizes=None, available=None):
+    """
+    Validate operations and apply them to in-memory cart lines.
+
+    lines: dict of line id -> CartItem; quantities are changed in place and
+        removed lines are left with quantity 0 for the caller to drop
+    operations: list of dicts, each one of
+        {'op': 'add', 'item_id', 'size_id', 'quantity'}  add to (or create) a line
+        {'op': 'set', 'cart_item_id' | 'item_id' + 'size_id', 'quantity'}
+                                                          set a line's quantity, 0 removes it
+        {'op': 'remove', 'cart_item_id'}                 remove a line
+    Operations apply in order, so later ones see the effect of earlier ones.
+    Quantities are checked against stock minus other users' active
+    reservations, read with one query each; nothing is written. A caller
+    holding that data elsewhere (the key-value cart backend) passes sizes
+    (size id -> ItemSize with item_id and size) and available (size id ->
+    units) instead; either way the binding check is reserve_cart_lines'.
+    Returns the new (unsaved) lines. Raises CartOperationError if any
+    operation is invalid.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError(None, 'operations must be a non-empty list')
+
+    by_key = {(line.item_id, line.size_id): line for line in lines.values()}
+    size_ids = {line.size_id for line in lines.values()}
+    for operation in operations:
+        if isinstance(operation, dict) and 'size_id' in operation:
+            try:
+                size_ids.add(int(operation['size_id']))
+            except (TypeError, ValueError):
+                pass
+    if sizes is None:
+        sizes = ItemSize.objects.in_bulk(size_ids)
+    if available is None:
+        available = available_quantities(sizes.values(), exclude_user_id=user_id)
+
+    now = timezone.now()
+    new_lines = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise CartOperationError(index, f"op must be one of {', '.join(CART_OPERATIONS)}")
+
+        if operation['op'] == 'add' or 'cart_item_id' not in operation:
+            if operation['op'] == 'remove':
+                raise CartOperationError(index, 'cart_item_id is required')
+            quantity = _parse_quantity(index, operation, allow_zero=operation['op'] == 'set')
+            item_id, size = _parse_item_and_size(index, operation, sizes)
+            line = by_key.get((item_id, size.id))
+            if line is None:
+                line = CartItem(
+                    cart_id=cart_id, item_id=item_id, size_id=size.id, quantity=0,
+                    created_at=now, updated_at=now
+                )
+                by_key[(item_id, size.id)] = line
+                new_lines.append(line)
+            line.quantity = line.quantity + quantity if operation['op'] == 'add' else quantity
+        else:
+            try:
+                line = lines.get(int(operation['cart_item_id']))
+            except (TypeError, ValueError):
+                line = None
+            if line is None:
+                raise CartLineNotFound(index, 'Cart item not found')
+            line.quantity = 0 if operation['op'] == 'remove' else _parse_quantity(
+                index, operation, allow_zero=True
+            )
+            size = sizes[line.size_id]
+
+        if line.quantity > available[size.id]:
+            raise CartOperationError(
+                index, f"Only {available[size.id]} items available in size {size.size}"
+            )
+
+    return new_lines
+
+
+def apply_cart_operations(user, operations):
+    """
+    Apply a list of cart operations (see plan_cart_operations) to the user's
+    stored cart, atomically.
+
+    The result is written with one bulk_create, one bulk_update and one
+    delete. Raises CartOperationError (and changes nothing) if any operation
+    is invalid. Returns (cart, lines remaining in the cart).
+    """
+    with transaction.atomic():
+        # Lock the cart row so concurrent batches for the same user serialize
+        cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+        lines = {line.id: line for line in CartItem.objects.filter(cart=cart)}
+        original = {line_id: line.quantity for line_id, line in lines.items()}
+
+        new_lines = plan_cart_operations(lines, operations, cart.id, user.id)
+
+        now = timezone.now()
+        to_create = [line for line in new_lines if line.quantity > 0]
+        to_delete = [line_id for line_id, line in lines.items() if line.quantity == 0]
+        to_update = []
+        for line_id, line in lines.items():
+            if line.quantity > 0 and line.quantity != original[line_id]:
+                line.updated_at = now
+                to_update.append(line)
+
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+        if to_delete:
+            CartItem.objects.filter(id__in=to_delete).delete()
+
+        quantity_delta = (
+            sum(line.quantity for line in to_create)
+            + sum(line.quantity - original[line_id] for line_id, line in lines.items())
+        )
+        adjust_cart_counters(user.id, quantity_delta, len(to_create) - len(to_delete))
+
+        # Hold what is in the cart for the reservation TTL, restarted on every change
+        remaining = [line for line in lines.values() if line.quantity > 0] + to_create
+        grown = {line.size_id for line in to_create} | {
+            line.size_id for line in to_update if line.quantity > original[line.id]
+        }
+        reserve_cart_lines(user.id, remaining, grown)
+
+    return cart, remaining
+
+
+def reserve_cart_lines(user_id, lines, grown_size_ids):
+    """
+    Reserve what the cart lines hold (see items.reservations.reserve). The
+    binding stock check for the sizes the operations grew happens here, under
+    the sizes' stock locks; plan_cart_operations' unlocked check only fails
+    fast. Raises CartOperationError if another shopper got the units first.
+    """
+    try:
+        reserve(user_id, {line.size_id: line.quantity for line in lines}, increased=grown_size_ids)
+    except InsufficientStock as e:
+        label = ItemSize.objects.filter(id=e.size_id).values_list('size', flat=True).first()
+        raise CartOperationError(None, f"Only {e.available} items available in size {label}")
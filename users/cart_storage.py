@@ -0,0 +1,499 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connection, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from items.inventory import with_stock_level
+from items.models import Category, Item, ItemImage, ItemSize
+from .cart import (
+    cart_items_queryset, prefetch_cart_lines, line_prefetches, is_shared_cache, apply_cart_operations, plan_cart_operations,
+    reserve_cart_lines, get_cart_counts, invalidate_cart_counts, merge_guest_cart
+)
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CART_STORAGE = 'users.cart_storage.ORMCartStorage'
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 5
+
+_storage = None
+
+
+def get_cart_storage():
+    """The cart storage backend configured by settings.CART_STORAGE_BACKEND"""
+    global _storage
+    if _storage is None:
+        backend = getattr(settings, 'CART_STORAGE_BACKEND', DEFAULT_CART_STORAGE)
+        _storage = import_string(backend)()
+    return _storage
+
+
+class CartStorageBusy(Exception):
+    pass
+
+
+class ORMCartStorage:
+    """
+    Carts stored directly as Cart/CartItem rows (the default).
+
+    Every method maps onto the helpers in users.cart; there is nothing to
+    flush because the rows are the source of truth.
+    """
+
+    def get_cart(self, user):
+        """(cart id, lines newest first, ready for serialize_cart_item); (None, []) if no cart"""
+        cart_id = Cart.objects.filter(user=user).values_list('id', flat=True).first()
+        if cart_id is None:
+            return None, []
+        return cart_id, list(cart_items_queryset(cart_id))
+
+    def apply(self, user, operations):
+        """Apply cart operations atomically; returns (cart id, remaining lines)"""
+        cart, lines = apply_cart_operations(user, operations)
+        return cart.id, lines
+
+    def display_lines(self, lines):
+        """Lines returned by apply, newest first and ready for serialize_cart_item"""
+        return prefetch_cart_lines(lines)
+
+    def get_counts(self, user_id):
+        return get_cart_counts(user_id)
+
+    def merge_guest_cart(self, user, guest_items):
+        return merge_guest_cart(user, guest_items)
+
+    def flush(self, user_id):
+        pass
+
+    @contextmanager
+    def checkout(self, user_id):
+        """Wraps the checkout transaction; the rows are already current"""
+        yield
+
+    def invalidate_items(self, item_ids):
+        pass
+
+
+class KeyValueCartStorage:
+    """
+    Carts held as compact records in the 'carts' cache, persisted to
+    CartItem rows behind the writes. The cache must be shared by every
+    worker (Redis); a per-process one is refused at startup unless
+    CART_STORAGE_ALLOW_LOCAL_CACHE is set (single-process development).
+
+    A record is {'cart_id', 'version', 'flushed', 'lines'} where each line
+    is [id, item_id, size_id, quantity, created_at timestamp]. Line ids are
+    CartItem ids taken from blocks of the id sequence each process holds,
+    and the rows are written with them, so a cart_item_id stays valid after
+    the record is evicted and rebuilt.
+
+    Everything a cart read or a cart change needs about the products (name,
+    price, primary image, categories, size labels and stock levels) comes
+    from per-item catalog entries in the same cache, kept CART_CATALOG_TIMEOUT
+    seconds and dropped when an item or size is saved or deleted or a
+    checkout sells it. On warm entries reads touch no database at all and
+    writes only the stock reservations, which are taken synchronously under
+    the cart lock: the binding stock check can't wait for the write-behind.
+    Changed carts are written back to CartItem rows by a background thread
+    shortly afterwards, and synchronously before checkout reads them. On a
+    cache miss the record is rebuilt from the rows. Lines whose item or size
+    has been deleted are dropped the next time the record is read or written.
+    """
+
+    cache_alias = 'carts'
+    id_block = 100
+
+    def __init__(self):
+        self.cache = caches[self.cache_alias]
+        if not is_shared_cache(self.cache_alias) and not getattr(settings, 'CART_STORAGE_ALLOW_LOCAL_CACHE', False):
+            # Each worker would hold (and flush) its own version of a cart, and
+            # the cart lock would only exclude threads of the same process
+            raise ImproperlyConfigured(
+                f"KeyValueCartStorage needs the '{self.cache_alias}' cache to be shared by every "
+                f"worker (e.g. Redis via REDIS_URL), not {type(self.cache).__name__}"
+            )
+        self.flush_delay = getattr(settings, 'CART_FLUSH_DELAY', 2)
+        self.catalog_timeout = getattr(settings, 'CART_CATALOG_TIMEOUT', 60)
+        self._queue = queue.Queue()
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+        self._ids = []
+        self._ids_lock = threading.Lock()
+
+    def _key(self, user_id):
+        # v2: line ids are CartItem ids (records under 'cart:' numbered them locally)
+        return f'cart:v2:{user_id}'
+
+    def _catalog_key(self, item_id):
+        return f'cart-catalog:{item_id}'
+
+    @contextmanager
+    def _lock(self, user_id):
+        """Per-user lock held in the cache itself, so it spans processes"""
+        lock_key = f'cart-lock:{user_id}'
+        deadline = time.monotonic() + LOCK_WAIT
+        while not self.cache.add(lock_key, 1, LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise CartStorageBusy(f'Cart for user {user_id} is locked')
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            self.cache.delete(lock_key)
+
+    # Records
+
+    def _save(self, user_id, record):
+        """
+        Store the record. One with unflushed changes is its only copy, so it is
+        stored without expiry (Redis' volatile-* eviction policies never pick
+        it); once flushed it gets the cache's default timeout again.
+        """
+        if record['version'] != record['flushed']:
+            self.cache.set(self._key(user_id), record, None)
+        else:
+            self.cache.set(self._key(user_id), record)
+
+    def _load(self, user_id, create=False):
+        """The user's record, rebuilt from the database on a miss; None if there is no cart"""
+        record = self.cache.get(self._key(user_id))
+        if record is not None:
+            return record
+
+        cart = Cart.objects.filter(user_id=user_id).only('id').first()
+        if cart is None:
+            if not create:
+                return None
+            cart, created = Cart.objects.get_or_create(user_id=user_id)
+
+        lines = [
+            [line_id, item_id, size_id, quantity, created_at.timestamp()]
+            for line_id, item_id, size_id, quantity, created_at in CartItem.objects.filter(
+                cart=cart
+            ).values_list('id', 'item_id', 'size_id', 'quantity', 'created_at')
+        ]
+        record = {
+            'cart_id': cart.id,
+            'version': 0,
+            'flushed': 0,
+            'lines': lines,
+        }
+        self._save(user_id, record)
+        return record
+
+    def _prune(self, record, live):
+        """
+        Drop lines whose (size id, item id) isn't in live, i.e. whose size or
+        item has been deleted. Returns True if the record changed.
+        """
+        lines = [line for line in record['lines'] if (line[2], line[1]) in live]
+        if len(lines) == len(record['lines']):
+            return False
+        record['lines'] = lines
+        record['version'] += 1
+        return True
+
+    def _allocate_ids(self, count):
+        """
+        count CartItem ids for new lines. Ids come from the table's sequence,
+        so they never collide with rows written elsewhere, but a block of
+        id_block is fetched at a time: most new lines cost no round trip.
+        """
+        with self._ids_lock:
+            if len(self._ids) < count:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                        [CartItem._meta.db_table, max(self.id_block, count - len(self._ids))]
+                    )
+                    self._ids.extend(row[0] for row in cursor.fetchall())
+            ids, self._ids = self._ids[:count], self._ids[count:]
+        return ids
+
+    def _lines(self, record):
+        """Unsaved CartItem instances for a record's lines, keyed by line id"""
+        lines = {}
+        for line_id, item_id, size_id, quantity, created_at in record['lines']:
+            created_at = datetime.fromtimestamp(created_at, tz=dt_timezone.utc)
+            lines[line_id] = CartItem(
+                id=line_id, cart_id=record['cart_id'], item_id=item_id, size_id=size_id,
+                quantity=quantity, created_at=created_at, updated_at=created_at
+            )
+        return lines
+
+    # Catalog
+
+    def _catalog(self, item_ids):
+        """
+        Catalog entries for the items, item id -> {'name', 'price',
+        'image_url', 'categories', 'sizes': {size id: [label, stock level]}}.
+        Misses are loaded in a fixed number of queries and cached; deleted
+        items are missing from the result.
+        """
+        item_ids = set(item_ids)
+        cached = self.cache.get_many([self._catalog_key(item_id) for item_id in item_ids])
+        catalog = {
+            item_id: cached[self._catalog_key(item_id)]
+            for item_id in item_ids if self._catalog_key(item_id) in cached
+        }
+        missing = item_ids - set(catalog)
+        if not missing:
+            return catalog
+
+        items = Item.objects.only('id', 'name', 'price').in_bulk(missing)
+        prefetch_related_objects(list(items.values()), *line_prefetches(prefix=''))
+        loaded = {
+            item.id: {
+                'name': item.name,
+                'price': str(item.price),
+                'image_url': item.primary_images[0].image_url if item.primary_images else None,
+                'categories': [category.name for category in item.category_list],
+                'sizes': {},
+            }
+            for item in items.values()
+        }
+        sizes = with_stock_level(ItemSize.objects.filter(item_id__in=list(items)).only('id', 'item_id', 'size'))
+        for size in sizes:
+            loaded[size.item_id]['sizes'][size.id] = [size.size, size.stock_level]
+        self.cache.set_many(
+            {self._catalog_key(item_id): entry for item_id, entry in loaded.items()}, self.catalog_timeout
+        )
+        catalog.update(loaded)
+        return catalog
+
+    def invalidate_items(self, item_ids):
+        """Drop the items' catalog entries (after a product change or a sale)"""
+        self.cache.delete_many([self._catalog_key(item_id) for item_id in set(item_ids)])
+
+    def _live(self, catalog):
+        return {
+            (size_id, item_id) for item_id, entry in catalog.items() for size_id in entry['sizes']
+        }
+
+    def _hydrate(self, lines, catalog):
+        """Give lines the item, size and stock level serialize_cart_item reads, from the catalog"""
+        items = {}
+        for line in lines:
+            entry = catalog[line.item_id]
+            item = items.get(line.item_id)
+            if item is None:
+                item = items[line.item_id] = Item(
+                    id=line.item_id, name=entry['name'], price=Decimal(entry['price'])
+                )
+                item.primary_images = [ItemImage(image_url=entry['image_url'])] if entry['image_url'] else []
+                item.category_list = [Category(name=name) for name in entry['categories']]
+            label, stock_level = entry['sizes'][line.size_id]
+            line.item = item
+            line.size = ItemSize(id=line.size_id, item_id=line.item_id, size=label)
+            line.stock_level = stock_level
+        return sorted(lines, key=lambda line: line.created_at, reverse=True)
+
+    # Storage interface
+
+    def get_cart(self, user):
+        record = self._load(user.id)
+        if record is None:
+            return None, []
+        catalog = self._catalog(line[1] for line in record['lines'])
+        live = self._live(catalog)
+        if any((line[2], line[1]) not in live for line in record['lines']):
+            # Something in the cart was deleted since the record was written
+            with self._lock(user.id):
+                record = self._load(user.id)
+                if self._prune(record, live):
+                    self._save(user.id, record)
+            self._schedule_flush(user.id)
+            catalog = self._catalog(line[1] for line in record['lines'])
+        return record['cart_id'], self._hydrate(self._lines(record).values(), catalog)
+
+    def apply(self, user, operations):
+        with self._lock(user.id):
+            record = self._load(user.id, create=True)
+            item_ids = {line[1] for line in record['lines']}
+            for operation in operations if isinstance(operations, list) else []:
+                try:
+                    item_ids.add(int(operation['item_id']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            catalog = self._catalog(item_ids)
+            self._prune(record, self._live(catalog))
+
+            # Stock levels are an upper bound that fails hopeless requests
+            # early; reserve_cart_lines checks against other carts for real
+            sizes = {}
+            available = {}
+            for item_id, entry in catalog.items():
+                for size_id, (label, stock_level) in entry['sizes'].items():
+                    sizes[size_id] = ItemSize(id=size_id, item_id=item_id, size=label)
+                    available[size_id] = max(stock_level, 0)
+
+            lines = self._lines(record)
+            original = {line_id: line.quantity for line_id, line in lines.items()}
+            new_lines = [
+                line for line in plan_cart_operations(
+                    lines, operations, record['cart_id'], user.id, sizes=sizes, available=available
+                )
+                if line.quantity > 0
+            ]
+            remaining = [line for line in list(lines.values()) + new_lines if line.quantity > 0]
+            grown = {line.size_id for line in new_lines} | {
+                line.size_id for line_id, line in lines.items() if line.quantity > original[line_id]
+            }
+            with transaction.atomic():
+                reserve_cart_lines(user.id, remaining, grown)
+
+            for line, line_id in zip(new_lines, self._allocate_ids(len(new_lines))):
+                line.id = line_id
+            record['lines'] = [
+                [line.id, line.item_id, line.size_id, line.quantity, line.created_at.timestamp()]
+                for line in remaining
+            ]
+            record['version'] += 1
+            self._save(user.id, record)
+
+        self._schedule_flush(user.id)
+        return record['cart_id'], self._hydrate(remaining, catalog)
+
+    def display_lines(self, lines):
+        """apply() already returns them hydrated from the catalog, newest first"""
+        return lines
+
+    def get_counts(self, user_id):
+        """Badge counts from the record itself: one key lookup on a hit"""
+        record = self._load(user_id)
+        lines = record['lines'] if record else []
+        return {
+            'total_quantity': sum(line[3] for line in lines),
+            'line_count': len(lines),
+        }
+
+    def merge_guest_cart(self, user, guest_items):
+        """
+        Merge through the rows (login is rare next to cart traffic), then let the
+        record be rebuilt from them on the next read.
+        """
+        with self._lock(user.id):
+            self._flush_locked(user.id)
+            report = merge_guest_cart(user, guest_items)
+            self.cache.delete(self._key(user.id))
+        return report
+
+    def flush(self, user_id):
+        """Write the user's record back to CartItem rows if it has unflushed changes"""
+        with self._lock(user_id):
+            self._flush_locked(user_id)
+
+    @contextmanager
+    def checkout(self, user_id):
+        """
+        Wraps the checkout transaction: flushes the record and holds the lock
+        until the transaction has ended, so no cart change can land between
+        the flush and the rows being deleted. The record is then dropped and
+        rebuilt from whatever the rows hold (nothing, if the order committed).
+        """
+        with self._lock(user_id):
+            self._flush_locked(user_id)
+            try:
+                yield
+            finally:
+                self.cache.delete(self._key(user_id))
+
+    # Write-behind
+
+    def _flush_locked(self, user_id):
+        record = self.cache.get(self._key(user_id))
+        if record is None:
+            return
+        # A line whose size was deleted meanwhile would fail its foreign key;
+        # the rows are written anyway, so check against them rather than the catalog
+        self._prune(record, set(ItemSize.objects.filter(
+            id__in={line[2] for line in record['lines']}
+        ).values_list('id', 'item_id')))
+        if record['version'] == record['flushed']:
+            return
+
+        incoming = {line[0]: line for line in record['lines']}
+        now = timezone.now()
+        with transaction.atomic():
+            Cart.objects.select_for_update().filter(id=record['cart_id']).first()
+            existing = {row.id: row for row in CartItem.objects.filter(cart_id=record['cart_id'])}
+
+            to_create = []
+            to_update = []
+            for line_id, line in incoming.items():
+                row = existing.get(line_id)
+                if row is None:
+                    to_create.append(CartItem(
+                        id=line_id, cart_id=record['cart_id'], item_id=line[1], size_id=line[2],
+                        quantity=line[3]
+                    ))
+                elif row.quantity != line[3]:
+                    row.quantity = line[3]
+                    row.updated_at = now
+                    to_update.append(row)
+            to_delete = [row_id for row_id in existing if row_id not in incoming]
+
+            if to_delete:
+                CartItem.objects.filter(id__in=to_delete).delete()
+            if to_update:
+                CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+            if to_create:
+                CartItem.objects.bulk_create(to_create)
+            Cart.objects.filter(id=record['cart_id']).update(
+                total_quantity=sum(line[3] for line in record['lines']),
+                line_count=len(record['lines']),
+                updated_at=now
+            )
+            invalidate_cart_counts(user_id)
+
+        record['flushed'] = record['version']
+        self._save(user_id, record)
+
+    def _schedule_flush(self, user_id):
+        with self._flusher_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush_pending)
+        self._queue.put(user_id)
+
+    def _drain(self):
+        user_ids = set()
+        while True:
+            try:
+                user_ids.add(self._queue.get_nowait())
+            except queue.Empty:
+                return user_ids
+
+    def _flush_many(self, user_ids):
+        for user_id in user_ids:
+            try:
+                self.flush(user_id)
+            except Exception as e:
+                logger.error(f"Error flushing cart for user {user_id}: {str(e)}")
+
+    def _run_flusher(self):
+        while True:
+            user_ids = {self._queue.get()}
+            # Let a burst of changes to the same cart coalesce into one write
+            time.sleep(self.flush_delay)
+            user_ids |= self._drain()
+            self._flush_many(user_ids)
+            close_old_connections()
+
+    def flush_pending(self):
+        """Flush every cart still waiting for the background thread (e.g. at shutdown)"""
+        self._flush_many(self._drain())
@@ -0,0 +1,258 @@
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+
+from items.models import Category, Item, ItemImage, ItemSize
+from items.inventory import lock_stock, record_movements, refresh_stock_flags, stock_flags, with_stock_level
+from items.reservations import reserved_quantities, release as release_reservations
+from .cart import reset_cart_counters
+from .cart_storage import get_cart_storage
+from .emails import order_confirmation_email
+from .models import Cart, CartItem, Order, OrderItem
+from .outbox import enqueue_email
+from .sales import queue_sales_rollup
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutError(Exception):
+    """A cart that can't be turned into an order; nothing has been written"""
+    pass
+
+
+def parse_guest_lines(guest_items):
+    """
+    (item_id, size_id, quantity) tuples from the guest cart sent by the frontend
+    (LocalCart items use 'id' for the item id).
+    """
+    lines = []
+    for guest_item in guest_items:
+        try:
+            line = (int(guest_item['id']), int(guest_item['size_id']), int(guest_item['quantity']))
+        except (KeyError, TypeError, ValueError):
+            raise CheckoutError("Invalid cart item")
+        if line[2] <= 0:
+            raise CheckoutError("Quantity must be greater than 0")
+        lines.append(line)
+    return lines
+
+
+def _check_stock(lines, sizes, reserved):
+    """
+    Raise CheckoutError unless every line fits in its size's live stock
+    level minus other shoppers' reservations. sizes: size id -> ItemSize
+    with stock_level and item loaded; the levels are decremented in place.
+    """
+    for item_id, size_id, quantity in lines:
+        size = sizes.get(size_id)
+        if size is None or size.item_id != item_id:
+            raise CheckoutError("One or more items in cart are no longer available")
+        available = size.stock_level - reserved.get(size_id, 0)
+        if quantity > available:
+            raise CheckoutError(
+                f"Only {max(available, 0)} items available for {size.item.name} in size {size.size}"
+            )
+        size.stock_level -= quantity
+
+
+def _sizes_with_stock(size_ids):
+    return with_stock_level(ItemSize.objects.select_related('item').filter(id__in=size_ids)).in_bulk()
+
+
+def _create_order(user, lines, shipping, exclude_user_id=None):
+    """
+    Check lines against stock and write the order, without taking the stock
+    yet: the caller ends the transaction with _take_stock(). Must run inside
+    transaction.atomic().
+
+    lines: list of (item_id, size_id, quantity)
+    shipping: Order field values (shipping_address, first_name, ...)
+    exclude_user_id: the buyer, whose own stock reservations don't count
+        against them
+
+    Items come from one in_bulk (plus one query each for their primary
+    images and their categories, snapshotted on the order items) and sizes
+    from one query with their live stock level. The stock check here takes
+    no lock, so a cart that can't be served fails fast; the binding check
+    is the one _take_stock repeats under the locks. The order items are one
+    bulk_create and the order is queued for the sales rollups (one insert). Returns (order, created OrderItems).
+    """
+    items = Item.objects.in_bulk({item_id for item_id, _, _ in lines})
+    prefetch_related_objects(
+        list(items.values()),
+        Prefetch(
+            'images',
+            queryset=ItemImage.objects.filter(is_primary=True, quality='low').order_by('id'),
+            to_attr='primary_images'
+        ),
+        Prefetch('categories', queryset=Category.objects.only('id', 'name').order_by('id'))
+    )
+    sizes = _sizes_with_stock({size_id for _, size_id, _ in lines})
+    if any(item_id not in items for item_id, _, _ in lines):
+        raise CheckoutError("One or more items in cart are no longer available")
+    _check_stock(lines, sizes, reserved_quantities(sizes, exclude_user_id=exclude_user_id))
+
+    total_price = sum(
+        (items[item_id].price * quantity for item_id, _, quantity in lines),
+        Decimal('0.00')
+    )
+
+    order = Order.objects.create(user=user, status='Pending', total_price=total_price, **shipping)
+    queue_sales_rollup(order)
+
+    order_items = OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order,
+            item=items[item_id],
+            size=sizes[size_id],
+            quantity=quantity,
+            price_at_time=items[item_id].price,
+            item_name=items[item_id].name,
+            size_label=sizes[size_id].size,
+            primary_image=(
+                items[item_id].primary_images[0].image_url
+                if items[item_id].primary_images else ''
+            ),
+            categories=[[category.id, category.name] for category in items[item_id].categories.all()]
+        )
+        for item_id, size_id, quantity in lines
+    ])
+    return order, order_items
+
+
+def _take_stock(order, lines, exclude_user_id=None):
+    """
+    Take the order's units: re-check the lines against the live levels under
+    the sizes' advisory locks and append one 'sale' movement per line.
+
+    Call it last in the checkout transaction. The locks are held until
+    commit (the movements only count for other buyers once committed, so a
+    check without them could pass twice for the last unit), which is why
+    everything else - order rows, cart clearing, rendering the confirmation
+    email - happens before they are taken: buyers of a popular size queue
+    only for this check, one insert and the commit. Size rows are never
+    written. Stock flags are refreshed only for items with a size that sold
+    out or ran low. Raises CheckoutError, rolling the whole order back.
+    """
+    size_ids = {size_id for _, size_id, _ in lines}
+    lock_stock(size_ids)
+    sizes = _sizes_with_stock(size_ids)
+    _check_stock(lines, sizes, reserved_quantities(sizes, exclude_user_id=exclude_user_id))
+
+    record_movements(
+        [(size_id, -quantity) for _, size_id, quantity in lines], 'sale', reference=f'order:{order.id}'
+    )
+    # Cart backends caching stock levels for display drop the sold items' entries
+    sold_item_ids = {item_id for item_id, _, _ in lines}
+    transaction.on_commit(lambda: get_cart_storage().invalidate_items(sold_item_ids))
+    # Item flags only need recomputing when a size crossed zero or its threshold
+    refresh_stock_flags({
+        size.item_id for size in sizes.values()
+        if stock_flags(size.stock_level, size.low_stock_threshold) != (size.in_stock, size.low_stock)
+    })
+
+
+def checkout_cart(user, cart_id, shipping, on_created=None):
+    """
+    Turn a signed-in user's cart into an order, atomically.
+
+    The cart row is locked, so a double-submitted checkout waits for the
+    first one (and then finds the cart empty). The cart is cleared, the
+    user's stock reservations released, the confirmation email queued and
+    finally the stock taken in the same transaction. on_created(order,
+    order_items), if given, runs in the transaction just before the stock
+    is taken, for writes that must commit with the order (e.g. the stored
+    idempotent response).
+    Raises Cart.DoesNotExist or CheckoutError. Returns (order, OrderItems).
+    """
+    # Carts held outside the database are written back before checkout reads
+    # them, and kept from changing until the transaction ends
+    with get_cart_storage().checkout(user.id), transaction.atomic():
+        cart = Cart.objects.select_for_update().get(id=cart_id, user=user)
+        lines = list(
+            CartItem.objects.filter(cart=cart).order_by('id').values_list('item_id', 'size_id', 'quantity')
+        )
+        if not lines:
+            raise CheckoutError("Cart is empty")
+
+        order, order_items = _create_order(user, lines, shipping, exclude_user_id=user.id)
+
+        CartItem.objects.filter(cart=cart).delete()
+        reset_cart_counters(user.id)
+        release_reservations(user.id)
+        queue_order_confirmation(order, order_items)
+        if on_created is not None:
+            on_created(order, order_items)
+        _take_stock(order, lines, exclude_user_id=user.id)
+
+    return order, order_items
+
+
+def checkout_guest(guest_items, shipping, on_created=None):
+    """
+    Create a guest order from the cart held by the frontend, atomically
+    (confirmation email queued in the same transaction). on_created is
+    called as in checkout_cart.
+
+    Raises CheckoutError. Returns (order, OrderItems).
+    """
+    lines = parse_guest_lines(guest_items)
+    if not lines:
+        raise CheckoutError("Cart is empty")
+
+    with transaction.atomic():
+        order, order_items = _create_order(None, lines, shipping)
+        queue_order_confirmation(order, order_items)
+        if on_created is not None:
+            on_created(order, order_items)
+        _take_stock(order, lines)
+
+    return order, order_items
+
+
+def order_item_summaries(order_items):
+    """Response (and email) shape of the created order items"""
+    return [
+        {
+            'id': order_item.id,
+            'item_name': order_item.item_name,
+            'size': order_item.size_label,
+            'quantity': order_item.quantity,
+            'price': str(order_item.price_at_time),
+            'image_url': order_item.primary_image or None
+        }
+        for order_item in order_items
+    ]
+
+
+def serialize_order(order, order_items):
+    """Response shape of a newly created order; order_items from order_item_summaries"""
+    return {
+        "id": order.id,
+        "status": order.status,
+        "total_price": str(order.total_price),
+        "shipping_address": order.shipping_address,
+        "shipping_phone": order.shipping_phone,
+        "shipping_email": order.shipping_email,
+        "first_name": order.first_name,
+        "last_name": order.last_name,
+        "zip_code": order.zip_code,
+        "city": order.city,
+        "created_at": order.created_at,
+        "items": order_items
+    }
+
+
+def queue_order_confirmation(order, order_items):
+    """
+    Queue the order confirmation for the outbox worker (run_outbox_worker).
+
+    Called inside the checkout transaction, so the email goes out if and
+    only if the order commits, and checkout never waits on the provider.
+    """
+    return enqueue_email(
+        'order_confirmation',
+        order_confirmation_email(order, order_item_summaries(order_items))
+    )
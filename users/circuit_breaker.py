@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """The breaker is refusing calls; retry_after is seconds until it lets one through"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stop calling a dependency that keeps failing.
+
+    Closed: calls go through; failure_threshold failures in a row open it.
+    Open: calls fail fast with CircuitOpen for reset_timeout seconds.
+    Half-open: one trial call goes through; success closes the breaker,
+    failure opens it again. Other calls are refused until the trial ends,
+    with retry_after set to what is left of its reset_timeout budget (a
+    trial running longer than that is presumed lost and another goes through).
+
+    State lives in the process, shared by every thread using the instance.
+    Only exceptions for which is_failure(exc) is true count against the
+    dependency (by default, all of them).
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, is_failure=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda exc: True)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_started_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def _before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return
+            now = time.monotonic()
+            if state == 'open':
+                retry_after = self.reset_timeout - (now - self._opened_at)
+            elif self._trial_started_at is None or now - self._trial_started_at >= self.reset_timeout:
+                self._trial_started_at = now
+                return
+            else:
+                retry_after = self.reset_timeout - (now - self._trial_started_at)
+            raise CircuitOpen(self.name, retry_after)
+
+    def _record(self, failed):
+        with self._lock:
+            self._trial_started_at = None
+            if not failed:
+                if self._opened_at is not None:
+                    logger.info(f"{self.name} circuit closed")
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"{self.name} circuit opened after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._record(self.is_failure(e))
+            raise
+        self._record(False)
+        return result
@@ -0,0 +1,47 @@
+from functools import lru_cache
+
+from django.template.loader import get_template
+
+SENDER = "Peter's Shop <no-reply@petershop.shop>"
+
+
+@lru_cache(maxsize=None)
+def _template(name):
+    """Compiled template, parsed once per process whatever the loader settings"""
+    return get_template(name)
+
+
+def render_email(name, context):
+    """(html, text) bodies from users/emails/<name>.html and <name>.txt"""
+    return (
+        _template(f'users/emails/{name}.html').render(context),
+        _template(f'users/emails/{name}.txt').render(context),
+    )
+
+
+def order_confirmation_email(order, order_items):
+    """
+    Provider payload of the order confirmation (and payment instructions)
+    email, shared by signed-in and guest checkout. order_items from
+    order_item_summaries.
+    """
+    html, text = render_email('order_confirmation', {'order': order, 'items': order_items})
+    return {
+        "from": SENDER,
+        "to": [order.shipping_email],
+        "subject": f"Thank You for Your Order #{order.id}",
+        "html": html,
+        "text": text
+    }
+
+
+def password_reset_email(email, reset_url):
+    """Provider payload of the password reset email"""
+    html, text = render_email('password_reset', {'reset_url': reset_url})
+    return {
+        "from": SENDER,
+        "to": [email],
+        "subject": "Reset Your Password",
+        "html": html,
+        "text": text
+    }
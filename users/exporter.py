@@ -0,0 +1,73 @@
+from django.db.models import Prefetch
+
+from items.exporter import EXPORT_CHUNK_SIZE, stream_csv, stream_jsonl
+from .models import Order, OrderItem
+
+ORDER_FIELDS = [
+    'id', 'user_id', 'status', 'total_price', 'shipping_name', 'shipping_email',
+    'shipping_phone', 'shipping_address', 'first_name', 'last_name', 'zip_code',
+    'city', 'guest_email', 'created_at', 'updated_at',
+]
+
+LINE_FIELDS = ['item_id', 'item_name', 'size_id', 'size', 'quantity', 'price_at_time', 'line_total']
+
+# One CSV row per order line, with the order columns repeated
+ORDER_CSV_HEADER = [f'order_{field}' if field != 'id' else 'order_id' for field in ORDER_FIELDS] + LINE_FIELDS
+
+
+def export_orders_queryset(status=None, created_from=None, created_to=None):
+    """
+    Orders with their lines, read through a server-side cursor in fixed-size chunks.
+    Lines carry their own item name and size label, so items and sizes aren't joined.
+    """
+    orders = Order.objects.prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.order_by('id'))
+    ).order_by('id')
+
+    if status:
+        orders = orders.filter(status=status)
+    if created_from:
+        orders = orders.filter(created_at__date__gte=created_from)
+    if created_to:
+        orders = orders.filter(created_at__date__lte=created_to)
+
+    return orders.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _order_record(order):
+    record = {field: getattr(order, field) for field in ORDER_FIELDS}
+    record['total_price'] = str(order.total_price)
+    record['items'] = [
+        {
+            'item_id': line.item_id,
+            'item_name': line.item_name,
+            'size_id': line.size_id,
+            'size': line.size_label,
+            'quantity': line.quantity,
+            'price_at_time': str(line.price_at_time),
+            'line_total': str(line.price_at_time * line.quantity),
+        }
+        for line in order.orderitem_set.all()
+    ]
+    return record
+
+
+def iter_order_records(**filters):
+    for order in export_orders_queryset(**filters):
+        yield _order_record(order)
+
+
+def iter_order_csv_rows(**filters):
+    for record in iter_order_records(**filters):
+        order_columns = [record[field] for field in ORDER_FIELDS]
+        order_columns[ORDER_FIELDS.index('created_at')] = record['created_at'].isoformat()
+        order_columns[ORDER_FIELDS.index('updated_at')] = record['updated_at'].isoformat()
+        for line in record['items']:
+            yield order_columns + [line[field] for field in LINE_FIELDS]
+
+
+def stream_orders(fmt, **filters):
+    """Generator of export chunks for orders matching the filters"""
+    if fmt == 'csv':
+        return stream_csv(ORDER_CSV_HEADER, iter_order_csv_rows(**filters))
+    return stream_jsonl(iter_order_records(**filters))
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+KEY_TTL = timedelta(hours=24)
+# An attempt still 'in_progress' after this long is assumed to have died with its worker
+IN_PROGRESS_TIMEOUT = timedelta(minutes=2)
+WAIT_TIMEOUT = 30
+POLL_INTERVAL = 0.1
+
+
+def request_fingerprint(request):
+    """SHA-256 of the request body, so a key can't be replayed for a different request"""
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _claim(scope, key, fingerprint):
+    """
+    Try to register the first attempt for a key.
+
+    Returns (record, True) when this request owns the key, or
+    (existing record, False) when another attempt got there first.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(
+                scope=scope,
+                key=key,
+                request_hash=fingerprint,
+                expires_at=now + KEY_TTL
+            ), True
+    except IntegrityError:
+        pass
+
+    existing = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+    if existing is None:
+        # Removed between our insert and this read (failed attempt); try again
+        return _claim(scope, key, fingerprint)
+
+    abandoned = existing.status == 'in_progress' and existing.updated_at < now - IN_PROGRESS_TIMEOUT
+    if existing.expires_at <= now or abandoned:
+        # Take over an expired key, or the attempt of a worker that died mid-request
+        taken = IdempotencyKey.objects.filter(
+            id=existing.id, updated_at=existing.updated_at
+        ).update(
+            request_hash=fingerprint,
+            status='in_progress',
+            response_status=None,
+            response_body=None,
+            expires_at=now + KEY_TTL,
+            updated_at=now
+        )
+        if taken:
+            existing.refresh_from_db()
+            return existing, True
+        return _claim(scope, key, fingerprint)
+
+    return existing, False
+
+
+def _wait_for_completion(record):
+    """Poll an in-flight attempt until it completes, fails or WAIT_TIMEOUT passes"""
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while record is not None and record.status == 'in_progress' and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(id=record.id).first()
+    return record
+
+
+def _store(record, response):
+    """Mark the key completed with exactly what the client receives, as rendered JSON"""
+    record.status = 'completed'
+    record.response_status = response.status_code
+    record.response_body = JSONRenderer().render(response.data).decode('utf-8')
+    record.save(update_fields=['status', 'response_status', 'response_body', 'updated_at'])
+
+
+def _release(record):
+    """
+    Release the key of an attempt that failed. Returns the completed record
+    instead if the attempt had already committed its work and response.
+    """
+    deleted, _ = IdempotencyKey.objects.filter(id=record.id, status='in_progress').delete()
+    if deleted:
+        return None
+    return IdempotencyKey.objects.filter(id=record.id, status='completed').first()
+
+
+def _replay(record):
+    response = Response(json.loads(record.response_body), status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent_response(request, scope, handler):
+    """
+    Run handler(complete) at most once per Idempotency-Key header value within scope.
+
+    Requests without the header run normally. The first request with a key
+    runs the handler and, if it succeeds (2xx), its response is stored for
+    KEY_TTL and replayed for every retry with the same key. A retry that
+    arrives while the first attempt is still running waits for it rather than
+    running the checkout a second time. Failed attempts release the key so
+    the client can retry with it. Reusing a key for a different request body
+    is rejected with 422.
+
+    The handler calls complete(response) with its success response inside
+    the transaction that does the work, so the stored response commits or
+    rolls back with it: a worker dying right after the commit can't leave
+    the key 'in_progress' for a retry to take over and run again. A 2xx
+    response the handler didn't complete is stored after it returns.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return handler(lambda response: response)
+    if len(key) > 255:
+        return Response(
+            {"error": f"{IDEMPOTENCY_HEADER} must be at most 255 characters"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    fingerprint = request_fingerprint(request)
+    while True:
+        record, owned = _claim(scope, key, fingerprint)
+        if owned:
+            break
+        if record.request_hash != fingerprint:
+            return Response(
+                {"error": f"{IDEMPOTENCY_HEADER} was already used for a different request"},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+
+        record = _wait_for_completion(record)
+        if record is None:
+            # The first attempt failed and released the key; try to own it now
+            continue
+        if record.status == 'completed':
+            return _replay(record)
+        return Response(
+            {"error": f"A request with this {IDEMPOTENCY_HEADER} is still being processed"},
+            status=status.HTTP_409_CONFLICT
+        )
+
+    def complete(response):
+        _store(record, response)
+        return response
+
+    try:
+        response = handler(complete)
+    except Exception:
+        _release(record)
+        raise
+
+    if not 200 <= response.status_code < 300:
+        # Failed after its work committed: answer with what was stored
+        completed = _release(record)
+        return _replay(completed) if completed else response
+
+    if record.status != 'completed':
+        _store(record, response)
+    return response
+
+
+def purge_expired_keys():
+    """Delete stored responses past their TTL. Returns the number removed."""
+    removed, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    if removed:
+        logger.info(f"Purged {removed} expired idempotency keys")
+    return removed
@@ -0,0 +1,45 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from users.emails import order_confirmation_email
+from users.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Time order confirmation rendering (HTML + text) for carts of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 100, 1000], help='Cart sizes to render')
+        parser.add_argument('--repeat', type=int, default=200, help='Renders per cart size')
+
+    def handle(self, *args, **options):
+        # Unsaved order: rendering never touches the database
+        order = Order(
+            id=1, status='Pending', total_price=Decimal('0.00'), shipping_email='bench@example.com',
+            shipping_address='1 Main St', shipping_phone='0000000000', first_name='Bench',
+            last_name='Mark', zip_code='00000', city='Toronto'
+        )
+        order_confirmation_email(order, [])  # Compile the templates outside the timings
+
+        for lines in options['lines']:
+            order_items = [
+                {
+                    'id': n,
+                    'item_name': f'Item {n}',
+                    'size': 'M',
+                    'quantity': 1,
+                    'price': '19.99',
+                    'image_url': None
+                }
+                for n in range(lines)
+            ]
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                order_confirmation_email(order, order_items)
+            per_render = (time.perf_counter() - start) / options['repeat']
+            self.stdout.write(
+                f"{lines:>6} lines: {per_render * 1000:8.3f} ms per render, "
+                f"{per_render * 1e6 / lines:8.2f} us per line"
+            )
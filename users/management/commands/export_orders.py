@@ -0,0 +1,42 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from items.exporter import EXPORT_FORMATS
+from users.exporter import stream_orders
+
+
+class Command(BaseCommand):
+    help = 'Export orders with their order lines as CSV or JSON lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help='Output format')
+        parser.add_argument('--output', help='File to write (defaults to stdout)')
+        parser.add_argument('--status', help='Only export orders with this status')
+        parser.add_argument('--from', dest='created_from', help='Only orders created on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='created_to', help='Only orders created on or before this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        try:
+            created_from = date.fromisoformat(options['created_from']) if options['created_from'] else None
+            created_to = date.fromisoformat(options['created_to']) if options['created_to'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            chunks = stream_orders(
+                options['format'],
+                status=options['status'],
+                created_from=created_from,
+                created_to=created_to
+            )
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Exported orders to {options['output']}"))
@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from users.outbox import BATCH_SIZE, drain, get_transport, process_batch, requeue_dead
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox (order confirmations, password resets) with retries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Threads sending in parallel')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Messages claimed per poll')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when nothing is due')
+        parser.add_argument('--once', action='store_true', help='Send what is due now and exit')
+        parser.add_argument('--requeue-dead', action='store_true', help='Retry dead-lettered messages first')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            requeued = requeue_dead()
+            self.stdout.write(f"Requeued {requeued} dead messages")
+
+        if options['once']:
+            attempted = drain(workers=options['workers'], batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Processed {attempted} messages"))
+            return
+
+        transport = get_transport()
+        self.stdout.write(f"Outbox worker running with {options['workers']} threads")
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            try:
+                while True:
+                    if not process_batch(executor, transport, options['batch_size']):
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping outbox worker")
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.sales import ROLLUP_BATCH_SIZE, apply_rollup_batch, rebuild_rollups, update_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold new and re-statused orders into the sales rollup tables (or rebuild them from scratch)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every rollup from the orders')
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE, help='Queued orders applied per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new orders')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            counted = rebuild_rollups()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups from {counted} orders"))
+
+        if not options['loop']:
+            applied = update_rollups(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Applied {applied} queued orders"))
+            return
+
+        self.stdout.write("Sales rollup updater running")
+        try:
+            while True:
+                if not apply_rollup_batch(options['batch_size']):
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping sales rollup updater")
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.14 on 2026-10-19 10:47
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_cart_counters(apps, schema_editor):
+    """Set the new counters from the cart items already stored, in one UPDATE"""
+    Cart = apps.get_model("users", "Cart")
+    CartItem = apps.get_model("users", "CartItem")
+    lines = CartItem.objects.filter(cart=OuterRef("pk")).order_by().values("cart")
+    Cart.objects.update(
+        total_quantity=Coalesce(
+            Subquery(
+                lines.annotate(total=Sum("quantity")).values("total"),
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        ),
+        line_count=Coalesce(
+            Subquery(
+                lines.annotate(total=Count("id")).values("total"),
+                output_field=IntegerField(),
+            ),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0004_auto_20250615_2233"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cart",
+            name="line_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="cart",
+            name="total_quantity",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_cart_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.0.14 on 2026-10-19 11:03
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_order_item_snapshot(apps, schema_editor):
+    """
+    Copy item names and size labels onto existing order items, one id range
+    per transaction so no batch holds row locks for long. Rows already
+    filled in are skipped, so an interrupted run can simply be repeated.
+    """
+    Item = apps.get_model("items", "Item")
+    ItemSize = apps.get_model("items", "ItemSize")
+    OrderItem = apps.get_model("users", "OrderItem")
+
+    last_id = OrderItem.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    for start in range(0, last_id + 1, BACKFILL_BATCH_SIZE):
+        with transaction.atomic():
+            OrderItem.objects.filter(
+                id__gte=start, id__lt=start + BACKFILL_BATCH_SIZE, item_name=""
+            ).update(
+                item_name=Coalesce(
+                    Subquery(Item.objects.filter(pk=OuterRef("item_id")).values("name")[:1]),
+                    Value(""),
+                ),
+                size_label=Coalesce(
+                    Subquery(ItemSize.objects.filter(pk=OuterRef("size_id")).values("size")[:1]),
+                    Value(""),
+                ),
+            )
+
+
+class Migration(migrations.Migration):
+    # Let each backfill batch commit on its own
+    atomic = False
+
+    dependencies = [
+        ("items", "0005_stock_reservations"),
+        ("users", "0008_order_history_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="item_name",
+            field=models.CharField(default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="orderitem",
+            name="size_label",
+            field=models.CharField(default="", max_length=50),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="item",
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.SET_NULL, to="items.item"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="size",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="items.itemsize",
+            ),
+        ),
+        migrations.RunPython(backfill_order_item_snapshot, migrations.RunPython.noop),
+    ]
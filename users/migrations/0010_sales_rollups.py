@@ -0,0 +1,141 @@
+# Generated by Django 5.0.14 on 2026-10-19 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0009_order_item_snapshot"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SalesDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("day", models.DateField()),
+                ("status", models.CharField(max_length=50)),
+                ("order_count", models.IntegerField(default=0)),
+                ("units", models.IntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+            ],
+            options={
+                "db_table": "sales_daily",
+            },
+        ),
+        migrations.CreateModel(
+            name="SalesDailyCategory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("day", models.DateField()),
+                ("status", models.CharField(max_length=50)),
+                ("order_count", models.IntegerField(default=0)),
+                ("units", models.IntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("category_id", models.IntegerField()),
+                ("category_name", models.CharField(default="", max_length=255)),
+            ],
+            options={
+                "db_table": "sales_daily_categories",
+            },
+        ),
+        migrations.CreateModel(
+            name="SalesDailyItem",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("day", models.DateField()),
+                ("status", models.CharField(max_length=50)),
+                ("order_count", models.IntegerField(default=0)),
+                ("units", models.IntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("item_id", models.IntegerField()),
+                ("size_id", models.IntegerField()),
+                ("item_name", models.CharField(default="", max_length=255)),
+                ("size_label", models.CharField(default="", max_length=50)),
+            ],
+            options={
+                "db_table": "sales_daily_items",
+            },
+        ),
+        migrations.CreateModel(
+            name="SalesRollupQueue",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("order_id", models.IntegerField()),
+                ("old_status", models.CharField(blank=True, max_length=50, null=True)),
+                ("new_status", models.CharField(max_length=50)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "sales_rollup_queue",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="salesdaily",
+            constraint=models.UniqueConstraint(
+                fields=("day", "status"), name="unique_sales_daily"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="salesdailycategory",
+            constraint=models.UniqueConstraint(
+                fields=("day", "status", "category_id"),
+                name="unique_sales_daily_category",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="salesdailyitem",
+            constraint=models.UniqueConstraint(
+                fields=("day", "status", "item_id", "size_id"),
+                name="unique_sales_daily_item",
+            ),
+        ),
+    ]
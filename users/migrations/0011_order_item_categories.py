@@ -0,0 +1,53 @@
+# Generated by Django 5.0.14 on 2026-10-19 11:49
+
+from collections import defaultdict
+
+from django.db import migrations, models, transaction
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def backfill_order_item_categories(apps, schema_editor):
+    """
+    Snapshot the current categories of each existing order item's item (the
+    best record there is of them), one id range per transaction. Lines whose
+    item is gone keep an empty list.
+    """
+    ItemCategory = apps.get_model("items", "ItemCategory")
+    OrderItem = apps.get_model("users", "OrderItem")
+
+    last_id = OrderItem.objects.order_by("-id").values_list("id", flat=True).first() or 0
+    for start in range(0, last_id + 1, BACKFILL_BATCH_SIZE):
+        with transaction.atomic():
+            order_items = list(
+                OrderItem.objects.filter(
+                    id__gte=start, id__lt=start + BACKFILL_BATCH_SIZE, item_id__isnull=False
+                ).only("id", "item_id")
+            )
+            categories = defaultdict(list)
+            for item_id, category_id, category_name in ItemCategory.objects.filter(
+                item_id__in={order_item.item_id for order_item in order_items}
+            ).order_by("category_id").values_list("item_id", "category_id", "category__name"):
+                categories[item_id].append([category_id, category_name])
+            for order_item in order_items:
+                order_item.categories = categories.get(order_item.item_id, [])
+            OrderItem.objects.bulk_update(order_items, ["categories"])
+
+
+class Migration(migrations.Migration):
+    # Let each backfill batch commit on its own
+    atomic = False
+
+    dependencies = [
+        ("items", "0007_stock_flags"),
+        ("users", "0010_sales_rollups"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="categories",
+            field=models.JSONField(default=list),
+        ),
+        migrations.RunPython(backfill_order_item_categories, migrations.RunPython.noop),
+    ]
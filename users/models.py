@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from items.models import Item, ItemSize
 
 # Create your models here.
@@ -45,6 +46,8 @@ from items.models import Item, ItemSize
 # CREATE TABLE carts (
 #     id SERIAL PRIMARY KEY,
 #     user_id INT NOT NULL UNIQUE,  -- One cart per user
+#     total_quantity INT NOT NULL DEFAULT 0,  -- Sum of cart_items.quantity
+#     line_count INT NOT NULL DEFAULT 0,  -- Number of cart_items rows
 #     created_at TIMESTAMP NOT NULL,
 #     updated_at TIMESTAMP NOT NULL,
 #     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
@@ -83,21 +86,83 @@ from items.models import Item, ItemSize
 #     updated_at TIMESTAMP NOT NULL,
 #     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 # );
+# CREATE INDEX orders_user_history_idx ON orders (user_id, created_at DESC, id DESC);
 
 # -- Order items table
 # CREATE TABLE order_items (
 #     id SERIAL PRIMARY KEY,
 #     order_id INT NOT NULL,
-#     item_id INT NOT NULL,
-#     size_id INT NOT NULL,
+#     item_id INT,  -- NULL once the item is deleted; the snapshot below remains
+#     size_id INT,
 #     quantity INT NOT NULL,
 #     price_at_time DECIMAL(10, 2) NOT NULL,  -- Price at time of order
+#     item_name VARCHAR(255) NOT NULL,  -- Item name at time of order
+#     size_label VARCHAR(50) NOT NULL,  -- Size label at time of order
 #     primary_image VARCHAR(255) NOT NULL,  -- Primary image URL of the item
 #     created_at TIMESTAMP NOT NULL,
 #     updated_at TIMESTAMP NOT NULL,
 #     FOREIGN KEY (order_id) REFERENCES orders(id) ON DELETE CASCADE,
-#     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
-#     FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE CASCADE
+#     FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE SET NULL,
+#     FOREIGN KEY (size_id) REFERENCES sizes(id) ON DELETE SET NULL
+# );
+
+# -- Idempotency keys table (replayable results of order creation requests)
+# CREATE TABLE idempotency_keys (
+#     id SERIAL PRIMARY KEY,
+#     scope VARCHAR(100) NOT NULL,  -- Endpoint and user ('orders:42', 'guest-checkout')
+#     key VARCHAR(255) NOT NULL,  -- Idempotency-Key header sent by the client
+#     request_hash VARCHAR(64) NOT NULL,  -- SHA-256 of the request body
+#     status VARCHAR(20) NOT NULL,  -- 'in_progress' or 'completed'
+#     response_status INT,
+#     response_body TEXT,  -- Rendered JSON, replayed byte for byte
+#     expires_at TIMESTAMP NOT NULL,
+#     created_at TIMESTAMP NOT NULL,
+#     updated_at TIMESTAMP NOT NULL,
+#     UNIQUE (scope, key)
+# );
+
+# -- Email outbox (written in the order / reset token transaction, sent by run_outbox_worker)
+# CREATE TABLE email_outbox (
+#     id SERIAL PRIMARY KEY,
+#     kind VARCHAR(50) NOT NULL,  -- 'order_confirmation' or 'password_reset'
+#     params JSONB NOT NULL,  -- Provider payload: from, to, subject, html, text
+#     status VARCHAR(20) NOT NULL,  -- 'pending', 'sending', 'sent' or 'dead'
+#     attempts INT NOT NULL DEFAULT 0,
+#     next_attempt_at TIMESTAMP NOT NULL,  -- Retry backoff, or lease expiry while 'sending'
+#     last_error TEXT,
+#     sent_at TIMESTAMP,
+#     created_at TIMESTAMP NOT NULL,
+#     updated_at TIMESTAMP NOT NULL
+# );
+
+# -- Sales rollups (maintained by update_sales_rollups from sales_rollup_queue)
+# CREATE TABLE sales_daily (
+#     id SERIAL PRIMARY KEY,
+#     day DATE NOT NULL,
+#     status VARCHAR(50) NOT NULL,  -- Order status the figures are currently in
+#     order_count INT NOT NULL,
+#     units INT NOT NULL,
+#     revenue DECIMAL(14, 2) NOT NULL,  -- Sum of orders.total_price
+#     created_at TIMESTAMP NOT NULL,
+#     updated_at TIMESTAMP NOT NULL,
+#     UNIQUE (day, status)
+# );
+# CREATE TABLE sales_daily_items (
+#     ...same figures, per (day, status, item_id, size_id), revenue = sum of price_at_time * quantity
+#     item_name VARCHAR(255) NOT NULL,  -- Snapshot from order_items
+#     size_label VARCHAR(50) NOT NULL
+# );
+# CREATE TABLE sales_daily_categories (
+#     ...same figures, per (day, status, category_id); an item in two categories counts in both
+#     category_name VARCHAR(255) NOT NULL
+# );
+# -- Orders whose figures still have to be added to (or moved between statuses in) the rollups
+# CREATE TABLE sales_rollup_queue (
+#     id SERIAL PRIMARY KEY,
+#     order_id INT NOT NULL,
+#     old_status VARCHAR(50),  -- NULL for a new order
+#     new_status VARCHAR(50) NOT NULL,
+#     created_at TIMESTAMP NOT NULL
 # );
 
 class BaseModel(models.Model):
@@ -142,6 +207,9 @@ class SocialAccount(BaseModel):
 
 class Cart(BaseModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE, unique=True)  # One cart per user
+    # Denormalized from cart_items so the badge count never aggregates
+    total_quantity = models.PositiveIntegerField(default=0)  # Sum of CartItem.quantity
+    line_count = models.PositiveIntegerField(default=0)  # Number of CartItem rows
 
     def __str__(self):
         return f"Cart for {self.user.username}"
@@ -189,6 +257,12 @@ class Order(BaseModel):
     # Optional fields for guest users
     guest_email = models.EmailField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Order history pages walk a user's orders newest first
+            models.Index(fields=['user', '-created_at', '-id'], name='orders_user_history_idx'),
+        ]
+
     def __str__(self):
         if self.user:
             return f"Order {self.id} - {self.user.username}"
@@ -197,12 +271,133 @@ class Order(BaseModel):
 
 class OrderItem(BaseModel):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
-    item = models.ForeignKey(Item, on_delete=models.CASCADE)
-    size = models.ForeignKey(ItemSize, on_delete=models.CASCADE)
+    # Order history keeps the line (and its snapshot) when the item or size is deleted
+    item = models.ForeignKey(Item, on_delete=models.SET_NULL, null=True)
+    size = models.ForeignKey(ItemSize, on_delete=models.SET_NULL, null=True)
     quantity = models.PositiveIntegerField()
     price_at_time = models.DecimalField(max_digits=10, decimal_places=2)  # Price at time of order
+    item_name = models.CharField(max_length=255, default='')  # Item name at time of order
+    size_label = models.CharField(max_length=50, default='')  # Size label at time of order
     primary_image = models.URLField(default='')  # Store the primary image URL with default empty string
+    # [[category_id, category_name], ...] of the item at time of order, so sales
+    # rollups keep counting the line under them after recategorisation or deletion
+    categories = models.JSONField(default=list)
 
     def __str__(self):
-        return f"{self.quantity}x {self.item.name} ({self.size.name})"
+        return f"{self.quantity}x {self.item_name} ({self.size_label})"
+
+
+
+
+class IdempotencyKey(BaseModel):
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+
+    scope = models.CharField(max_length=100)  # Endpoint and user the key belongs to
+    key = models.CharField(max_length=255)  # Idempotency-Key header value
+    request_hash = models.CharField(max_length=64)  # SHA-256 of the request body
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(null=True, blank=True)  # Rendered JSON of the stored response
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key_per_scope'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status})"
+
+
+class OutboxMessage(BaseModel):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    ]
+
+    kind = models.CharField(max_length=50)  # 'order_confirmation', 'password_reset'
+    params = models.JSONField()  # Provider payload: from, to, subject, html, text
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When to try next; while 'sending' it's the worker's lease, after which another worker may retry
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    sent_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        db_table = 'email_outbox'
+        indexes = [
+            # The worker's claim query only ever looks at unsent messages
+            models.Index(
+                fields=['next_attempt_at'],
+                name='email_outbox_due_idx',
+                condition=models.Q(status__in=['pending', 'sending'])
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} to {', '.join(self.params.get('to', []))} ({self.status})"
+
+
+class SalesRollup(BaseModel):
+    day = models.DateField()
+    status = models.CharField(max_length=50)  # Order status the figures are currently in
+    order_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class SalesDaily(SalesRollup):
+    class Meta:
+        db_table = 'sales_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='unique_sales_daily'),
+        ]
+
+
+class SalesDailyItem(SalesRollup):
+    # Plain ids and snapshot labels: the rollup outlives catalog edits and deletions
+    item_id = models.IntegerField()
+    size_id = models.IntegerField()
+    item_name = models.CharField(max_length=255, default='')
+    size_label = models.CharField(max_length=50, default='')
+
+    class Meta:
+        db_table = 'sales_daily_items'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'status', 'item_id', 'size_id'], name='unique_sales_daily_item'
+            ),
+        ]
+
+
+class SalesDailyCategory(SalesRollup):
+    category_id = models.IntegerField()
+    category_name = models.CharField(max_length=255, default='')
+
+    class Meta:
+        db_table = 'sales_daily_categories'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'status', 'category_id'], name='unique_sales_daily_category'
+            ),
+        ]
+
+
+class SalesRollupQueue(models.Model):
+    order_id = models.IntegerField()
+    old_status = models.CharField(max_length=50, null=True, blank=True)  # None for a new order
+    new_status = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'sales_rollup_queue'
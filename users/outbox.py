@@ -0,0 +1,243 @@
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .circuit_breaker import CircuitBreaker, CircuitOpen
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMAIL_TRANSPORT = 'users.outbox.ResendTransport'
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+# A message still 'sending' after this long is assumed lost with its worker and retried
+SEND_LEASE = timedelta(minutes=5)
+BATCH_SIZE = 50
+
+_transport = None
+
+
+def enqueue_email(kind, params):
+    """
+    Queue an email for the outbox worker.
+
+    Call it inside the transaction that creates what the email is about, so
+    the message exists if and only if that commits. params is the provider
+    payload (from, to, subject, html, text).
+    """
+    return OutboxMessage.objects.create(kind=kind, params=params)
+
+
+class EmailNotConfigured(Exception):
+    pass
+
+
+class PermanentEmailError(Exception):
+    """The provider rejected the message itself (4xx); retrying won't help"""
+    pass
+
+
+class TransientEmailError(Exception):
+    """Timeout, connection failure, 429 or 5xx: worth retrying later"""
+    pass
+
+
+class ResendTransport:
+    """
+    Sends through the Resend HTTP API (the default).
+
+    Calls the API directly rather than through the SDK so every request has
+    connect/read timeouts (EMAIL_CONNECT_TIMEOUT / EMAIL_READ_TIMEOUT), and
+    goes through a circuit breaker shared by the worker's threads: after
+    EMAIL_BREAKER_THRESHOLD transient failures in a row, sends fail fast
+    with CircuitOpen for EMAIL_BREAKER_RESET seconds and the messages wait
+    in the outbox. RESEND_API_URL points it at another server (e.g. a local
+    fake in tests).
+    """
+
+    def __init__(self):
+        self.api_url = os.getenv('RESEND_API_URL', 'https://api.resend.com').rstrip('/')
+        self.timeout = (
+            getattr(settings, 'EMAIL_CONNECT_TIMEOUT', 3.05),
+            getattr(settings, 'EMAIL_READ_TIMEOUT', 10),
+        )
+        self.breaker = CircuitBreaker(
+            'email provider',
+            failure_threshold=getattr(settings, 'EMAIL_BREAKER_THRESHOLD', 5),
+            reset_timeout=getattr(settings, 'EMAIL_BREAKER_RESET', 30),
+            is_failure=lambda exc: isinstance(exc, TransientEmailError)
+        )
+        self._local = threading.local()
+
+    def send(self, params):
+        api_key = os.getenv('RESEND_API_KEY')
+        if not api_key:
+            raise EmailNotConfigured("RESEND_API_KEY is not set in environment variables")
+        return self.breaker.call(self._post, params, api_key)
+
+    @property
+    def session(self):
+        # One keep-alive session per worker thread
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _post(self, params, api_key):
+        try:
+            response = self.session.post(
+                f'{self.api_url}/emails',
+                json=params,
+                headers={'Authorization': f'Bearer {api_key}', 'Accept': 'application/json'},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            raise TransientEmailError(f"{type(e).__name__}: {str(e)}") from e
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise TransientEmailError(f"HTTP {response.status_code}: {response.text[:200]}")
+        if response.status_code >= 400:
+            raise PermanentEmailError(f"HTTP {response.status_code}: {response.text[:200]}")
+        return response.json()
+
+
+class LocMemTransport:
+    """Keeps messages in LocMemTransport.sent instead of sending them (tests, local development)"""
+
+    sent = []
+
+    def send(self, params):
+        self.sent.append(params)
+
+
+def get_transport():
+    """The transport configured by settings.EMAIL_OUTBOX_TRANSPORT"""
+    global _transport
+    if _transport is None:
+        backend = getattr(settings, 'EMAIL_OUTBOX_TRANSPORT', DEFAULT_EMAIL_TRANSPORT)
+        _transport = import_string(backend)()
+    return _transport
+
+
+def backoff(attempts):
+    """Delay before retry number attempts + 1: exponential, capped, with jitter"""
+    delay = min(BACKOFF_BASE * (2 ** (attempts - 1)), BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_batch(batch_size=BATCH_SIZE):
+    """
+    Lease up to batch_size due messages to this worker.
+
+    SKIP LOCKED lets several workers claim side by side without handing out
+    the same message twice. Claimed messages move to 'sending' with
+    next_attempt_at as the lease expiry, so a crashed worker's messages are
+    picked up again once the lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True).filter(
+                status__in=['pending', 'sending'],
+                next_attempt_at__lte=now
+            ).order_by('next_attempt_at')[:batch_size]
+        )
+        if not messages:
+            return []
+        OutboxMessage.objects.filter(id__in=[message.id for message in messages]).update(
+            status='sending',
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + SEND_LEASE,
+            updated_at=now
+        )
+    for message in messages:
+        message.status = 'sending'
+        message.attempts += 1
+    return messages
+
+
+def deliver(message, transport):
+    """
+    Send one claimed message and record the outcome.
+
+    Failures are retried with backoff until MAX_ATTEMPTS, then the message
+    is dead-lettered (status 'dead') and left for someone to look at;
+    messages the provider rejects outright are dead-lettered at once. While
+    the provider's circuit is open the message goes back to the queue until
+    the breaker lets calls through again, without using up an attempt.
+    Returns the new status.
+    """
+    close_old_connections()
+    try:
+        transport.send(message.params)
+    except CircuitOpen as e:
+        now = timezone.now()
+        OutboxMessage.objects.filter(id=message.id, status='sending').update(
+            status='pending',
+            attempts=F('attempts') - 1,
+            next_attempt_at=now + timedelta(seconds=e.retry_after),
+            updated_at=now
+        )
+        return 'pending'
+    except Exception as e:
+        now = timezone.now()
+        if message.attempts >= MAX_ATTEMPTS or isinstance(e, PermanentEmailError):
+            new_status = 'dead'
+            logger.error(f"Giving up on {message.kind} email {message.id} after {message.attempts} attempts: {str(e)}")
+        else:
+            new_status = 'pending'
+            logger.warning(f"Error sending {message.kind} email {message.id} (attempt {message.attempts}): {str(e)}")
+        OutboxMessage.objects.filter(id=message.id, status='sending').update(
+            status=new_status,
+            next_attempt_at=now + backoff(message.attempts),
+            last_error=str(e),
+            updated_at=now
+        )
+        return new_status
+
+    now = timezone.now()
+    OutboxMessage.objects.filter(id=message.id, status='sending').update(
+        status='sent', sent_at=now, last_error='', updated_at=now
+    )
+    logger.info(f"Sent {message.kind} email {message.id} to {', '.join(message.params.get('to', []))}")
+    return 'sent'
+
+
+def process_batch(executor, transport=None, batch_size=BATCH_SIZE):
+    """Claim one batch and send it on executor's threads. Returns the number of messages claimed."""
+    transport = transport or get_transport()
+    messages = claim_batch(batch_size)
+    list(executor.map(lambda message: deliver(message, transport), messages))
+    return len(messages)
+
+
+def drain(workers=4, transport=None, batch_size=BATCH_SIZE):
+    """
+    Send everything that is due now (`run_outbox_worker --once`, and the
+    outbox tests with their own transports).
+    Returns the number of delivery attempts made.
+    """
+    attempted = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            claimed = process_batch(executor, transport, batch_size)
+            if not claimed:
+                return attempted
+            attempted += claimed
+
+
+def requeue_dead():
+    """Give dead-lettered messages a fresh set of attempts. Returns how many were requeued."""
+    return OutboxMessage.objects.filter(status='dead').update(
+        status='pending', attempts=0, next_attempt_at=timezone.now(), updated_at=timezone.now()
+    )
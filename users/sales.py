@@ -0,0 +1,323 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    Order, OrderItem, SalesDaily, SalesDailyItem, SalesDailyCategory, SalesRollupQueue
+)
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_BATCH_SIZE = 500
+REBUILD_CHUNK_SIZE = 2000
+
+# Rollup model -> the fields (besides day and status) identifying a row
+ROLLUP_KEYS = {
+    SalesDaily: (),
+    SalesDailyItem: ('item_id', 'size_id'),
+    SalesDailyCategory: ('category_id',),
+}
+
+
+def analytics_db():
+    """Database alias analytics reads go to: the 'analytics' replica when configured"""
+    return 'analytics' if 'analytics' in settings.DATABASES else 'default'
+
+
+def queue_sales_rollup(order, old_status=None):
+    """
+    Record that order's figures must be added to the rollups (or moved from
+    old_status to its current status). Call it in the transaction that
+    creates or changes the order: it is one insert, and the rollup rows
+    themselves are only touched later by update_sales_rollups, away from
+    checkout.
+    """
+    SalesRollupQueue.objects.create(order_id=order.id, old_status=old_status, new_status=order.status)
+
+
+def set_order_status(order, new_status):
+    """Change an order's status and queue the matching rollup move, atomically"""
+    with transaction.atomic():
+        order = Order.objects.select_for_update().get(id=order.id)
+        old_status = order.status
+        if old_status == new_status:
+            return order
+        order.status = new_status
+        order.save(update_fields=['status', 'updated_at'])
+        queue_sales_rollup(order, old_status=old_status)
+    return order
+
+
+def _order_contributions(order_ids):
+    """
+    Figures each order adds to each rollup, as
+    {order_id: {model: {key: [order_count, units, revenue]}}} plus labels per
+    (model, key). Keys exclude day and status. Lines count under the
+    categories snapshotted at checkout, so an order moved between statuses
+    later subtracts exactly what it added, whatever happened to its items.
+    """
+    orders = {
+        order_id: (timezone.localdate(created_at), total_price)
+        for order_id, created_at, total_price in Order.objects.filter(
+            id__in=order_ids
+        ).values_list('id', 'created_at', 'total_price')
+    }
+    lines = list(
+        OrderItem.objects.filter(order_id__in=orders).values_list(
+            'order_id', 'item_id', 'size_id', 'item_name', 'size_label', 'quantity', 'price_at_time',
+            'categories'
+        )
+    )
+
+    contributions = {
+        order_id: {
+            SalesDaily: {(): [1, 0, total_price]},
+            SalesDailyItem: {},
+            SalesDailyCategory: {},
+        }
+        for order_id, (day, total_price) in orders.items()
+    }
+    labels = {}
+    for order_id, item_id, size_id, item_name, size_label, quantity, price, categories in lines:
+        figures = contributions[order_id]
+        figures[SalesDaily][()][1] += quantity
+        targets = [(SalesDailyItem, (item_id or 0, size_id or 0))]
+        labels[(SalesDailyItem, targets[0][1])] = {'item_name': item_name, 'size_label': size_label}
+        for category_id, category_name in categories:
+            targets.append((SalesDailyCategory, (category_id,)))
+            labels[(SalesDailyCategory, (category_id,))] = {'category_name': category_name}
+        for model, key in targets:
+            row = figures[model].setdefault(key, [1, 0, Decimal('0.00')])
+            row[1] += quantity
+            row[2] += price * quantity
+
+    days = {order_id: day for order_id, (day, _) in orders.items()}
+    return days, contributions, labels
+
+
+def _apply_deltas(model, deltas, labels):
+    """
+    Add deltas ({(day, status, *key): [order_count, units, revenue]}) to a
+    rollup table: one insert of any missing rows, one locking read and one
+    bulk_update, whatever the number of rows.
+    """
+    key_fields = ('day', 'status') + ROLLUP_KEYS[model]
+    model.objects.bulk_create(
+        [
+            model(**dict(zip(key_fields, key)), **labels.get((model, key[2:]), {}))
+            for key in deltas
+        ],
+        ignore_conflicts=True
+    )
+
+    rows = model.objects.select_for_update().filter(
+        day__in={key[0] for key in deltas},
+        status__in={key[1] for key in deltas}
+    ).order_by('id')
+    for field in ROLLUP_KEYS[model]:
+        position = key_fields.index(field)
+        rows = rows.filter(**{f'{field}__in': {key[position] for key in deltas}})
+
+    to_update = []
+    for row in rows:
+        delta = deltas.get(tuple(getattr(row, field) for field in key_fields))
+        if delta is None:
+            continue
+        row.order_count += delta[0]
+        row.units += delta[1]
+        row.revenue += delta[2]
+        row.updated_at = timezone.now()
+        to_update.append(row)
+    model.objects.bulk_update(to_update, ['order_count', 'units', 'revenue', 'updated_at'])
+
+
+def apply_rollup_batch(batch_size=ROLLUP_BATCH_SIZE):
+    """
+    Fold up to batch_size queued order events into the rollups, in one
+    transaction with the queue rows' deletion, so each event counts exactly
+    once. SKIP LOCKED lets several updaters run side by side. Returns the
+    number of events applied.
+    """
+    with transaction.atomic():
+        events = list(
+            SalesRollupQueue.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+
+        days, contributions, labels = _order_contributions({event.order_id for event in events})
+        deltas = {model: defaultdict(lambda: [0, 0, Decimal('0.00')]) for model in ROLLUP_KEYS}
+        for event in events:
+            if event.order_id not in contributions:
+                continue  # Order deleted since
+            moves = [(event.new_status, 1)]
+            if event.old_status is not None:
+                moves.append((event.old_status, -1))
+            for status, sign in moves:
+                for model, figures in contributions[event.order_id].items():
+                    for key, (order_count, units, revenue) in figures.items():
+                        delta = deltas[model][(days[event.order_id], status) + key]
+                        delta[0] += sign * order_count
+                        delta[1] += sign * units
+                        delta[2] += sign * revenue
+
+        for model, model_deltas in deltas.items():
+            if model_deltas:
+                _apply_deltas(model, model_deltas, labels)
+        SalesRollupQueue.objects.filter(id__in=[event.id for event in events]).delete()
+    return len(events)
+
+
+def update_rollups(batch_size=ROLLUP_BATCH_SIZE):
+    """Apply every queued event. Returns the number applied."""
+    applied = 0
+    while True:
+        count = apply_rollup_batch(batch_size)
+        if not count:
+            return applied
+        applied += count
+
+
+def _bulk_insert(model, rows):
+    batch = []
+    for row in rows:
+        batch.append(model(**row))
+        if len(batch) >= REBUILD_CHUNK_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def _category_figures(lines):
+    """
+    Per (day, status, category) figures of lines, from the categories
+    snapshotted on each line. The snapshot is a JSON list, so the grouping
+    is done here, streaming the lines in order id order (an order's lines
+    are adjacent, which is how orders are counted once per category).
+    """
+    groups = {}
+    for line in lines.order_by('order_id').values(
+        'order_id', 'day', 'status', 'categories', 'quantity', 'price_at_time'
+    ).iterator(chunk_size=REBUILD_CHUNK_SIZE):
+        for category_id, category_name in line['categories']:
+            group = groups.get((line['day'], line['status'], category_id))
+            if group is None:
+                group = groups[(line['day'], line['status'], category_id)] = {
+                    'category_name': category_name, 'order_count': 0, 'units': 0,
+                    'revenue': Decimal('0.00'), 'last_order_id': None,
+                }
+            if group['last_order_id'] != line['order_id']:
+                group['last_order_id'] = line['order_id']
+                group['order_count'] += 1
+            group['category_name'] = max(group['category_name'], category_name)
+            group['units'] += line['quantity']
+            group['revenue'] += line['price_at_time'] * line['quantity']
+
+    for (day, status, category_id), group in groups.items():
+        del group['last_order_id']
+        yield dict(group, day=day, status=status, category_id=category_id)
+
+
+def rebuild_rollups():
+    """
+    Recompute every rollup from orders and order items.
+
+    Runs in one REPEATABLE READ transaction, so the aggregates and the queue
+    rows it discards come from the same snapshot: orders committed meanwhile
+    keep their queue rows and are applied by the next update. Returns the
+    number of orders counted.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+
+        SalesRollupQueue.objects.all().delete()
+        for model in ROLLUP_KEYS:
+            model.objects.all().delete()
+
+        now = timezone.now()
+        lines = OrderItem.objects.annotate(
+            day=TruncDate('order__created_at'), status=F('order__status')
+        ).order_by()
+        line_figures = {
+            'order_count': Count('order_id', distinct=True),
+            'units': Sum('quantity'),
+            'revenue': Sum(F('price_at_time') * F('quantity')),
+        }
+
+        units_by_day = {
+            (row['day'], row['status']): row['units']
+            for row in lines.values('day', 'status').annotate(units=Sum('quantity'))
+        }
+        _bulk_insert(SalesDaily, (
+            dict(row, units=units_by_day.get((row['day'], row['status']), 0), created_at=now, updated_at=now)
+            for row in Order.objects.annotate(day=TruncDate('created_at')).order_by().values(
+                'day', 'status'
+            ).annotate(order_count=Count('id'), revenue=Sum('total_price')).iterator()
+        ))
+        _bulk_insert(SalesDailyItem, (
+            dict(
+                row,
+                item_id=row['item_id'] or 0,
+                size_id=row['size_id'] or 0,
+                created_at=now,
+                updated_at=now
+            )
+            for row in lines.values('day', 'status', 'item_id', 'size_id').annotate(
+                item_name=Max('item_name'), size_label=Max('size_label'), **line_figures
+            ).iterator()
+        ))
+        _bulk_insert(SalesDailyCategory, (
+            dict(row, created_at=now, updated_at=now)
+            for row in _category_figures(lines)
+        ))
+        counted = Order.objects.count()
+
+    logger.info(f"Rebuilt sales rollups from {counted} orders")
+    return counted
+
+
+SALES_GROUPS = {
+    'day': (SalesDaily, ('day',), {}),
+    'item': (SalesDailyItem, ('item_id',), {'item_name': Max('item_name')}),
+    'size': (SalesDailyItem, ('item_id', 'size_id'), {'item_name': Max('item_name'), 'size_label': Max('size_label')}),
+    'category': (SalesDailyCategory, ('category_id',), {'category_name': Max('category_name')}),
+}
+
+
+def sales_report(group='day', date_from=None, date_to=None, status=None, limit=50):
+    """
+    Sales figures grouped by day, item, size or category, read only from
+    the rollups (on the analytics database when there is one). Days come
+    back in date order, everything else by revenue, top `limit` rows.
+    """
+    model, group_fields, labels = SALES_GROUPS[group]
+    db = analytics_db()
+    filters = {}
+    if date_from:
+        filters['day__gte'] = date_from
+    if date_to:
+        filters['day__lte'] = date_to
+    if status:
+        filters['status'] = status
+
+    figures = {'order_count': Sum('order_count'), 'units': Sum('units'), 'revenue': Sum('revenue')}
+    rows = model.objects.using(db).filter(**filters).values(*group_fields).annotate(**labels, **figures)
+    rows = rows.order_by('day') if group == 'day' else rows.order_by('-revenue', *group_fields)[:limit]
+    totals = SalesDaily.objects.using(db).filter(**filters).aggregate(**figures)
+
+    return {
+        'rows': [dict(row, revenue=str(row['revenue'])) for row in rows],
+        'totals': {
+            'order_count': totals['order_count'] or 0,
+            'units': totals['units'] or 0,
+            'revenue': str(totals['revenue'] or Decimal('0.00')),
+        }
+    }
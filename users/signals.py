@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from items.models import Item, ItemSize
+from .cart import recompute_cart_counters
+from .cart_storage import get_cart_storage
+from .models import Cart
+
+
+# Deleting an item or size cascades to the CartItem rows pointing at it,
+# behind the cart counters' back: note whose carts are affected before the
+# delete and recount them once the lines are gone, in the same transaction.
+
+@receiver(pre_delete, sender=ItemSize)
+def note_carts_holding_size(sender, instance, **kwargs):
+    instance._cart_user_ids = list(
+        Cart.objects.filter(cartitem__size=instance).values_list('user_id', flat=True).distinct()
+    )
+
+
+@receiver(pre_delete, sender=Item)
+def note_carts_holding_item(sender, instance, **kwargs):
+    instance._cart_user_ids = list(
+        Cart.objects.filter(cartitem__item=instance).values_list('user_id', flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=ItemSize)
+@receiver(post_delete, sender=Item)
+def recount_carts(sender, instance, **kwargs):
+    recompute_cart_counters(getattr(instance, '_cart_user_ids', []))
+
+
+# Cart backends that cache product data (names, prices, sizes, stock) for
+# cart reads drop an item's entry once a change to it commits
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+@receiver(post_save, sender=ItemSize)
+@receiver(post_delete, sender=ItemSize)
+def drop_cached_cart_product(sender, instance, **kwargs):
+    item_id = instance.pk if sender is Item else instance.item_id
+    transaction.on_commit(lambda: get_cart_storage().invalidate_items([item_id]))
@@ -1,3 +1,790 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from items.inventory import stock_levels
+from items.models import Category, Item, ItemCategory, ItemDetail, ItemSize, StockMovement, StockReservation
+from items.reservations import available_quantities, reserve, sweep_expired
+from . import cart_storage
+from . import outbox, views
+from .cart import cart_count_cache_key
+from .checkout import checkout_guest
+from .circuit_breaker import CircuitBreaker, CircuitOpen
+from .models import (
+    Cart, CartItem, IdempotencyKey, Order, OutboxMessage, SalesDaily, SalesDailyCategory, SalesDailyItem, User
+)
+from .sales import rebuild_rollups, set_order_status, update_rollups
+
+
+def make_item(name, sizes=(('M', 5), ('L', 5))):
+    item = Item.objects.create(name=name, price='10.00', description='')
+    ItemDetail.objects.create(item=item, color='blue')
+    ItemCategory.objects.create(item=item, category=Category.objects.get_or_create(name='tops')[0])
+    for label, quantity in sizes:
+        ItemSize.objects.create(item=item, size=label, quantity=quantity)
+    return item
+
+
+class CartTestCase(TransactionTestCase):
+    """Counter and cart tests commit for real, so on_commit cache invalidation runs"""
+
+    def setUp(self):
+        for alias in ('default', 'carts'):
+            caches[alias].clear()
+        self.user = User.objects.create(username='shopper', email='shopper@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.admin = User.objects.create(username='admin', email='admin@example.com', is_superuser=True)
+        self.admin_client = APIClient()
+        self.admin_client.force_authenticate(self.admin)
+
+    def add(self, item, size_label, quantity):
+        size = item.sizes.get(size=size_label)
+        response = self.client.post(
+            '/api/cart/', {'item_id': item.id, 'size_id': size.id, 'quantity': quantity}, format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['cart_item']['id']
+
+    def counts(self):
+        response = self.client.get('/api/cart-count/')
+        return response.data['total_items'], response.data['total_lines']
+
+
+class CartCounterTests(CartTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shirt = make_item('Shirt')
+        self.socks = make_item('Socks')
+
+    def test_counts_follow_cart_changes(self):
+        line = self.add(self.shirt, 'M', 2)
+        self.add(self.socks, 'L', 1)
+        self.assertEqual(self.counts(), (3, 2))
+
+        self.client.put('/api/cart/', {'cart_item_id': line, 'quantity': 4}, format='json')
+        self.assertEqual(self.counts(), (5, 2))
+
+        self.client.delete(f'/api/cart/?cart_item_id={line}')
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_per_process_cache_is_not_trusted_for_counts(self):
+        self.add(self.shirt, 'M', 2)
+        # Another worker's stale copy, which this worker could never invalidate
+        caches['default'].set(cart_count_cache_key(self.user.id), {'total_quantity': 9, 'line_count': 9})
+
+        self.assertEqual(self.counts(), (2, 1))
+
+    def test_shared_cache_serves_and_invalidates_counts(self):
+        with mock.patch('users.cart.is_shared_cache', return_value=True):
+            line = self.add(self.shirt, 'M', 2)
+            self.assertEqual(self.counts(), (2, 1))
+            with self.assertNumQueries(0):
+                self.assertEqual(self.counts(), (2, 1))
+
+            self.client.put('/api/cart/', {'cart_item_id': line, 'quantity': 3}, format='json')
+            self.assertEqual(self.counts(), (3, 1))
+
+    def test_removing_a_size_recounts_carts(self):
+        self.add(self.shirt, 'M', 2)
+        self.add(self.socks, 'L', 1)
+        self.assertEqual(self.counts(), (3, 2))
+
+        response = self.admin_client.put(
+            f'/api/admin/items/{self.shirt.id}/', {'sizes': [{'size': 'L', 'quantity': 5}]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.counts(), (1, 1))
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((cart.total_quantity, cart.line_count), (1, 1))
+
+    def test_deleting_an_item_recounts_carts(self):
+        self.add(self.shirt, 'M', 2)
+        self.add(self.shirt, 'L', 1)
+        self.add(self.socks, 'M', 1)
+        self.assertEqual(self.counts(), (4, 3))
+
+        self.assertEqual(self.admin_client.delete(f'/api/admin/items/{self.shirt.id}/').status_code, 200)
+
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 1)
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((cart.total_quantity, cart.line_count), (1, 1))
+
+
+class CartOperationTests(CartTestCase):
+    """PATCH /api/cart/: several operations applied as one"""
+
+    def setUp(self):
+        super().setUp()
+        self.shirt = make_item('Shirt', sizes=(('M', 3), ('L', 5)))
+        self.socks = make_item('Socks')
+        self.size_m = self.shirt.sizes.get(size='M')
+        self.socks_l = self.socks.sizes.get(size='L')
+
+    def patch(self, *operations):
+        return self.client.patch('/api/cart/', {'operations': list(operations)}, format='json')
+
+    def cart(self):
+        return sorted(CartItem.objects.filter(cart__user=self.user).values_list('size_id', 'quantity'))
+
+    def reserved(self):
+        return sorted(StockReservation.objects.filter(user=self.user).values_list('size_id', 'quantity'))
+
+    def test_operations_apply_in_order(self):
+        shirt_line = self.add(self.shirt, 'M', 1)
+        socks_m_line = self.add(self.socks, 'M', 2)
+
+        response = self.patch(
+            {'op': 'add', 'item_id': self.socks.id, 'size_id': self.socks_l.id, 'quantity': 1},
+            {'op': 'set', 'cart_item_id': shirt_line, 'quantity': 3},
+            {'op': 'add', 'item_id': self.socks.id, 'size_id': self.socks_l.id, 'quantity': 2},
+            {'op': 'remove', 'cart_item_id': socks_m_line},
+        )
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['count'], {'total_items': 6, 'total_lines': 2})
+        self.assertEqual(
+            sorted((item['name'], item['size'], item['quantity']) for item in response.data['items']),
+            [('Shirt', 'M', 3), ('Socks', 'L', 3)]
+        )
+        self.assertEqual(self.cart(), [(self.size_m.id, 3), (self.socks_l.id, 3)])
+        self.assertEqual(self.reserved(), self.cart())
+        self.assertEqual(self.counts(), (6, 2))
+
+    def test_set_to_zero_removes_the_line(self):
+        line = self.add(self.shirt, 'M', 2)
+
+        response = self.patch({'op': 'set', 'cart_item_id': line, 'quantity': 0})
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['items'], [])
+        self.assertEqual((self.cart(), self.reserved()), ([], []))
+
+    def test_failing_operation_changes_nothing(self):
+        line = self.add(self.shirt, 'M', 1)
+
+        response = self.patch(
+            {'op': 'set', 'cart_item_id': line, 'quantity': 2},
+            {'op': 'add', 'item_id': self.socks.id, 'size_id': self.socks_l.id, 'quantity': 6},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'Only 5 items available in size L', 'operation': 1})
+        self.assertEqual(self.cart(), [(self.size_m.id, 1)])
+        self.assertEqual(self.reserved(), [(self.size_m.id, 1)])
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_invalid_operations_name_their_index(self):
+        line = self.add(self.shirt, 'M', 1)
+
+        for operations, error, index in (
+            ([], 'operations must be a non-empty list', None),
+            ([{'op': 'set', 'cart_item_id': line, 'quantity': 1}, {'op': 'move'}], 'op must be one of', 1),
+            ([{'op': 'remove', 'item_id': self.shirt.id}], 'cart_item_id is required', 0),
+            ([{'op': 'remove', 'cart_item_id': 0}], 'Cart item not found', 0),
+        ):
+            response = self.patch(*operations)
+            self.assertEqual(response.status_code, 400, operations)
+            self.assertTrue(response.data['error'].startswith(error), response.data)
+            self.assertEqual(response.data['operation'], index)
+        self.assertEqual(self.cart(), [(self.size_m.id, 1)])
+
+    def test_queries_do_not_grow_with_operations(self):
+        shirt_line = self.add(self.shirt, 'M', 1)
+        socks_line = self.add(self.socks, 'M', 1)
+        shirt_l = self.shirt.sizes.get(size='L')
+        hat = make_item('Hat')
+        hat_l = hat.sizes.get(size='L')
+
+        with CaptureQueriesContext(connection) as one:
+            self.patch(
+                {'op': 'set', 'cart_item_id': shirt_line, 'quantity': 2},
+                {'op': 'add', 'item_id': self.shirt.id, 'size_id': shirt_l.id, 'quantity': 1},
+            )
+        with CaptureQueriesContext(connection) as several:
+            self.patch(
+                {'op': 'set', 'cart_item_id': shirt_line, 'quantity': 3},
+                {'op': 'set', 'cart_item_id': socks_line, 'quantity': 2},
+                {'op': 'add', 'item_id': self.socks.id, 'size_id': self.socks_l.id, 'quantity': 1},
+                {'op': 'add', 'item_id': hat.id, 'size_id': hat_l.id, 'quantity': 1},
+            )
+
+        self.assertEqual(len(several), len(one))
+
+
+class ReservationTests(CartTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shirt = make_item('Shirt', sizes=(('M', 1), ('L', 5)))
+        self.size = self.shirt.sizes.get(size='M')
+        self.other = User.objects.create(username='other', email='other@example.com')
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def add_last_unit(self, client):
+        return client.post(
+            '/api/cart/', {'item_id': self.shirt.id, 'size_id': self.size.id, 'quantity': 1}, format='json'
+        )
+
+    def test_racing_shoppers_reserve_the_last_unit_once(self):
+        users = [User.objects.create(username=f'racer{n}', email=f'racer{n}@example.com') for n in range(6)]
+        start = threading.Barrier(len(users))
+        statuses = []
+
+        def race(user):
+            try:
+                client = self.client_for(user)
+                start.wait()
+                statuses.append(self.add_last_unit(client).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=race, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [200] + [400] * 5)
+        self.assertEqual(StockReservation.objects.get(size=self.size).quantity, 1)
+        self.assertEqual(CartItem.objects.filter(size=self.size).count(), 1)
+
+    def test_stale_availability_is_rechecked_under_the_lock(self):
+        self.assertEqual(self.add_last_unit(self.client_for(self.other)).status_code, 200)
+
+        # The unlocked check read the size before the other shopper's reservation committed
+        with mock.patch('users.cart.available_quantities', return_value={self.size.id: 1}):
+            response = self.add_last_unit(self.client)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Only 0 items available in size M')
+        self.assertFalse(StockReservation.objects.filter(user=self.user).exists())
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_available_excludes_own_and_expired_reservations(self):
+        size_l = self.shirt.sizes.get(size='L')
+        reserve(self.user.id, {size_l.id: 2})
+        reserve(self.other.id, {size_l.id: 1})
+
+        self.assertEqual(available_quantities([size_l], exclude_user_id=self.user.id), {size_l.id: 4})
+        self.assertEqual(available_quantities([size_l]), {size_l.id: 2})
+
+        StockReservation.objects.filter(user=self.other).update(expires_at=timezone.now())
+        self.assertEqual(available_quantities([size_l]), {size_l.id: 3})
+        self.assertEqual(sweep_expired(), 1)
+        self.assertEqual(list(StockReservation.objects.values_list('user_id', flat=True)), [self.user.id])
+
+    def test_lapsed_reservation_is_reheld_as_far_as_it_fits(self):
+        size_l = self.shirt.sizes.get(size='L')
+        line = self.add(self.shirt, 'L', 3)
+        StockReservation.objects.filter(user=self.user).update(expires_at=timezone.now())
+        reserve(self.other.id, {size_l.id: 4})
+
+        self.add(self.shirt, 'M', 1)
+
+        self.assertEqual(CartItem.objects.get(id=line).quantity, 3)
+        self.assertEqual(
+            dict(StockReservation.objects.filter(user=self.user).values_list('size_id', 'quantity')),
+            {size_l.id: 1, self.size.id: 1}
+        )
+
+
+SHIPPING = {
+    'shipping_address': '1 Main St',
+    'shipping_phone': '555',
+    'shipping_email': 'shopper@example.com',
+    'first_name': 'Shop',
+    'last_name': 'Per',
+    'zip_code': '00000',
+    'city': 'Town',
+}
+
+
+class CheckoutTests(CartTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.shirt = make_item('Shirt', sizes=(('M', 1), ('L', 5)))
+        self.socks = make_item('Socks', sizes=(('L', 1),))
+        self.hat = make_item('Hat')
+        self.tops = Category.objects.get(name='tops')
+
+    def shopper(self, name, *items):
+        """Another signed-in shopper with one unit of each item's L size in their cart"""
+        user = User.objects.create(username=name, email=f'{name}@example.com')
+        client = APIClient()
+        client.force_authenticate(user)
+        for item in items:
+            size = item.sizes.get(size='L')
+            response = client.post(
+                '/api/cart/', {'item_id': item.id, 'size_id': size.id, 'quantity': 1}, format='json'
+            )
+            self.assertEqual(response.status_code, 200, response.data)
+        return user, client
+
+    def checkout(self, user=None, client=None):
+        cart = Cart.objects.get(user=user or self.user)
+        return (client or self.client).post('/api/orders/', {'cart_id': cart.id, **SHIPPING}, format='json')
+
+    def guest_checkout(self, item, size_label, quantity):
+        size = item.sizes.get(size=size_label)
+        return APIClient().post('/api/guest-checkout/', {
+            'cart': {'items': [{'id': item.id, 'size_id': size.id, 'quantity': quantity}]},
+            **SHIPPING
+        }, format='json')
+
+    def test_checkout_snapshots_lines_and_clears_cart(self):
+        self.add(self.shirt, 'L', 2)
+        self.add(self.socks, 'L', 1)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get()
+        self.assertEqual(str(order.total_price), '30.00')
+        lines = order.orderitem_set.values_list('item_name', 'size_label', 'quantity', 'price_at_time', 'categories')
+        self.assertEqual(sorted(lines), [
+            ('Shirt', 'L', 2, Decimal('10.00'), [[self.tops.id, 'tops']]),
+            ('Socks', 'L', 1, Decimal('10.00'), [[self.tops.id, 'tops']]),
+        ])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.counts(), (0, 0))
+        self.assertEqual(
+            stock_levels([self.shirt.sizes.get(size='L').id, self.socks.sizes.get().id]),
+            {self.shirt.sizes.get(size='L').id: 3, self.socks.sizes.get().id: 0}
+        )
+
+    def test_order_writes_do_not_grow_with_cart_lines(self):
+        other, other_client = self.shopper('big', self.shirt, self.socks, self.hat)
+        self.add(self.shirt, 'L', 1)
+
+        with CaptureQueriesContext(connection) as one_line:
+            self.assertEqual(self.checkout().status_code, 201)
+        with CaptureQueriesContext(connection) as three_lines:
+            self.assertEqual(self.checkout(other, other_client).status_code, 201)
+
+        self.assertEqual(len(three_lines), len(one_line))
+
+    def test_own_reservation_counts_for_the_buyer_only(self):
+        self.add(self.shirt, 'M', 1)
+
+        response = self.guest_checkout(self.shirt, 'M', 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Only 0 items available for Shirt in size M')
+
+        self.assertEqual(self.checkout().status_code, 201)
+
+    def test_unavailable_line_rolls_back_the_whole_order(self):
+        self.add(self.shirt, 'L', 2)
+        self.add(self.socks, 'L', 1)
+        StockReservation.objects.filter(user=self.user).update(expires_at=timezone.now())
+        self.assertEqual(self.guest_checkout(self.socks, 'L', 1).status_code, 201)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Only 0 items available for Socks in size L')
+        self.assertEqual(Order.objects.count(), 1)  # The guest's
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+        self.assertEqual(stock_levels([self.shirt.sizes.get(size='L').id]), {self.shirt.sizes.get(size='L').id: 5})
+
+    def test_carts_sharing_sizes_in_opposite_order_check_out_together(self):
+        shoppers = [self.shopper('first', self.shirt, self.hat), self.shopper('second', self.hat, self.shirt)]
+        start = threading.Barrier(len(shoppers))
+        statuses = []
+
+        def race(user, client):
+            try:
+                start.wait()
+                statuses.append(self.checkout(user, client).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=race, args=shopper) for shopper in shoppers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [201, 201])
+        self.assertEqual(StockMovement.objects.filter(kind='sale').count(), 4)
+
+
+@override_settings(
+    CART_STORAGE_BACKEND='users.cart_storage.KeyValueCartStorage', CART_STORAGE_ALLOW_LOCAL_CACHE=True
+)
+class KeyValueCartTests(CartTestCase):
+    """Records written back to rows explicitly (the background flusher is stubbed out)"""
+
+    def setUp(self):
+        super().setUp()
+        cart_storage._storage = None
+        patcher = mock.patch.object(cart_storage.KeyValueCartStorage, '_schedule_flush')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, cart_storage, '_storage', None)
+        self.storage = cart_storage.get_cart_storage()
+        self.shirt = make_item('Shirt')
+
+    def evict(self):
+        caches['carts'].clear()
+
+    def cart_lines(self):
+        response = self.client.get('/api/cart/')
+        return {line['cart_item_id']: line['quantity'] for line in response.data['items']}
+
+    def test_line_ids_survive_flush_and_eviction(self):
+        line = self.add(self.shirt, 'M', 2)
+        self.storage.flush(self.user.id)
+
+        self.assertEqual(list(CartItem.objects.values_list('id', 'quantity')), [(line, 2)])
+        self.evict()
+
+        response = self.client.put('/api/cart/', {'cart_item_id': line, 'quantity': 3}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.cart_lines(), {line: 3})
+        self.storage.flush(self.user.id)
+        self.assertEqual(list(CartItem.objects.values_list('id', 'quantity')), [(line, 3)])
+
+    def test_line_ids_survive_login_merge(self):
+        line = self.add(self.shirt, 'M', 1)
+        size_l = self.shirt.sizes.get(size='L')
+
+        self.storage.merge_guest_cart(self.user, [{'id': self.shirt.id, 'size_id': size_l.id, 'quantity': 2}])
+
+        lines = self.cart_lines()
+        self.assertEqual(lines[line], 1)
+        self.assertEqual(sorted(lines.values()), [1, 2])
+        self.assertEqual(self.client.delete(f'/api/cart/?cart_item_id={line}').status_code, 200)
+        self.assertEqual(list(self.cart_lines().values()), [2])
+
+    def test_checkout_takes_unflushed_lines_and_empties_cart(self):
+        self.add(self.shirt, 'M', 2)
+        cart_id = Cart.objects.get(user=self.user).id
+
+        response = self.client.post('/api/orders/', {'cart_id': cart_id, **SHIPPING}, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Order.objects.get().orderitem_set.get().quantity, 2)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.cart_lines(), {})
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_warm_cart_traffic_only_writes_reservations(self):
+        self.add(self.shirt, 'M', 1)
+        size_l = self.shirt.sizes.get(size='L')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(
+                '/api/cart/', {'item_id': self.shirt.id, 'size_id': size_l.id, 'quantity': 2}, format='json'
+            )
+        tables = {'stock_reservations', 'sizes', 'stock_movements'}
+        for query in queries:
+            if query['sql'].startswith('SELECT'):
+                self.assertTrue(
+                    'pg_advisory_xact_lock' in query['sql']
+                    or any(f'"{table}"' in query['sql'] for table in tables),
+                    query['sql']
+                )
+        self.assertFalse(any(
+            CartItem._meta.db_table in query['sql'] or 'nextval' in query['sql'] for query in queries
+        ))
+        self.assertEqual(StockReservation.objects.get(user=self.user, size=size_l).quantity, 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted(self.cart_lines().values()), [1, 2])
+
+    def test_patch_serializes_lines_from_the_catalog(self):
+        line = self.add(self.shirt, 'M', 1)
+        size_l = self.shirt.sizes.get(size='L')
+
+        response = self.client.patch('/api/cart/', {'operations': [
+            {'op': 'set', 'cart_item_id': line, 'quantity': 3},
+            {'op': 'add', 'item_id': self.shirt.id, 'size_id': size_l.id, 'quantity': 1},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(
+            [
+                (item['name'], item['size'], item['quantity'], item['total_available'])
+                for item in response.data['items']
+            ],
+            [('Shirt', 'L', 1, 5), ('Shirt', 'M', 3, 5)]
+        )
+
+    def test_cached_stock_levels_follow_sales(self):
+        self.add(self.shirt, 'M', 1)
+        self.assertEqual(self.client.get('/api/cart/').data['items'][0]['total_available'], 5)
+
+        size_m = self.shirt.sizes.get(size='M')
+        response = APIClient().post('/api/guest-checkout/', {
+            'cart': {'items': [{'id': self.shirt.id, 'size_id': size_m.id, 'quantity': 3}]}, **SHIPPING
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get('/api/cart/').data['items'][0]['total_available'], 2)
+
+    def test_unflushed_records_never_expire(self):
+        with mock.patch.object(self.storage.cache, 'set', wraps=self.storage.cache.set) as cache_set:
+            self.add(self.shirt, 'M', 1)
+            self.assertEqual(cache_set.call_args.args[2:], (None,))
+
+            self.storage.flush(self.user.id)
+            self.assertEqual(cache_set.call_args.args[2:], ())
+
+    @override_settings(CART_STORAGE_ALLOW_LOCAL_CACHE=False)
+    def test_refuses_a_per_process_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            cart_storage.KeyValueCartStorage()
+
+    def test_lines_of_deleted_sizes_are_dropped(self):
+        self.add(self.shirt, 'M', 2)
+        line = self.add(self.shirt, 'L', 1)
+        self.shirt.sizes.get(size='M').delete()
+
+        self.assertEqual(self.cart_lines(), {line: 1})
+        self.assertEqual(self.counts(), (1, 1))
+        self.storage.flush(self.user.id)
+        self.assertEqual(list(CartItem.objects.values_list('id', flat=True)), [line])
+
+
+class IdempotentCheckoutTests(TransactionTestCase):
+
+    def setUp(self):
+        self.shirt = make_item('Shirt')
+        self.size = self.shirt.sizes.get(size='M')
+        self.client = APIClient()
+
+    def checkout(self, key):
+        return self.client.post('/api/guest-checkout/', {
+            'cart': {'items': [{'id': self.shirt.id, 'size_id': self.size.id, 'quantity': 1}]},
+            **SHIPPING
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_order(self):
+        first = self.checkout('abc')
+        retry = self.checkout('abc')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['order']['id'], first.data['order']['id'])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_response_is_stored_with_the_order(self):
+        created = views.order_created_response
+        calls = []
+
+        def fail_after_commit(order, order_items):
+            calls.append(order.id)
+            if len(calls) > 1:
+                raise RuntimeError('worker died')
+            return created(order, order_items)
+
+        with mock.patch.object(views, 'order_created_response', side_effect=fail_after_commit):
+            response = self.checkout('abc')
+
+        # The view failed after the checkout committed; the stored response answers
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['order']['id'], calls[0])
+        self.assertEqual(IdempotencyKey.objects.get().status, 'completed')
+        self.assertEqual(self.checkout('abc').data['order']['id'], calls[0])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_checkout_releases_the_key(self):
+        self.size.delete()
+
+        self.assertEqual(self.checkout('abc').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class SalesRollupTests(TransactionTestCase):
+
+    def setUp(self):
+        self.shirt = make_item('Shirt')
+        self.socks = make_item('Socks')
+        self.sale = Category.objects.create(name='sale')
+        ItemCategory.objects.create(item=self.socks, category=self.sale)
+
+    def buy(self, *lines):
+        order, _ = checkout_guest([
+            {'id': item.id, 'size_id': item.sizes.get(size=label).id, 'quantity': quantity}
+            for item, label, quantity in lines
+        ], SHIPPING)
+        return order
+
+    def rollups(self):
+        # Incremental updates leave emptied rows at zero; a rebuild has none
+        return {
+            model.__name__: sorted(model.objects.exclude(order_count=0).values_list(
+                'day', 'status', *fields, 'order_count', 'units', 'revenue'
+            ))
+            for model, fields in (
+                (SalesDaily, ()),
+                (SalesDailyItem, ('item_id', 'size_id', 'item_name', 'size_label')),
+                (SalesDailyCategory, ('category_id', 'category_name')),
+            )
+        }
+
+    def assert_rebuild_agrees(self):
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(self.rollups(), incremental)
+        return incremental
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        first = self.buy((self.shirt, 'M', 2), (self.socks, 'L', 1))
+        self.buy((self.socks, 'M', 3))
+        set_order_status(first, 'Shipped')
+        update_rollups()
+
+        rollups = self.assert_rebuild_agrees()
+        tops = [row for row in rollups['SalesDailyCategory'] if row[3] == 'tops']
+        self.assertEqual([(row[1], row[4], row[5]) for row in tops], [('Pending', 1, 3), ('Shipped', 1, 3)])
+
+    def test_recategorised_item_moves_the_figures_it_added(self):
+        order = self.buy((self.socks, 'M', 2))
+        update_rollups()
+        ItemCategory.objects.filter(item=self.socks, category=self.sale).delete()
+
+        set_order_status(order, 'Shipped')
+        update_rollups()
+
+        sale = SalesDailyCategory.objects.filter(category_id=self.sale.id)
+        self.assertEqual(dict(sale.values_list('status', 'units')), {'Pending': 0, 'Shipped': 2})
+        self.assert_rebuild_agrees()
+
+    def test_deleted_item_still_moves_between_statuses(self):
+        order = self.buy((self.socks, 'M', 2))
+        update_rollups()
+        self.socks.delete()
+
+        set_order_status(order, 'Cancelled')
+        update_rollups()
+
+        categories = SalesDailyCategory.objects.values_list('category_name', 'status', 'units')
+        self.assertEqual(sorted(categories), [
+            ('sale', 'Cancelled', 2), ('sale', 'Pending', 0), ('tops', 'Cancelled', 2), ('tops', 'Pending', 0)
+        ])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('users.circuit_breaker.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+        with self.assertRaises(ValueError):
+            self.breaker.call(self.fail_with, ValueError())
+
+    def fail_with(self, exc):
+        raise exc
+
+    def refused_after(self):
+        with self.assertRaises(CircuitOpen) as refused:
+            self.breaker.call(lambda: None)
+        return refused.exception.retry_after
+
+    def test_open_breaker_reports_remaining_cooldown(self):
+        self.now += 10
+        self.assertEqual(self.refused_after(), 20)
+
+    def test_calls_during_trial_wait_for_its_budget(self):
+        self.now += 30
+        seen = []
+
+        def trial():
+            self.now += 5
+            seen.append(self.refused_after())
+
+        self.breaker.call(trial)
+
+        self.assertEqual(seen, [25])
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_lost_trial_lets_another_through(self):
+        self.now += 30
+        self.breaker._before_call()  # a trial whose thread never reports back
+        self.now += 29
+        self.assertEqual(self.refused_after(), 1)
+
+        self.now += 1
+        self.assertEqual(self.breaker.call(lambda: 'ok'), 'ok')
+
+
+class FailingTransport:
+
+    def __init__(self, error):
+        self.error = error
+
+    def send(self, params):
+        raise self.error
+
+
+class OutboxTests(TransactionTestCase):
+
+    def setUp(self):
+        outbox.LocMemTransport.sent.clear()
+        self.message = outbox.enqueue_email('order_confirmation', {'to': ['shopper@example.com'], 'subject': 'Hi'})
+
+    def refreshed(self):
+        return OutboxMessage.objects.get(id=self.message.id)
+
+    def test_drain_sends_due_messages_once(self):
+        later = outbox.enqueue_email('order_confirmation', {'to': ['later@example.com']})
+        OutboxMessage.objects.filter(id=later.id).update(next_attempt_at=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(outbox.drain(transport=outbox.LocMemTransport()), 1)
+        self.assertEqual(outbox.drain(transport=outbox.LocMemTransport()), 0)
+
+        self.assertEqual(outbox.LocMemTransport.sent, [{'to': ['shopper@example.com'], 'subject': 'Hi'}])
+        self.assertEqual(self.refreshed().status, 'sent')
+        self.assertEqual(OutboxMessage.objects.get(id=later.id).status, 'pending')
+
+    def test_transient_failure_retries_with_backoff(self):
+        outbox.drain(transport=FailingTransport(outbox.TransientEmailError('HTTP 503')))
+
+        message = self.refreshed()
+        self.assertEqual((message.status, message.attempts, message.last_error), ('pending', 1, 'HTTP 503'))
+        self.assertGreater(message.next_attempt_at, timezone.now() + outbox.BACKOFF_BASE / 3)
+
+    def test_last_attempt_dead_letters_and_requeue_revives(self):
+        OutboxMessage.objects.filter(id=self.message.id).update(attempts=outbox.MAX_ATTEMPTS - 1)
+
+        outbox.drain(transport=FailingTransport(outbox.TransientEmailError('timeout')))
+
+        self.assertEqual(self.refreshed().status, 'dead')
+        self.assertEqual(outbox.requeue_dead(), 1)
+        self.assertEqual(outbox.drain(transport=outbox.LocMemTransport()), 1)
+        self.assertEqual(self.refreshed().status, 'sent')
+
+    def test_permanent_failure_dead_letters_at_once(self):
+        outbox.drain(transport=FailingTransport(outbox.PermanentEmailError('HTTP 422')))
+
+        self.assertEqual((self.refreshed().status, self.refreshed().attempts), ('dead', 1))
+
+    def test_open_circuit_defers_without_using_an_attempt(self):
+        outbox.drain(transport=FailingTransport(outbox.CircuitOpen('email provider', 20)))
+
+        message = self.refreshed()
+        self.assertEqual((message.status, message.attempts), ('pending', 0))
+        self.assertGreater(message.next_attempt_at, timezone.now() + timedelta(seconds=15))
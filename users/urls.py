@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import UserView, RegisterView, LoginView, VerifyTokenView, ForgotPasswordView, ResetPasswordView, CartView, CartCountView, OrderView, UserDetailView, ChangePasswordView, UserOrdersView, GuestCheckoutView        
+from .views import UserView, RegisterView, LoginView, VerifyTokenView, ForgotPasswordView, ResetPasswordView, CartView, CartCountView, OrderView, UserDetailView, ChangePasswordView, UserOrdersView, GuestCheckoutView, AdminOrderExportView, AdminSalesView, AdminOrderStatusView
 from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [ 
@@ -16,7 +16,15 @@ urlpatterns = [
     path('user-detail/', UserDetailView.as_view(), name='user_detail'),
     path('change-password/', ChangePasswordView.as_view(), name='change_password'),
     path('user-orders/', UserOrdersView.as_view(), name='user_orders'),
+    path('user-orders/<int:order_id>/', UserOrdersView.as_view(), name='user_order_detail'),
     
     # Guest checkout endpoint
     path('guest-checkout/', GuestCheckoutView.as_view(), name='guest_checkout'),
+    
+    # Admin exports
+    path('admin/orders/export/', AdminOrderExportView.as_view(), name='admin_orders_export'),
+    path('admin/orders/<int:order_id>/status/', AdminOrderStatusView.as_view(), name='admin_order_status'),
+    
+    # Admin analytics
+    path('admin/sales/', AdminSalesView.as_view(), name='admin_sales'),
 ]
\ No newline at end of file
@@ -2,17 +2,29 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth.hashers import make_password, check_password
-from .models import User, PasswordResetToken, Cart, CartItem, Item, ItemSize, Order, OrderItem
+from .models import User, PasswordResetToken, Cart, Order, OrderItem
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.pagination import CursorPagination
 import os
 from datetime import datetime, timedelta
 import secrets
-import resend
 import logging
-from django.db import models
-from decimal import Decimal
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from items.exporter import export_response, EXPORT_FORMATS
+from .exporter import stream_orders
+from .cart import serialize_cart_item, CartOperationError, CartLineNotFound
+from .cart_storage import get_cart_storage
+from .idempotency import idempotent_response
+from .checkout import (
+    checkout_cart, checkout_guest, order_item_summaries, serialize_order, CheckoutError
+)
+from .outbox import enqueue_email
+from .emails import password_reset_email
+from .sales import SALES_GROUPS, sales_report, set_order_status
 
 logger = logging.getLogger(__name__)
 
@@ -150,121 +162,7 @@ class LoginView(APIView):
         Merge guest cart with user's existing cart
         Returns information about the merge operation
         """
-        # Get or create user's cart
-        user_cart, created = Cart.objects.get_or_create(user=user)
-        
-        # Get existing cart items
-        existing_cart_items = CartItem.objects.filter(cart=user_cart).select_related('item', 'size')
-        
-        # Create a lookup dict for existing items (item_id + size_id as key)
-        existing_items_dict = {}
-        for cart_item in existing_cart_items:
-            key = f"{cart_item.item.id}_{cart_item.size.id}"
-            existing_items_dict[key] = cart_item
-        
-        # Process guest cart items
-        merged_items = []
-        added_items = []
-        updated_items = []
-        failed_items = []
-        
-        for guest_item in guest_cart.get('items', []):
-            try:
-                # Validate item and size exist
-                item = Item.objects.get(id=guest_item['id'])
-                size = ItemSize.objects.get(id=guest_item['size_id'])
-                
-                # Check stock availability
-                requested_quantity = guest_item['quantity']
-                if requested_quantity > size.quantity:
-                    failed_items.append({
-                        'item_name': item.name,
-                        'size': size.size,
-                        'requested_quantity': requested_quantity,
-                        'available_quantity': size.quantity,
-                        'reason': 'insufficient_stock'
-                    })
-                    continue
-                
-                key = f"{item.id}_{size.id}"
-                
-                if key in existing_items_dict:
-                    # Item already exists in user cart - merge quantities
-                    existing_cart_item = existing_items_dict[key]
-                    old_quantity = existing_cart_item.quantity
-                    
-                    # Strategy: Sum quantities, but respect stock limits
-                    new_quantity = old_quantity + requested_quantity
-                    
-                    if new_quantity > size.quantity:
-                        # If sum exceeds stock, use maximum available
-                        new_quantity = size.quantity
-                        failed_items.append({
-                            'item_name': item.name,
-                            'size': size.size,
-                            'requested_quantity': requested_quantity,
-                            'existing_quantity': old_quantity,
-                            'final_quantity': new_quantity,
-                            'reason': 'partial_merge_due_to_stock'
-                        })
-                    
-                    existing_cart_item.quantity = new_quantity
-                    existing_cart_item.save()
-                    
-                    updated_items.append({
-                        'item_name': item.name,
-                        'size': size.size,
-                        'old_quantity': old_quantity,
-                        'added_quantity': requested_quantity,
-                        'final_quantity': new_quantity
-                    })
-                    
-                else:
-                    # New item - add to user cart
-                    new_cart_item = CartItem.objects.create(
-                        cart=user_cart,
-                        item=item,
-                        size=size,
-                        quantity=requested_quantity
-                    )
-                    
-                    added_items.append({
-                        'item_name': item.name,
-                        'size': size.size,
-                        'quantity': requested_quantity
-                    })
-                
-                merged_items.append({
-                    'item_id': item.id,
-                    'item_name': item.name,
-                    'size': size.size,
-                    'quantity': requested_quantity
-                })
-                
-            except (Item.DoesNotExist, ItemSize.DoesNotExist):
-                failed_items.append({
-                    'item_id': guest_item.get('id'),
-                    'size_id': guest_item.get('size_id'),
-                    'quantity': guest_item.get('quantity'),
-                    'reason': 'item_not_found'
-                })
-            except Exception as item_error:
-                logger.error(f"Error processing guest cart item: {str(item_error)}")
-                failed_items.append({
-                    'item_id': guest_item.get('id'),
-                    'size_id': guest_item.get('size_id'),
-                    'quantity': guest_item.get('quantity'),
-                    'reason': 'processing_error'
-                })
-        
-        return {
-            'success': True,
-            'total_guest_items': len(guest_cart.get('items', [])),
-            'added_items': added_items,
-            'updated_items': updated_items,
-            'failed_items': failed_items,
-            'message': f"Cart merge completed. Added {len(added_items)} new items, updated {len(updated_items)} existing items."
-        }
+        return get_cart_storage().merge_guest_cart(user, guest_cart.get('items', []))
 
 class VerifyTokenView(APIView):
     permission_classes = [IsAuthenticated]
@@ -315,51 +213,20 @@ class ForgotPasswordView(APIView):
             token = secrets.token_urlsafe(32)
             expires_at = datetime.now() + timedelta(hours=1)  # Token expires in 1 hour
             
-            # Save or update reset token
-            PasswordResetToken.objects.update_or_create(
-                user=user,
-                defaults={
-                    'token': token,
-                    'expires_at': expires_at
-                }
-            )
-            
-            # Send email using Resend
-            api_key = os.getenv('RESEND_API_KEY')
-            if not api_key:
-                logger.error("RESEND_API_KEY is not set in environment variables")
-                return Response(
-                    {"error": "Email service is not configured"}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-            
-            resend.api_key = api_key
-            
             # Get frontend URL from environment variable, default to localhost:3000
             frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:3000')
             reset_url = f"{frontend_url}/reset-password?token={token}"
             
-            try:
-                params = {
-                    "from": "Peter's Shop <no-reply@petershop.shop>",
-                    "to": [email],
-                    "subject": "Reset Your Password",
-                    "html": f"""
-                        <h2>Reset Your Password</h2>
-                        <p>Click the link below to reset your password. This link will expire in 1 hour.</p>
-                        <a href="{reset_url}">Reset Password</a>
-                        <p>If you didn't request this, please ignore this email.</p>
-                    """
-                }
-                
-                email = resend.Emails.send(params)
-                logger.info(f"Password reset email sent to {email}")
-            except Exception as email_error:
-                logger.error(f"Error sending email: {str(email_error)}")
-                return Response(
-                    {"error": "Failed to send reset email"}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            # Save the token and queue the email together; run_outbox_worker sends it
+            with transaction.atomic():
+                PasswordResetToken.objects.update_or_create(
+                    user=user,
+                    defaults={
+                        'token': token,
+                        'expires_at': expires_at
+                    }
                 )
+                enqueue_email('password_reset', password_reset_email(email, reset_url))
             
             return Response({
                 "message": "Password reset link has been sent to your email"
@@ -423,42 +290,14 @@ class CartView(APIView):
     def get(self, request):
         """Get the user's cart items"""
         try:
-            # Get or create cart for the user
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            
-            # Get all cart items with related item and size information
-            cart_items = CartItem.objects.filter(cart=cart).select_related(
-                'item', 'size'
-            ).prefetch_related(
-                'item__images',
-                'item__categories'
-            ).order_by('-created_at')
-            
-            # Format the response
-            items = []
-            for cart_item in cart_items:
-                item = cart_item.item
-                # Get primary image
-                primary_image = item.images.filter(is_primary=True, quality='low').first()
-                
-                # Get all category names and combine them
-                category_names = item.categories.values_list('name', flat=True)
-                combined_categories = ', '.join(category_names) if category_names else None
-                
-                items.append({
-                    'id': item.id,
-                    'cart_item_id': cart_item.id,
-                    'name': item.name,
-                    'price': str(item.price),
-                    'size': cart_item.size.size,
-                    'quantity': cart_item.quantity,
-                    'total_available': cart_item.size.quantity,
-                    'image_url': primary_image.image_url if primary_image else None,
-                    'categories': combined_categories
-                })
+            # Reading the cart never creates one; users without a cart get an empty one
+            cart_id, lines = get_cart_storage().get_cart(request.user)
+            
+            # Lines, primary images and categories in a fixed number of queries
+            items = [serialize_cart_item(cart_item) for cart_item in lines]
             
             return Response({
-                'cart_id': cart.id,
+                'cart_id': cart_id,
                 'items': items,
                 'total_items': len(items)
             }, status=status.HTTP_200_OK)
@@ -479,20 +318,6 @@ class CartView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Get or create cart for the user
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            
-            # Get the item and size
-            try:
-                item = Item.objects.get(id=request.data['item_id'])
-                size = ItemSize.objects.get(id=request.data['size_id'])
-            except (Item.DoesNotExist, ItemSize.DoesNotExist):
-                return Response(
-                    {"error": "Invalid item or size"}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Validate requested quantity against available stock
             requested_quantity = int(request.data['quantity'])
             if requested_quantity <= 0:
                 return Response(
@@ -500,34 +325,26 @@ class CartView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            if requested_quantity > size.quantity:
+            # Add to the existing line, or set its quantity, depending on the add parameter
+            item_id = int(request.data['item_id'])
+            size_id = int(request.data['size_id'])
+            try:
+                cart_id, lines = get_cart_storage().apply(request.user, [{
+                    'op': 'add' if request.data.get('add', False) else 'set',
+                    'item_id': item_id,
+                    'size_id': size_id,
+                    'quantity': requested_quantity
+                }])
+            except CartOperationError as e:
                 return Response(
-                    {"error": f"Only {size.quantity} items available in size {size.size}"}, 
+                    {"error": str(e)}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Check if item already exists in cart
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                item=item,
-                size=size,
-                defaults={'quantity': requested_quantity}
+            cart_item = next(
+                line for line in lines if line.item_id == item_id and line.size_id == size_id
             )
             
-            # If item exists, handle quantity based on add parameter
-            if not created:
-                new_quantity = cart_item.quantity + requested_quantity if request.data.get('add', False) else requested_quantity
-                
-                # Check if new total quantity exceeds available stock
-                if new_quantity > size.quantity:
-                    return Response(
-                        {"error": f"Only {size.quantity} items available in size {size.size}"}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                cart_item.quantity = new_quantity
-                cart_item.save()
-            
             return Response({
                 "message": "Item added to cart successfully",
                 "cart_item": {
@@ -552,27 +369,32 @@ class CartView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Get the cart item
+            # Update quantity (0 removes the line)
+            cart_item_id = int(request.data['cart_item_id'])
             try:
-                cart_item = CartItem.objects.get(
-                    id=request.data['cart_item_id'],
-                    cart__user=request.user
-                )
-            except CartItem.DoesNotExist:
+                cart_id, lines = get_cart_storage().apply(request.user, [{
+                    'op': 'set',
+                    'cart_item_id': cart_item_id,
+                    'quantity': request.data['quantity']
+                }])
+            except CartLineNotFound as e:
                 return Response(
-                    {"error": "Cart item not found"}, 
+                    {"error": str(e)}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
+            except CartOperationError as e:
+                return Response(
+                    {"error": str(e)}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Update quantity
-            cart_item.quantity = int(request.data['quantity'])
-            cart_item.save()
+            cart_item = next((line for line in lines if line.id == cart_item_id), None)
             
             return Response({
                 "message": "Cart item updated successfully",
                 "cart_item": {
-                    "id": cart_item.id,
-                    "quantity": cart_item.quantity
+                    "id": cart_item_id,
+                    "quantity": cart_item.quantity if cart_item else 0
                 }
             }, status=status.HTTP_200_OK)
             
@@ -592,21 +414,18 @@ class CartView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Get the cart item
+            # Delete the cart item
             try:
-                cart_item = CartItem.objects.get(
-                    id=cart_item_id,
-                    cart__user=request.user
-                )
-            except CartItem.DoesNotExist:
+                get_cart_storage().apply(request.user, [{
+                    'op': 'remove',
+                    'cart_item_id': cart_item_id
+                }])
+            except CartLineNotFound as e:
                 return Response(
-                    {"error": "Cart item not found"}, 
+                    {"error": str(e)}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Delete the cart item
-            cart_item.delete()
-            
             return Response({
                 "message": "Item removed from cart successfully"
             }, status=status.HTTP_200_OK)
@@ -616,6 +435,36 @@ class CartView(APIView):
                 {"error": str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+    
+    def patch(self, request):
+        """Apply several add/set/remove operations to the cart in one transaction"""
+        try:
+            storage = get_cart_storage()
+            try:
+                cart_id, lines = storage.apply(request.user, request.data.get('operations'))
+            except CartOperationError as e:
+                return Response(
+                    {"error": str(e), "operation": e.index}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            items = [serialize_cart_item(cart_item) for cart_item in storage.display_lines(lines)]
+            
+            return Response({
+                'cart_id': cart_id,
+                'items': items,
+                'total_items': len(items),
+                'count': {
+                    'total_items': sum(item['quantity'] for item in items),
+                    'total_lines': len(items)
+                }
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            return Response(
+                {"error": str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
 class CartCountView(APIView):
     permission_classes = [IsAuthenticated]
@@ -623,16 +472,12 @@ class CartCountView(APIView):
     def get(self, request):
         """Get the total number of items in the user's cart"""
         try:
-            # Get or create cart for the user
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            
-            # Get total quantity of all items in cart
-            total_items = CartItem.objects.filter(cart=cart).aggregate(
-                total_quantity=models.Sum('quantity')
-            )['total_quantity'] or 0
+            # Maintained counters, served from the cache (no write, no aggregate)
+            counts = get_cart_storage().get_counts(request.user.id)
             
             return Response({
-                'total_items': total_items
+                'total_items': counts['total_quantity'],
+                'total_lines': counts['line_count']
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
@@ -641,12 +486,24 @@ class CartCountView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+def order_created_response(order, order_items):
+    """201 response for a new order (stored as-is for idempotent retries)"""
+    return Response({
+        "message": "Order created successfully",
+        "order": serialize_order(order, order_item_summaries(order_items))
+    }, status=status.HTTP_201_CREATED)
+
 class OrderView(APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser, JSONParser)
     
     def post(self, request):
-        """Create a new order from cart items"""
+        """Create a new order from cart items (retries with the same Idempotency-Key replay the result)"""
+        return idempotent_response(
+            request, f'orders:{request.user.id}', lambda complete: self.create_order(request, complete)
+        )
+    
+    def create_order(self, request, complete):
         try:
             # Get cart_id from request
             cart_id = request.data.get('cart_id')
@@ -656,470 +513,35 @@ class OrderView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Get user's cart
+            shipping = {
+                'shipping_address': request.data.get('shipping_address', ''),
+                'shipping_phone': request.data.get('shipping_phone', '0000000000'),
+                'shipping_email': request.data.get('shipping_email', 'guest@example.com'),
+                'first_name': request.data.get('first_name', ''),
+                'last_name': request.data.get('last_name', ''),
+                'zip_code': request.data.get('zip_code', ''),
+                'city': request.data.get('city', '')
+            }
+            
             try:
-                cart = Cart.objects.get(id=cart_id, user=request.user)
-                cart_items = CartItem.objects.filter(cart=cart).select_related(
-                    'item', 'size'
-                ).prefetch_related(
-                    'item__images'
+                # The response is stored for idempotent retries in the checkout transaction
+                order, order_items = checkout_cart(
+                    request.user, cart_id, shipping,
+                    on_created=lambda order, order_items: complete(order_created_response(order, order_items))
                 )
             except Cart.DoesNotExist:
                 return Response(
                     {"error": "Cart not found"}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
-            
-            if not cart_items.exists():
+            except CheckoutError as e:
                 return Response(
-                    {"error": "Cart is empty"}, 
+                    {"error": str(e)}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Calculate total price
-            total_price = Decimal('0.00')
-            for cart_item in cart_items:
-                total_price += cart_item.item.price * cart_item.quantity
-            
-            # Create order
-            order = Order.objects.create(
-                user=request.user,
-                status='Pending',
-                total_price=total_price,
-                shipping_address=request.data.get('shipping_address', ''),
-                shipping_phone=request.data.get('shipping_phone', '0000000000'),
-                shipping_email=request.data.get('shipping_email', 'guest@example.com'),
-                first_name=request.data.get('first_name', ''),
-                last_name=request.data.get('last_name', ''),
-                zip_code=request.data.get('zip_code', ''),
-                city=request.data.get('city', '')
-            )
-            
-            # Create order items and update stock
-            order_items = []
-            for cart_item in cart_items:
-                # Get primary image
-                primary_image = cart_item.item.images.filter(is_primary=True, quality='low').first()
-                
-                # Create order item
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    item=cart_item.item,
-                    size=cart_item.size,
-                    quantity=cart_item.quantity,
-                    price_at_time=cart_item.item.price,
-                    primary_image=primary_image.image_url if primary_image else None
-                )
-                
-                # Update stock
-                cart_item.size.quantity -= cart_item.quantity
-                cart_item.size.save()
-                
-                order_items.append({
-                    'id': order_item.id,
-                    'item_name': cart_item.item.name,
-                    'size': cart_item.size.size,
-                    'quantity': cart_item.quantity,
-                    'price': str(cart_item.item.price),
-                    'image_url': primary_image.image_url if primary_image else None
-                })
-            
-            # Clear the cart
-            cart_items.delete()
-            
-            # Send order confirmation email
-            try:
-                api_key = os.getenv('RESEND_API_KEY')
-                if api_key:
-                    resend.api_key = api_key
-                    
-                    # Format order items for email
-                    items_html = ""
-                    for item in order_items:
-                        items_html += f"""
-                            <tr>
-                                <td>{item['item_name']}</td>
-                                <td>{item['size']}</td>
-                                <td>{item['quantity']}</td>
-                                <td>${item['price']}</td>
-                            </tr>
-                        """
-                    
-                    params = {
-                        "from": "Peter's Shop <no-reply@petershop.shop>",
-                        "to": [order.shipping_email],
-                        "subject": f"Thank You for Your Order #{order.id}",
-                        "html": f"""
-                            <!DOCTYPE html>
-                            <html lang="en">
-                            <head>
-                                <meta charset="UTF-8">
-                                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                                <title>Order Confirmation</title>
-                                <style>
-                                    /* Reset styles */
-                                    * {{
-                                        margin: 0;
-                                        padding: 0;
-                                        box-sizing: border-box;
-                                    }}
-                                    
-                                    body {{
-                                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-                                        line-height: 1.6;
-                                        color: #333;
-                                        background-color: #f5f5f5;
-                                        margin: 0;
-                                        padding: 0;
-                                    }}
-                                    
-                                    .email-container {{
-                                        max-width: 600px;
-                                        margin: 0 auto;
-                                        background-color: #ffffff;
-                                        padding: 20px;
-                                    }}
-                                    
-                                    .header {{
-                                        text-align: center;
-                                        margin-bottom: 30px;
-                                        padding: 20px 0;
-                                    }}
-                                    
-                                    .header h1 {{
-                                        color: #2c3e50;
-                                        margin-bottom: 10px;
-                                        font-size: 28px;
-                                        font-weight: 700;
-                                    }}
-                                    
-                                    .header p {{
-                                        color: #7f8c8d;
-                                        font-size: 16px;
-                                        margin: 0;
-                                    }}
-                                    
-                                    .payment-section {{
-                                        background-color: #f8f9fa;
-                                        padding: 20px;
-                                        border-radius: 8px;
-                                        margin-bottom: 30px;
-                                        border-left: 4px solid #3498db;
-                                    }}
-                                    
-                                    .payment-section h2 {{
-                                        color: #2c3e50;
-                                        margin-bottom: 15px;
-                                        font-size: 20px;
-                                    }}
-                                    
-                                    .payment-section p {{
-                                        font-size: 16px;
-                                        margin-bottom: 15px;
-                                        line-height: 1.5;
-                                    }}
-                                    
-                                    .email-highlight {{
-                                        background-color: #fff;
-                                        padding: 15px;
-                                        border-radius: 6px;
-                                        margin: 15px 0;
-                                        text-align: center;
-                                        border: 2px solid #3498db;
-                                    }}
-                                    
-                                    .email-highlight p {{
-                                        font-size: 18px;
-                                        font-weight: bold;
-                                        color: #2c3e50;
-                                        margin: 0;
-                                    }}
-                                    
-                                    .order-id-note {{
-                                        color: #2c3e50;
-                                        font-weight: bold;
-                                        background-color: #e8f5e9;
-                                        padding: 12px;
-                                        border-radius: 4px;
-                                        text-align: center;
-                                        margin-top: 15px;
-                                    }}
-                                    
-                                    .order-summary {{
-                                        margin-bottom: 30px;
-                                    }}
-                                    
-                                    .order-summary h3 {{
-                                        color: #2c3e50;
-                                        border-bottom: 2px solid #eee;
-                                        padding-bottom: 10px;
-                                        margin-bottom: 20px;
-                                        font-size: 18px;
-                                    }}
-                                    
-                                    .order-table {{
-                                        width: 100%;
-                                        border-collapse: collapse;
-                                        margin-top: 15px;
-                                        background-color: #fff;
-                                        border-radius: 8px;
-                                        overflow: hidden;
-                                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                                    }}
-                                    
-                                    .order-table th {{
-                                        background-color: #f8f9fa;
-                                        padding: 12px 8px;
-                                        text-align: left;
-                                        border-bottom: 2px solid #ddd;
-                                        font-weight: 600;
-                                        font-size: 14px;
-                                    }}
-                                    
-                                    .order-table td {{
-                                        padding: 12px 8px;
-                                        border-bottom: 1px solid #eee;
-                                        font-size: 14px;
-                                    }}
-                                    
-                                    .order-table .text-center {{
-                                        text-align: center;
-                                    }}
-                                    
-                                    .order-table .text-right {{
-                                        text-align: right;
-                                    }}
-                                    
-                                    .order-table .total-row {{
-                                        background-color: #f8f9fa;
-                                        font-weight: bold;
-                                    }}
-                                    
-                                    .shipping-info {{
-                                        background-color: #f8f9fa;
-                                        padding: 20px;
-                                        border-radius: 8px;
-                                        margin-bottom: 30px;
-                                    }}
-                                    
-                                    .shipping-info h3 {{
-                                        color: #2c3e50;
-                                        margin-bottom: 15px;
-                                        font-size: 18px;
-                                    }}
-                                    
-                                    .shipping-info p {{
-                                        margin: 8px 0;
-                                        font-size: 14px;
-                                        line-height: 1.4;
-                                    }}
-                                    
-                                    .footer {{
-                                        text-align: center;
-                                        margin-top: 30px;
-                                        padding-top: 20px;
-                                        border-top: 1px solid #eee;
-                                    }}
-                                    
-                                    .footer p {{
-                                        color: #7f8c8d;
-                                        margin-bottom: 10px;
-                                        font-size: 14px;
-                                    }}
-                                    
-                                    .footer a {{
-                                        color: #3498db;
-                                        text-decoration: none;
-                                        font-weight: 500;
-                                    }}
-                                    
-                                    /* Mobile Responsive Styles */
-                                    @media only screen and (max-width: 600px) {{
-                                        .email-container {{
-                                            padding: 15px;
-                                            margin: 0;
-                                        }}
-                                        
-                                        .header h1 {{
-                                            font-size: 24px;
-                                        }}
-                                        
-                                        .header p {{
-                                            font-size: 14px;
-                                        }}
-                                        
-                                        .payment-section {{
-                                            padding: 15px;
-                                            margin-bottom: 20px;
-                                        }}
-                                        
-                                        .payment-section h2 {{
-                                            font-size: 18px;
-                                        }}
-                                        
-                                        .payment-section p {{
-                                            font-size: 14px;
-                                        }}
-                                        
-                                        .email-highlight {{
-                                            padding: 12px;
-                                        }}
-                                        
-                                        .email-highlight p {{
-                                            font-size: 16px;
-                                        }}
-                                        
-                                        .order-id-note {{
-                                            padding: 10px;
-                                            font-size: 14px;
-                                        }}
-                                        
-                                        .order-table {{
-                                            font-size: 12px;
-                                        }}
-                                        
-                                        .order-table th,
-                                        .order-table td {{
-                                            padding: 8px 4px;
-                                            font-size: 12px;
-                                        }}
-                                        
-                                        .order-table th:first-child,
-                                        .order-table td:first-child {{
-                                            padding-left: 8px;
-                                        }}
-                                        
-                                        .order-table th:last-child,
-                                        .order-table td:last-child {{
-                                            padding-right: 8px;
-                                        }}
-                                        
-                                        .shipping-info {{
-                                            padding: 15px;
-                                        }}
-                                        
-                                        .shipping-info h3 {{
-                                            font-size: 16px;
-                                        }}
-                                        
-                                        .shipping-info p {{
-                                            font-size: 13px;
-                                        }}
-                                        
-                                        .footer p {{
-                                            font-size: 13px;
-                                        }}
-                                    }}
-                                    
-                                    @media only screen and (max-width: 480px) {{
-                                        .email-container {{
-                                            padding: 10px;
-                                        }}
-                                        
-                                        .header {{
-                                            padding: 15px 0;
-                                            margin-bottom: 20px;
-                                        }}
-                                        
-                                        .header h1 {{
-                                            font-size: 22px;
-                                        }}
-                                        
-                                        .payment-section,
-                                        .shipping-info {{
-                                            padding: 12px;
-                                        }}
-                                        
-                                        .order-table th,
-                                        .order-table td {{
-                                            padding: 6px 3px;
-                                            font-size: 11px;
-                                        }}
-                                        
-                                        .order-summary h3,
-                                        .shipping-info h3 {{
-                                            font-size: 15px;
-                                        }}
-                                    }}
-                                </style>
-                            </head>
-                            <body>
-                                <div class="email-container">
-                                    <div class="header">
-                                        <h1>Thank You for Your Order!</h1>
-                                        <p>We're excited to process your order #{order.id}</p>
-                                    </div>
-
-                                    <div class="payment-section">
-                                        <h2>Next Steps: Complete Your Payment</h2>
-                                        <p>To complete your order, please send payment via E-transfer to:</p>
-                                        <div class="email-highlight">
-                                            <p>lei232lei91@gmail.com</p>
-                                        </div>
-                                        <div class="order-id-note">
-                                            Please include Order ID #{order.id} in the transfer message
-                                        </div>
-                                    </div>
-
-                                    <div class="order-summary">
-                                        <h3>Order Summary</h3>
-                                        <table class="order-table">
-                                            <tr>
-                                                <th>Item</th>
-                                                <th>Size</th>
-                                                <th class="text-center">Qty</th>
-                                                <th class="text-right">Price</th>
-                                            </tr>
-                                            {items_html}
-                                            <tr class="total-row">
-                                                <td colspan="3" class="text-right">Total:</td>
-                                                <td class="text-right">${order.total_price}</td>
-                                            </tr>
-                                        </table>
-                                    </div>
-
-                                    <div class="shipping-info">
-                                        <h3>Shipping Information</h3>
-                                        <p><strong>Name:</strong> {order.first_name} {order.last_name}</p>
-                                        <p><strong>Address:</strong> {order.shipping_address}</p>
-                                        <p><strong>City:</strong> {order.city}</p>
-                                        <p><strong>ZIP Code:</strong> {order.zip_code}</p>
-                                        <p><strong>Phone:</strong> {order.shipping_phone}</p>
-                                    </div>
-
-                                    <div class="footer">
-                                        <p>Questions about your order?</p>
-                                        <a href="mailto:lei23lei91@gmail.com">Contact us at lei23lei91@gmail.com</a>
-                                    </div>
-                                </div>
-                            </body>
-                            </html>
-                        """
-                    }
-                    
-                    email = resend.Emails.send(params)
-                    logger.info(f"Order confirmation email sent to {order.shipping_email}")
-            except Exception as email_error:
-                logger.error(f"Error sending order confirmation email: {str(email_error)}")
-                # Continue with the response even if email fails
-            
-            return Response({
-                "message": "Order created successfully",
-                "order": {
-                    "id": order.id,
-                    "status": order.status,
-                    "total_price": str(order.total_price),
-                    "shipping_address": order.shipping_address,
-                    "shipping_phone": order.shipping_phone,
-                    "shipping_email": order.shipping_email,
-                    "first_name": order.first_name,
-                    "last_name": order.last_name,
-                    "zip_code": order.zip_code,
-                    "city": order.city,
-                    "created_at": order.created_at,
-                    "items": order_items
-                }
-            }, status=status.HTTP_201_CREATED)
+            # The confirmation email was queued with the order (see run_outbox_worker)
+            return order_created_response(order, order_items)
             
         except Exception as e:
             return Response(
@@ -1236,68 +658,135 @@ class ChangePasswordView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+class OrderHistoryPagination(CursorPagination):
+    # A cursor instead of page numbers: every page is one index range scan on
+    # (user, created_at, id), however many orders the customer has placed
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    ordering = ('-created_at', '-id')
+
 class UserOrdersView(APIView):
     permission_classes = [IsAuthenticated]
     
-    def get(self, request):
-        """Get all orders for the authenticated user"""
+    SUMMARY_FIELDS = ('id', 'status', 'total_price', 'created_at')
+    DETAIL_FIELDS = SUMMARY_FIELDS + (
+        'shipping_address', 'shipping_phone', 'shipping_name', 'shipping_email',
+        'first_name', 'last_name', 'zip_code', 'city', 'updated_at'
+    )
+    
+    def get(self, request, order_id=None):
+        """
+        Order history of the authenticated user, newest first and cursor
+        paginated (?cursor=..., ?page_size=). ?view=summary returns only id,
+        status, total, item count and first image per order; the items of a
+        single order come from /user-orders/<order_id>/.
+        """
         try:
-            # Get all orders for the user with related items
-            orders = Order.objects.filter(user=request.user).prefetch_related(
-                'orderitem_set',
-                'orderitem_set__item',
-                'orderitem_set__size'
-            ).order_by('-created_at')
-            
-            orders_data = []
-            for order in orders:
-                # Get all items for this order
-                order_items = []
-                for order_item in order.orderitem_set.all():
-                    order_items.append({
-                        'id': order_item.id,
-                        'item_name': order_item.item.name,
-                        'size': order_item.size.size,
-                        'quantity': order_item.quantity,
-                        'price_at_time': str(order_item.price_at_time),
-                        'primary_image': order_item.primary_image
-                    })
-                
-                # Format order data
-                orders_data.append({
-                    'id': order.id,
-                    'status': order.status,
-                    'total_price': str(order.total_price),
-                    'shipping_address': order.shipping_address,
-                    'shipping_phone': order.shipping_phone,
-                    'shipping_name': order.shipping_name,
-                    'shipping_email': order.shipping_email,
-                    'first_name': order.first_name,
-                    'last_name': order.last_name,
-                    'zip_code': order.zip_code,
-                    'city': order.city,
-                    'created_at': order.created_at,
-                    'updated_at': order.updated_at,
-                    'items': order_items
+            orders = Order.objects.filter(user=request.user)
+            
+            if order_id is not None:
+                order = orders.only(*self.DETAIL_FIELDS).get(id=order_id)
+                order_items = self.order_items_by_order([order.id]).get(order.id, [])
+                return Response(self.serialize_order(order, order_items), status=status.HTTP_200_OK)
+            
+            paginator = OrderHistoryPagination()
+            
+            if request.query_params.get('view') == 'summary':
+                # Item count and first image come from correlated subqueries on
+                # the order_id index, so a page is a single query
+                order_lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by()
+                orders = orders.only(*self.SUMMARY_FIELDS).annotate(
+                    item_count=Coalesce(
+                        Subquery(
+                            order_lines.values('order').annotate(total=Sum('quantity')).values('total'),
+                            output_field=IntegerField()
+                        ),
+                        Value(0)
+                    ),
+                    first_image=Subquery(order_lines.order_by('id').values('primary_image')[:1])
+                )
+                page = paginator.paginate_queryset(orders, request, view=self)
+                return paginator.get_paginated_response({
+                    'orders': [
+                        {
+                            'id': order.id,
+                            'status': order.status,
+                            'total_price': str(order.total_price),
+                            'item_count': order.item_count,
+                            'first_image': order.first_image or None,
+                            'created_at': order.created_at
+                        }
+                        for order in page
+                    ]
                 })
             
-            return Response({
-                'orders': orders_data,
-                'total_orders': len(orders_data)
-            }, status=status.HTTP_200_OK)
+            page = paginator.paginate_queryset(orders.only(*self.DETAIL_FIELDS), request, view=self)
+            order_items = self.order_items_by_order([order.id for order in page])
+            return paginator.get_paginated_response({
+                'orders': [
+                    self.serialize_order(order, order_items.get(order.id, []))
+                    for order in page
+                ]
+            })
             
+        except Order.DoesNotExist:
+            return Response(
+                {"error": "Order not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             return Response(
                 {"error": str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+    
+    def order_items_by_order(self, order_ids):
+        """Serialized items of the given orders, keyed by order id (one query)"""
+        order_items = {}
+        # Name and size label are snapshots on the line itself: no join on items or sizes
+        for order_item in OrderItem.objects.filter(order_id__in=order_ids).only(
+            'order_id', 'quantity', 'price_at_time', 'item_name', 'size_label', 'primary_image'
+        ).order_by('id'):
+            order_items.setdefault(order_item.order_id, []).append({
+                'id': order_item.id,
+                'item_name': order_item.item_name,
+                'size': order_item.size_label,
+                'quantity': order_item.quantity,
+                'price_at_time': str(order_item.price_at_time),
+                'primary_image': order_item.primary_image
+            })
+        return order_items
+    
+    def serialize_order(self, order, order_items):
+        return {
+            'id': order.id,
+            'status': order.status,
+            'total_price': str(order.total_price),
+            'shipping_address': order.shipping_address,
+            'shipping_phone': order.shipping_phone,
+            'shipping_name': order.shipping_name,
+            'shipping_email': order.shipping_email,
+            'first_name': order.first_name,
+            'last_name': order.last_name,
+            'zip_code': order.zip_code,
+            'city': order.city,
+            'created_at': order.created_at,
+            'updated_at': order.updated_at,
+            'items': order_items
+        }
 
 class GuestCheckoutView(APIView):
     permission_classes = []  # Allow public access for guest checkout
     parser_classes = (MultiPartParser, FormParser, JSONParser)
     
     def post(self, request):
-        """Create a new order from guest cart data sent from frontend"""
+        """Create a new order from guest cart data sent from frontend (honours Idempotency-Key)"""
+        return idempotent_response(
+            request, 'guest-checkout', lambda complete: self.create_order(request, complete)
+        )
+    
+    def create_order(self, request, complete):
         try:
             # Get cart data from request - expecting LocalCart structure
             cart_data = request.data.get('cart', {})
@@ -1322,369 +811,148 @@ class GuestCheckoutView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Validate cart items and calculate total
-            cart_items_data = []
-            total_price = Decimal('0.00')
+            shipping = {field: request.data.get(field) for field in required_fields}
+            shipping['guest_email'] = request.data.get('shipping_email')  # Store guest email
             
-            for cart_item in cart_items:
-                try:
-                    # Use 'id' instead of 'item_id' to match your LocalCartItem interface
-                    item = Item.objects.get(id=cart_item['id'])
-                    size = ItemSize.objects.get(id=cart_item['size_id'])
-                    
-                    # Validate stock availability
-                    if cart_item['quantity'] > size.quantity:
-                        return Response(
-                            {"error": f"Only {size.quantity} items available for {item.name} in size {size.size}"}, 
-                            status=status.HTTP_400_BAD_REQUEST
-                        )
-                    
-                    # Calculate item total
-                    item_total = item.price * cart_item['quantity']
-                    total_price += item_total
-                    
-                    cart_items_data.append({
-                        'item': item,
-                        'size': size,
-                        'quantity': cart_item['quantity'],
-                        'price': item.price
-                    })
-                    
-                except (Item.DoesNotExist, ItemSize.DoesNotExist):
-                    return Response(
-                        {"error": "One or more items in cart are no longer available"}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            # Create order
-            order = Order.objects.create(
-                user=None,  # Guest order
-                status='Pending',
-                total_price=total_price,
-                shipping_address=request.data.get('shipping_address'),
-                shipping_phone=request.data.get('shipping_phone'),
-                shipping_email=request.data.get('shipping_email'),
-                first_name=request.data.get('first_name'),
-                last_name=request.data.get('last_name'),
-                zip_code=request.data.get('zip_code'),
-                city=request.data.get('city'),
-                guest_email=request.data.get('shipping_email')  # Store guest email
-            )
-            
-            # Create order items and update stock
-            order_items = []
-            for cart_item_data in cart_items_data:
-                # Get primary image
-                primary_image = cart_item_data['item'].images.filter(is_primary=True, quality='low').first()
-                
-                # Create order item
-                order_item = OrderItem.objects.create(
-                    order=order,
-                    item=cart_item_data['item'],
-                    size=cart_item_data['size'],
-                    quantity=cart_item_data['quantity'],
-                    price_at_time=cart_item_data['price'],
-                    primary_image=primary_image.image_url if primary_image else None
+            try:
+                order, order_items = checkout_guest(
+                    cart_items, shipping,
+                    on_created=lambda order, order_items: complete(order_created_response(order, order_items))
+                )
+            except CheckoutError as e:
+                return Response(
+                    {"error": str(e)}, 
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-                
-                # Update stock
-                cart_item_data['size'].quantity -= cart_item_data['quantity']
-                cart_item_data['size'].save()
-                
-                order_items.append({
-                    'id': order_item.id,
-                    'item_name': cart_item_data['item'].name,
-                    'size': cart_item_data['size'].size,
-                    'quantity': cart_item_data['quantity'],
-                    'price': str(cart_item_data['price']),
-                    'image_url': primary_image.image_url if primary_image else None
-                })
             
-            # Send order confirmation email
-            try:
-                api_key = os.getenv('RESEND_API_KEY')
-                if api_key:
-                    resend.api_key = api_key
-                    
-                    # Format order items for email
-                    items_html = ""
-                    for item in order_items:
-                        items_html += f"""
-                            <tr>
-                                <td>{item['item_name']}</td>
-                                <td>{item['size']}</td>
-                                <td>{item['quantity']}</td>
-                                <td>${item['price']}</td>
-                            </tr>
-                        """
-                    
-                    params = {
-                        "from": "Peter's Shop <no-reply@petershop.shop>",
-                        "to": [order.shipping_email],
-                        "subject": f"Thank You for Your Order #{order.id}",
-                        "html": f"""
-                            <!DOCTYPE html>
-                            <html lang="en">
-                            <head>
-                                <meta charset="UTF-8">
-                                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                                <title>Order Confirmation</title>
-                                <style>
-                                    /* Reset styles */
-                                    * {{
-                                        margin: 0;
-                                        padding: 0;
-                                        box-sizing: border-box;
-                                    }}
-                                    
-                                    body {{
-                                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-                                        line-height: 1.6;
-                                        color: #333;
-                                        background-color: #f5f5f5;
-                                        margin: 0;
-                                        padding: 0;
-                                    }}
-                                    
-                                    .email-container {{
-                                        max-width: 600px;
-                                        margin: 0 auto;
-                                        background-color: #ffffff;
-                                        padding: 20px;
-                                    }}
-                                    
-                                    .header {{
-                                        text-align: center;
-                                        margin-bottom: 30px;
-                                        padding: 20px 0;
-                                    }}
-                                    
-                                    .header h1 {{
-                                        color: #2c3e50;
-                                        margin-bottom: 10px;
-                                        font-size: 28px;
-                                        font-weight: 700;
-                                    }}
-                                    
-                                    .header p {{
-                                        color: #7f8c8d;
-                                        font-size: 16px;
-                                        margin: 0;
-                                    }}
-                                    
-                                    .payment-section {{
-                                        background-color: #f8f9fa;
-                                        padding: 20px;
-                                        border-radius: 8px;
-                                        margin-bottom: 30px;
-                                        border-left: 4px solid #3498db;
-                                    }}
-                                    
-                                    .payment-section h2 {{
-                                        color: #2c3e50;
-                                        margin-bottom: 15px;
-                                        font-size: 20px;
-                                    }}
-                                    
-                                    .payment-section p {{
-                                        font-size: 16px;
-                                        margin-bottom: 15px;
-                                        line-height: 1.5;
-                                    }}
-                                    
-                                    .email-highlight {{
-                                        background-color: #fff;
-                                        padding: 15px;
-                                        border-radius: 6px;
-                                        margin: 15px 0;
-                                        text-align: center;
-                                        border: 2px solid #3498db;
-                                    }}
-                                    
-                                    .email-highlight p {{
-                                        font-size: 18px;
-                                        font-weight: bold;
-                                        color: #2c3e50;
-                                        margin: 0;
-                                    }}
-                                    
-                                    .order-id-note {{
-                                        color: #2c3e50;
-                                        font-weight: bold;
-                                        background-color: #e8f5e9;
-                                        padding: 12px;
-                                        border-radius: 4px;
-                                        text-align: center;
-                                        margin-top: 15px;
-                                    }}
-                                    
-                                    .order-summary {{
-                                        margin-bottom: 30px;
-                                    }}
-                                    
-                                    .order-summary h3 {{
-                                        color: #2c3e50;
-                                        border-bottom: 2px solid #eee;
-                                        padding-bottom: 10px;
-                                        margin-bottom: 20px;
-                                        font-size: 18px;
-                                    }}
-                                    
-                                    .order-table {{
-                                        width: 100%;
-                                        border-collapse: collapse;
-                                        margin-top: 15px;
-                                        background-color: #fff;
-                                        border-radius: 8px;
-                                        overflow: hidden;
-                                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                                    }}
-                                    
-                                    .order-table th {{
-                                        background-color: #f8f9fa;
-                                        padding: 12px 8px;
-                                        text-align: left;
-                                        border-bottom: 2px solid #ddd;
-                                        font-weight: 600;
-                                        font-size: 14px;
-                                    }}
-                                    
-                                    .order-table td {{
-                                        padding: 12px 8px;
-                                        border-bottom: 1px solid #eee;
-                                        font-size: 14px;
-                                    }}
-                                    
-                                    .order-table .text-center {{
-                                        text-align: center;
-                                    }}
-                                    
-                                    .order-table .text-right {{
-                                        text-align: right;
-                                    }}
-                                    
-                                    .order-table .total-row {{
-                                        background-color: #f8f9fa;
-                                        font-weight: bold;
-                                    }}
-                                    
-                                    .shipping-info {{
-                                        background-color: #f8f9fa;
-                                        padding: 20px;
-                                        border-radius: 8px;
-                                        margin-bottom: 30px;
-                                    }}
-                                    
-                                    .shipping-info h3 {{
-                                        color: #2c3e50;
-                                        margin-bottom: 15px;
-                                        font-size: 18px;
-                                    }}
-                                    
-                                    .shipping-info p {{
-                                        margin: 8px 0;
-                                        font-size: 14px;
-                                        line-height: 1.4;
-                                    }}
-                                    
-                                    .footer {{
-                                        text-align: center;
-                                        margin-top: 30px;
-                                        padding-top: 20px;
-                                        border-top: 1px solid #eee;
-                                    }}
-                                    
-                                    .footer p {{
-                                        color: #7f8c8d;
-                                        margin-bottom: 10px;
-                                        font-size: 14px;
-                                    }}
-                                    
-                                    .footer a {{
-                                        color: #3498db;
-                                        text-decoration: none;
-                                        font-weight: 500;
-                                    }}
-                                </style>
-                            </head>
-                            <body>
-                                <div class="email-container">
-                                    <div class="header">
-                                        <h1>Thank You for Your Order!</h1>
-                                        <p>We're excited to process your order #{order.id}</p>
-                                    </div>
+            # The confirmation email was queued with the order (see run_outbox_worker)
+            return order_created_response(order, order_items)
+            
+        except Exception as e:
+            return Response(
+                {"error": str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-                                    <div class="payment-section">
-                                        <h2>Next Steps: Complete Your Payment</h2>
-                                        <p>To complete your order, please send payment via E-transfer to:</p>
-                                        <div class="email-highlight">
-                                            <p>lei232lei91@gmail.com</p>
-                                        </div>
-                                        <div class="order-id-note">
-                                            Please include Order ID #{order.id} in the transfer message
-                                        </div>
-                                    </div>
+class AdminOrderExportView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """
+        Stream orders with their order lines as CSV or JSON lines.
+
+        Optional filters: ?status=, ?from=YYYY-MM-DD, ?to=YYYY-MM-DD.
+        Use ?export_format=csv|jsonl (DRF reserves ?format for renderers).
+        """
+        if not request.user.is_superuser:
+            return Response(
+                {"error": "Only administrators can perform this action"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        fmt = request.query_params.get('export_format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            created_from = request.query_params.get('from')
+            created_to = request.query_params.get('to')
+            filters = {
+                'status': request.query_params.get('status'),
+                'created_from': datetime.strptime(created_from, '%Y-%m-%d').date() if created_from else None,
+                'created_to': datetime.strptime(created_to, '%Y-%m-%d').date() if created_to else None,
+            }
+        except ValueError:
+            return Response(
+                {"error": "Dates must use the YYYY-MM-DD format"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        return export_response(stream_orders(fmt, **filters), fmt, 'orders')
 
-                                    <div class="order-summary">
-                                        <h3>Order Summary</h3>
-                                        <table class="order-table">
-                                            <tr>
-                                                <th>Item</th>
-                                                <th>Size</th>
-                                                <th class="text-center">Qty</th>
-                                                <th class="text-right">Price</th>
-                                            </tr>
-                                            {items_html}
-                                            <tr class="total-row">
-                                                <td colspan="3" class="text-right">Total:</td>
-                                                <td class="text-right">${order.total_price}</td>
-                                            </tr>
-                                        </table>
-                                    </div>
+class AdminSalesView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """
+        Sales analytics from the rollup tables (never the orders themselves).
 
-                                    <div class="shipping-info">
-                                        <h3>Shipping Information</h3>
-                                        <p><strong>Name:</strong> {order.first_name} {order.last_name}</p>
-                                        <p><strong>Address:</strong> {order.shipping_address}</p>
-                                        <p><strong>City:</strong> {order.city}</p>
-                                        <p><strong>ZIP Code:</strong> {order.zip_code}</p>
-                                        <p><strong>Phone:</strong> {order.shipping_phone}</p>
-                                    </div>
+        ?group=day|item|size|category (default day), optional ?from=YYYY-MM-DD,
+        ?to=YYYY-MM-DD, ?status= and ?limit= (top rows by revenue, max 500).
+        Figures lag checkout by however often update_sales_rollups runs.
+        """
+        if not request.user.is_superuser:
+            return Response(
+                {"error": "Only administrators can perform this action"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        group = request.query_params.get('group', 'day')
+        if group not in SALES_GROUPS:
+            return Response(
+                {"error": f"group must be one of: {', '.join(SALES_GROUPS)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            date_from = request.query_params.get('from')
+            date_to = request.query_params.get('to')
+            date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+        except ValueError:
+            return Response(
+                {"error": "Dates must use the YYYY-MM-DD format and limit must be a number"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            report = sales_report(
+                group=group, date_from=date_from, date_to=date_to,
+                status=request.query_params.get('status'), limit=limit
+            )
+            return Response(dict(report, group=group), status=status.HTTP_200_OK)
+        except Exception as e:
+            return Response(
+                {"error": str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-                                    <div class="footer">
-                                        <p>Questions about your order?</p>
-                                        <a href="mailto:lei23lei91@gmail.com">Contact us at lei23lei91@gmail.com</a>
-                                    </div>
-                                </div>
-                            </body>
-                            </html>
-                        """
-                    }
-                    
-                    email = resend.Emails.send(params)
-                    logger.info(f"Guest order confirmation email sent to {order.shipping_email}")
-            except Exception as email_error:
-                logger.error(f"Error sending guest order confirmation email: {str(email_error)}")
-                # Continue with the response even if email fails
-            
+class AdminOrderStatusView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser, JSONParser)
+    
+    def patch(self, request, order_id):
+        """Change an order's status (the sales rollups follow it)"""
+        if not request.user.is_superuser:
+            return Response(
+                {"error": "Only administrators can perform this action"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        new_status = request.data.get('status')
+        valid_statuses = [choice for choice, _ in Order.STATUS_CHOICES]
+        if new_status not in valid_statuses:
+            return Response(
+                {"error": f"status must be one of: {', '.join(valid_statuses)}"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            order = set_order_status(Order.objects.get(id=order_id), new_status)
             return Response({
-                "message": "Order created successfully",
-                "order": {
-                    "id": order.id,
-                    "status": order.status,
-                    "total_price": str(order.total_price),
-                    "shipping_address": order.shipping_address,
-                    "shipping_phone": order.shipping_phone,
-                    "shipping_email": order.shipping_email,
-                    "first_name": order.first_name,
-                    "last_name": order.last_name,
-                    "zip_code": order.zip_code,
-                    "city": order.city,
-                    "created_at": order.created_at,
-                    "items": order_items
-                }
-            }, status=status.HTTP_201_CREATED)
-            
+                "id": order.id,
+                "status": order.status,
+                "updated_at": order.updated_at
+            }, status=status.HTTP_200_OK)
+        except Order.DoesNotExist:
+            return Response(
+                {"error": "Order not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
         except Exception as e:
             return Response(
                 {"error": str(e)}, 